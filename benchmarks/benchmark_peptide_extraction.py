@@ -0,0 +1,104 @@
+"""
+Compare the time and peak memory of the Python string and packed integer
+peptide extraction engines:
+
+- python: extract_peptides, a dict from peptide string to sources
+- packed: extract_peptides_with_packed_encoding, the same dict built from
+  packed keys
+- index: PeptideSourceIndex.from_sequences, the sorted keys and source CSR
+  which msmhc-generate --peptide-extraction-engine packed collapses
+
+Pass --collapse to also time collapsing the extracted peptides into hits,
+which is what msmhc-generate does next with either result.
+
+By default this runs on a synthetic proteome of random proteins, pass
+--genome grch37 to use the reference proteome from an installed pyensembl
+release instead. Each engine runs in its own process so that peak RSS
+measurements don't interfere with each other.
+
+    python benchmarks/benchmark_peptide_extraction.py --num-proteins 20000
+"""
+
+from argparse import ArgumentParser
+from multiprocessing import get_context
+from random import Random
+import resource
+import time
+
+from msmhc.sequence import Sequence
+from msmhc.peptides import (
+    collapse_peptide_sources,
+    extract_peptides,
+    extract_peptides_with_packed_encoding,
+)
+from msmhc.peptide_source_index import PeptideSourceIndex
+
+parser = ArgumentParser()
+parser.add_argument("--num-proteins", type=int, default=5000)
+parser.add_argument("--mean-protein-length", type=int, default=550)
+parser.add_argument("--min-peptide-length", type=int, default=7)
+parser.add_argument("--max-peptide-length", type=int, default=15)
+parser.add_argument("--genome", default=None)
+parser.add_argument("--engines", default="python,packed,index")
+parser.add_argument("--collapse", default=False, action="store_true")
+
+engines = {
+    "python": extract_peptides,
+    "packed": extract_peptides_with_packed_encoding,
+    "index": PeptideSourceIndex.from_sequences,
+}
+
+
+def load_sequences(args):
+    if args.genome:
+        from varcode.reference import genome_for_reference_name
+        from msmhc.main import generate_reference_sequences
+        genome = genome_for_reference_name(args.genome)
+        return generate_reference_sequences(genome)
+    rng = Random(0)
+    letters = "ACDEFGHIKLMNPQRSTVWY"
+    sequences = []
+    for i in range(args.num_proteins):
+        length = max(10, int(rng.expovariate(1.0 / args.mean_protein_length)))
+        amino_acids = "".join(rng.choice(letters) for _ in range(length))
+        sequences.append(Sequence(name="protein-%d" % i, amino_acids=amino_acids))
+    return sequences
+
+
+def run_engine(args, engine_name, queue):
+    sequences = load_sequences(args)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    peptides = engines[engine_name](
+        sequences,
+        min_length=args.min_peptide_length,
+        max_length=args.max_peptide_length)
+    n_peptides = len(peptides)
+    if args.collapse:
+        peptides = collapse_peptide_sources(peptides)
+    elapsed = time.time() - t0
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((n_peptides, elapsed, rss_before, rss_after))
+
+
+def main():
+    args = parser.parse_args()
+    context = get_context("spawn")
+    for engine_name in args.engines.split(","):
+        queue = context.Queue()
+        process = context.Process(
+            target=run_engine,
+            args=(args, engine_name, queue))
+        process.start()
+        n_peptides, elapsed, rss_before, rss_after = queue.get()
+        process.join()
+        print("%-8s %d peptides in %0.2fs, peak RSS %0.1fMB (%0.1fMB after loading)" % (
+            engine_name,
+            n_peptides,
+            elapsed,
+            rss_after / 1024.0,
+            rss_before / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
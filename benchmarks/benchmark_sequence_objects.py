@@ -0,0 +1,100 @@
+"""
+Measure the construction time and memory per object of the Sequence
+records which msmhc keeps in memory by the million (collapsed peptides,
+decoys and alternative reading frames), and the time to write them out
+as FASTA.
+
+    python benchmarks/benchmark_sequence_objects.py --num-objects 200000
+"""
+
+from argparse import ArgumentParser
+import os
+from random import Random
+import time
+import tracemalloc
+
+from msmhc.alt_orf import UpstreamORF
+from msmhc.decoys import Decoy
+from msmhc.output import write_fasta_records
+from msmhc.sequence import Sequence
+
+parser = ArgumentParser()
+parser.add_argument("--num-objects", type=int, default=200000)
+parser.add_argument("--peptide-length", type=int, default=9)
+
+
+def random_peptides(n, length):
+    rng = Random(0)
+    letters = "ACDEFGHIKLMNPQRSTVWY"
+    return ["".join(rng.choice(letters) for _ in range(length)) for _ in range(n)]
+
+
+def make_collapsed_peptides(peptides):
+    # collapsed peptides share their attribute sets with other peptides
+    # from the same sources
+    attributes = {
+        "source": {"reference"},
+        "gene_name": {"TP53"},
+        "gene_id": {"ENSG00000141510"},
+        "transcript_id": {"ENST00000269305", "ENST00000445888"},
+        "transcript_name": {"TP53-001", "TP53-002"},
+    }
+    return [
+        Sequence(
+            name="ReferenceSequence-TP53-%d" % i,
+            amino_acids=peptide,
+            attributes=attributes)
+        for (i, peptide) in enumerate(peptides)
+    ]
+
+
+def make_decoys(peptides):
+    return [Decoy(peptide) for peptide in peptides]
+
+
+def make_alt_orfs(peptides):
+    return [
+        UpstreamORF(
+            original_sequence_name="ref-ENST00000269305",
+            transcript_id="ENST00000269305",
+            transcript_name="TP53-001",
+            gene_id="ENSG00000141510",
+            gene_name="TP53",
+            relative_start=-(i % 300) - 1,
+            amino_acids=peptide,
+            sequence_before_start="GCCACC",
+            start_codon="ATG",
+            sequence_after_start="GCC",
+            ends_with_stop_codon=True)
+        for (i, peptide) in enumerate(peptides)
+    ]
+
+
+def measure(name, make_objects, peptides):
+    tracemalloc.start()
+    t0 = time.time()
+    objects = make_objects(peptides)
+    elapsed = time.time() - t0
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.time()
+    with open(os.devnull, "w") as f:
+        write_fasta_records(objects, f)
+    write_elapsed = time.time() - t0
+    print("%-18s %0.2fus/object to construct, %d bytes/object, %0.2fus/object to write" % (
+        name,
+        1e6 * elapsed / len(objects),
+        allocated // len(objects),
+        1e6 * write_elapsed / len(objects)))
+
+
+def main():
+    args = parser.parse_args()
+    peptides = random_peptides(args.num_objects, args.peptide_length)
+    measure("collapsed peptides", make_collapsed_peptides, peptides)
+    measure("decoys", make_decoys, peptides)
+    measure("upstream ORFs", make_alt_orfs, peptides)
+
+
+if __name__ == "__main__":
+    main()
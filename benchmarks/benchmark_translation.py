@@ -0,0 +1,66 @@
+"""
+Compare the throughput of GeneticCode.translate, one codon at a time, with
+GeneticCode.translate_batch on random cDNA sequences, in codons per second.
+
+Stop codons end translation, so by default the sequences are open reading
+frames without any stop codons, which is the slowest case for translate.
+
+    python benchmarks/benchmark_translation.py --num-sequences 10000
+"""
+
+from argparse import ArgumentParser
+from random import Random
+import time
+
+from msmhc.genetic_code import (
+    standard_genetic_code_with_extra_start_codons,
+    vertebrate_mitochondrial_genetic_code,
+)
+
+parser = ArgumentParser()
+parser.add_argument("--num-sequences", type=int, default=10000)
+parser.add_argument("--mean-length", type=int, default=1500)
+parser.add_argument("--with-stop-codons", default=False, action="store_true")
+
+genetic_codes = [
+    standard_genetic_code_with_extra_start_codons,
+    vertebrate_mitochondrial_genetic_code,
+]
+
+
+def random_cdna_sequences(args, genetic_code):
+    rng = Random(0)
+    codons = sorted(
+        codon
+        for codon in genetic_code.codon_table
+        if args.with_stop_codons or codon not in genetic_code.stop_codons)
+    return [
+        "".join(
+            rng.choice(codons)
+            for _ in range(rng.randint(1, 2 * args.mean_length // 3)))
+        for _ in range(args.num_sequences)
+    ]
+
+
+def main():
+    args = parser.parse_args()
+    for genetic_code in genetic_codes:
+        sequences = random_cdna_sequences(args, genetic_code)
+        n_codons = sum(len(s) // 3 for s in sequences)
+        t0 = time.time()
+        expected = [genetic_code.translate(s, first_codon_is_start=True) for s in sequences]
+        translate_elapsed = time.time() - t0
+        t0 = time.time()
+        results = genetic_code.translate_batch(sequences, first_codon_is_start=True)
+        batch_elapsed = time.time() - t0
+        assert results == expected
+        print("%s: %d codons, translate %0.2fM codons/s, translate_batch %0.2fM codons/s (%0.1fx)" % (
+            genetic_code.name,
+            n_codons,
+            n_codons / translate_elapsed / 1e6,
+            n_codons / batch_elapsed / 1e6,
+            translate_elapsed / batch_elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,20 @@
 # limitations under the License.
 
 
-from .genetic_code import translate_cdna
+from bisect import bisect_right
+import re
+
+import numpy as np
+
+from .genetic_code import standard_genetic_code_with_extra_start_codons
 from .sequence import Sequence
 from .reference_sequence import ReferenceSequence
-from .kozak import translation_initiation_score, ALT_START_CODONS
+from .transcript_record import genomic_position, transcript_exon_intervals
+from .kozak import (
+    ALT_START_CODONS,
+    translation_initiation_score as _translation_initiation_score,
+    translation_initiation_scores,
+)
 
 class AltORF(Sequence):
     """
@@ -46,7 +56,8 @@ class AltORF(Sequence):
             sequence_before_start,
             start_codon,
             sequence_after_start,
-            ends_with_stop_codon):
+            ends_with_stop_codon,
+            translation_initiation_score=None):
         assert len(amino_acids) > 0
         assert len(start_codon) == 3
         assert len(sequence_before_start) <= 6
@@ -64,10 +75,12 @@ class AltORF(Sequence):
         self.start_codon = start_codon
         self.sequence_after_start = sequence_after_start
         self.ends_with_stop_codon = ends_with_stop_codon
-        self.translation_initiation_score = translation_initiation_score(
-            self.sequence_before_start,
-            self.start_codon,
-            self.sequence_after_start)
+        if translation_initiation_score is None:
+            translation_initiation_score = _translation_initiation_score(
+                self.sequence_before_start,
+                self.start_codon,
+                self.sequence_after_start)
+        self.translation_initiation_score = translation_initiation_score
         is_upstream = relative_start < 0
 
         if is_upstream:
@@ -83,21 +96,24 @@ class AltORF(Sequence):
         Sequence.__init__(
             self,
             name=name,
-            amino_acids=amino_acids,
-            attributes={
-                "source": "upstream-orf" if is_upstream else "downstream-orf",
-                "relative_start": str(self.relative_start),
-                "original_sequence_name": self.original_sequence_name,
-                "gene_name": self.gene_name,
-                "gene_id": self.gene_id,
-                "transcript_name": self.transcript_name,
-                "transcript_id": self.transcript_id,
-                "sequence_before_start": self.sequence_before_start,
-                "sequence_after_start": self.sequence_after_start,
-                "start_codon": self.start_codon,
-                "translation_initiation_score": self.translation_initiation_score,
-                "ends_with_stop_codon": self.ends_with_stop_codon,
-            })
+            amino_acids=amino_acids)
+
+    def base_attributes(self):
+        # built from the slots rather than stored a second time
+        return {
+            "source": "upstream-orf" if self.relative_start < 0 else "downstream-orf",
+            "relative_start": str(self.relative_start),
+            "original_sequence_name": self.original_sequence_name,
+            "gene_name": self.gene_name,
+            "gene_id": self.gene_id,
+            "transcript_name": self.transcript_name,
+            "transcript_id": self.transcript_id,
+            "sequence_before_start": self.sequence_before_start,
+            "sequence_after_start": self.sequence_after_start,
+            "start_codon": self.start_codon,
+            "translation_initiation_score": self.translation_initiation_score,
+            "ends_with_stop_codon": self.ends_with_stop_codon,
+        }
 
 
 class DownstreamORF(AltORF):
@@ -109,13 +125,145 @@ class UpstreamORF(AltORF):
 
 START_CODONS = {"ATG"}.union(ALT_START_CODONS)
 
+# compiled search patterns by set of start codons
+_start_codon_patterns = {}
+
+
+def start_codon_pattern(start_codons=("ATG",)):
+    """
+    Compiled regular expression which matches at every position where one
+    of the given start codons begins, including overlapping matches.
+    """
+    start_codons = frozenset(start_codons)
+    if start_codons not in _start_codon_patterns:
+        unknown = start_codons.difference(START_CODONS)
+        if unknown:
+            raise ValueError(
+                "Unsupported start codons %s, expected some of %s" % (
+                    sorted(unknown),
+                    sorted(START_CODONS)))
+        # zero width lookahead so that overlapping codons are all found
+        _start_codon_patterns[start_codons] = re.compile(
+            "(?=(%s))" % "|".join(sorted(start_codons)))
+    return _start_codon_patterns[start_codons]
+
+
+class ThreeFrameTranslation(object):
+    """
+    Translation of all three reading frames of a cDNA sequence along with
+    the positions of their stop codons, so that the protein starting at
+    any codon can be sliced out instead of translated again.
+    """
+    __slots__ = [
+        "frames",
+        "stop_positions",
+    ]
+
+    def __init__(self, cdna_sequence, genetic_code=standard_genetic_code_with_extra_start_codons):
+        self.frames = [
+            genetic_code.translate_codons(cdna_sequence, frame)
+            for frame in range(3)
+        ]
+        self.stop_positions = [
+            np.flatnonzero(
+                np.frombuffer(frame_amino_acids.encode("ascii"), dtype=np.uint8) == ord("*")
+            ).tolist()
+            for frame_amino_acids in self.frames
+        ]
+
+    def translate_from(self, start, first_amino_acid="M"):
+        """
+        Same result as translate_cdna(cdna_sequence[start:], first_codon_is_start=True)
+        for a start codon at the given nucleotide position.
+
+        Returns
+        -------
+        Amino acids up to the next stop codon and whether there was one
+        """
+        frame = start % 3
+        first_codon = start // 3
+        frame_amino_acids = self.frames[frame]
+        stop_positions = self.stop_positions[frame]
+        i = bisect_right(stop_positions, first_codon)
+        if i < len(stop_positions):
+            end = stop_positions[i]
+            ends_with_stop_codon = True
+        else:
+            end = len(frame_amino_acids)
+            ends_with_stop_codon = False
+        amino_acids = frame_amino_acids[first_codon + 1:end]
+        if "?" in amino_acids:
+            # same error as translating the unknown codon directly
+            raise KeyError("Unknown codon in reading frame starting at %d" % start)
+        return first_amino_acid + amino_acids, ends_with_stop_codon
+
+
+class ReadingFrameMemo(object):
+    """
+    Translations of alternative reading frames keyed by the genomic
+    position of their start codon, so that isoforms which share the
+    exons of an ORF translate it only once. Only the reading frames of the
+    most recent gene are kept.
+    """
+    __slots__ = [
+        "gene_id",
+        "reading_frames",
+        "n_translated",
+        "n_reused",
+    ]
+
+    def __init__(self):
+        self.gene_id = None
+        self.reading_frames = {}
+        self.n_translated = 0
+        self.n_reused = 0
+
+    def start_gene(self, gene_id):
+        if gene_id != self.gene_id:
+            self.gene_id = gene_id
+            self.reading_frames.clear()
+
+    def get(self, key, cdna_sequence, start):
+        """
+        Amino acids and stop codon flag of a reading frame translated from
+        another transcript, if its nucleotides up to the stop codon (or the
+        end of the transcript) are the same in this one.
+        """
+        for orf_cdna, amino_acids, ends_with_stop_codon in self.reading_frames.get(key, ()):
+            if cdna_sequence.startswith(orf_cdna, start) and (
+                    ends_with_stop_codon or
+                    len(cdna_sequence) - start - len(orf_cdna) < 3):
+                self.n_reused += 1
+                return amino_acids, ends_with_stop_codon
+        return None
+
+    def add(self, key, cdna_sequence, start, amino_acids, ends_with_stop_codon):
+        self.n_translated += 1
+        n_codons = len(amino_acids) + ends_with_stop_codon
+        orf_cdna = cdna_sequence[start:start + 3 * n_codons]
+        self.reading_frames.setdefault(key, []).append(
+            (orf_cdna, amino_acids, ends_with_stop_codon))
+
+    def __str__(self):
+        return "ReadingFrameMemo(n_translated=%d, n_reused=%d)" % (
+            self.n_translated,
+            self.n_reused)
+
+    def __repr__(self):
+        return str(self)
+
+
 def generate_alt_reading_frames(
         sequence_obj,
         min_peptide_length=7,
         search_start_offset=None,
         search_end_offset=None,
         kozak_length_before_start_codon=6,
-        kozak_length_after_start_codon=3):
+        kozak_length_after_start_codon=3,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        translation=None,
+        memo=None):
     """
     Parameters
     ----------
@@ -135,6 +283,23 @@ def generate_alt_reading_frames(
 
     kozak_length_after_start_codon : int
 
+    start_codons : collection of str
+        Codons to start translation from, ATG and any of the near-cognate
+        ALT_START_CODONS. Every start codon is translated to methionine.
+
+    min_translation_initiation_score : float
+        Skip start codons whose kozak.translation_initiation_score is lower,
+        without translating them
+
+    translation : ThreeFrameTranslation or None
+        Translation of the transcript's cDNA, pass one in to share it between
+        searches of the same transcript.
+
+    memo : ReadingFrameMemo or None
+        Reuse the translations of start codons at the same genomic position
+        in other isoforms of the gene. Transcripts without exon coordinates
+        are always translated.
+
     Returns
     -------
     list of AltORF
@@ -161,11 +326,35 @@ def generate_alt_reading_frames(
     else:
         end = start_codon_offset + search_end_offset
 
-    for i in range(start, end):
+    if memo is not None:
+        exon_intervals = transcript_exon_intervals(transcript)
+        if exon_intervals:
+            memo.start_gene(original_gene_id)
+            contig = transcript.contig
+            strand = transcript.strand
+        else:
+            memo = None
+
+    # scores of every position in the search window along with its Kozak
+    # context, computed once there's a candidate start codon
+    scores = None
+    scores_start = max(0, start - kozak_length_before_start_codon)
+    # a codon starting before the end of the search may extend past it
+    for match in start_codon_pattern(start_codons).finditer(
+            cdna_sequence, max(0, start), max(0, end + 2)):
+        i = match.start()
         if i == 0:
             # skip the original reading frame
             continue
-        first_codon = cdna_sequence[i:i + 3]
+        if scores is None:
+            scores = translation_initiation_scores(
+                cdna_sequence[scores_start:end + 2 + kozak_length_after_start_codon],
+                length_before_start_codon=kozak_length_before_start_codon,
+                length_after_start_codon=kozak_length_after_start_codon).tolist()
+        score = scores[i - scores_start]
+        if score < min_translation_initiation_score:
+            continue
+        first_codon = match.group(1)
         relative_start = i - start_codon_offset
         if relative_start < 0:
             result_class = UpstreamORF
@@ -175,23 +364,34 @@ def generate_alt_reading_frames(
         sequence_before_start_codon = cdna_sequence[
             max(0, i - kozak_length_before_start_codon):i]
         second_codon = cdna_sequence[i + 3:i + 3 + kozak_length_after_start_codon]
-        if first_codon == "ATG":
-            cds = cdna_sequence[i:]
-            amino_acids, ends_with_stop_codon = translate_cdna(
-                cdna_sequence=cds,
-                first_codon_is_start=True)
-            n_aa = len(amino_acids)
-            if n_aa >= min_peptide_length:
-                results.append(result_class(
-                    relative_start=relative_start,
-                    amino_acids=amino_acids,
-                    original_sequence_name=original_sequence_name,
-                    transcript_id=original_transcript_id,
-                    transcript_name=original_transcript_name,
-                    gene_id=original_gene_id,
-                    gene_name=original_gene_name,
-                    sequence_before_start=sequence_before_start_codon,
-                    start_codon=first_codon,
-                    sequence_after_start=second_codon,
-                    ends_with_stop_codon=ends_with_stop_codon))
+        translated = None
+        position = None
+        if memo is not None:
+            position = genomic_position(exon_intervals, strand, i)
+        if position is not None:
+            key = (contig, strand, position)
+            translated = memo.get(key, cdna_sequence, i)
+        if translated is None:
+            if translation is None:
+                # only translate transcripts which have a candidate start codon
+                translation = ThreeFrameTranslation(cdna_sequence)
+            translated = translation.translate_from(i)
+            if position is not None:
+                memo.add(key, cdna_sequence, i, *translated)
+        amino_acids, ends_with_stop_codon = translated
+        n_aa = len(amino_acids)
+        if n_aa >= min_peptide_length:
+            results.append(result_class(
+                relative_start=relative_start,
+                amino_acids=amino_acids,
+                original_sequence_name=original_sequence_name,
+                transcript_id=original_transcript_id,
+                transcript_name=original_transcript_name,
+                gene_id=original_gene_id,
+                gene_name=original_gene_name,
+                sequence_before_start=sequence_before_start_codon,
+                start_codon=first_codon,
+                sequence_after_start=second_codon,
+                ends_with_stop_codon=ends_with_stop_codon,
+                translation_initiation_score=score))
     return results
@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Write the FASTA files of many samples in a pool of worker processes, each
+merging one sample's mutant peptides into the collapsed reference peptides
+of a reference cache, which the workers memory-map and share.
+"""
+
+import multiprocessing
+import os
+
+from .collapsed_peptides import CollapsedPeptides
+from .main import generate_mutant_sequences
+from .reference_cache import write_hits_with_reference_peptides
+
+# collapsed reference peptides of each worker process, memory-mapped from
+# the reference cache so that the workers share their pages
+_reference_peptides = None
+
+
+def _load_reference_peptides(path):
+    global _reference_peptides
+    _reference_peptides = CollapsedPeptides.load(path)
+
+
+def _generate_sample(
+        sample,
+        variants_path,
+        load_variants,
+        genome,
+        output_path,
+        min_length,
+        max_length,
+        n_decoys_per_hit,
+        random_seed,
+        decoy_strategy):
+    # runs in a worker process
+    variants = load_variants(variants_path, genome)
+    print("Sample %s: generating sequences from %d variants" % (sample, len(variants)))
+    mutant_sequences = generate_mutant_sequences(
+        variants,
+        max_peptide_length=max_length)
+    temp_path = "%s.tmp-%d" % (output_path, os.getpid())
+    with open(temp_path, "w") as f:
+        n_hits, n_decoys = write_hits_with_reference_peptides(
+            _reference_peptides,
+            mutant_sequences,
+            f,
+            min_length=min_length,
+            max_length=max_length,
+            n_decoys_per_hit=n_decoys_per_hit,
+            random_seed=random_seed,
+            decoy_strategy=decoy_strategy)
+    os.rename(temp_path, output_path)
+    return sample, len(variants), n_hits, n_decoys
+
+
+def _generate_sample_from_task(task):
+    return _generate_sample(*task)
+
+
+def generate_sample_databases(
+        samples,
+        reference_path,
+        output_dir,
+        genome,
+        load_variants,
+        min_length=7,
+        max_length=20,
+        n_decoys_per_hit=1,
+        random_seed=0,
+        decoy_strategy="shuffle",
+        n_processes=1):
+    """
+    Write a '<sample>.fa' file of hits and decoys for every sample, each
+    renamed into place once it's complete.
+
+    Parameters
+    ----------
+    samples : list of (str, str) pairs
+        Sample name and the path of its variant file
+
+    reference_path : str
+        Collapsed reference peptides saved by CollapsedPeptides.save, such
+        as those of msmhc.reference_cache.load_or_build_reference_peptides
+        with the same min_length and max_length
+
+    output_dir : str
+
+    genome : pyensembl.Genome
+        Genome the variants are loaded with, pickled for every worker
+
+    load_variants : callable
+        Called with a variant file path and genome in a worker process,
+        returns a varcode.VariantCollection. Has to be picklable, such as a
+        module-level function.
+
+    min_length : int
+
+    max_length : int
+
+    n_decoys_per_hit : int
+
+    random_seed : int
+
+    decoy_strategy : str
+
+    n_processes : int
+        Number of spawned worker processes, each generating one sample at a
+        time
+
+    Returns
+    -------
+    List of the sample name, number of variants, number of hits and number
+    of decoys of every sample, in the order the samples finished
+    """
+    # workers are spawned and get a pickled copy of the genome, which opens
+    # its own pyensembl database
+    tasks = [
+        (
+            sample,
+            variants_path,
+            load_variants,
+            genome,
+            os.path.join(output_dir, "%s.fa" % sample),
+            min_length,
+            max_length,
+            n_decoys_per_hit,
+            random_seed,
+            decoy_strategy,
+        )
+        for (sample, variants_path) in samples
+    ]
+    n_processes = max(1, min(n_processes, len(tasks)))
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(
+            n_processes,
+            initializer=_load_reference_peptides,
+            initargs=(reference_path,)) as pool:
+        for sample, n_variants, n_hits, n_decoys in pool.imap_unordered(
+                _generate_sample_from_task, tasks):
+            print("Sample %s: wrote %d hits and %d decoys from %d variants" % (
+                sample,
+                n_hits,
+                n_decoys,
+                n_variants))
+            results.append((sample, n_variants, n_hits, n_decoys))
+    return results
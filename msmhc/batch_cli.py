@@ -0,0 +1,210 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generate the databases of many samples which share one genome: the
+reference and reading frame peptides are collapsed once into the
+memory-mapped reference cache, then a pool of worker processes each
+merge one sample's mutant peptides into them and write its FASTA file,
+see msmhc.batch.
+"""
+
+from argparse import ArgumentParser
+import os
+import sys
+
+from . import __version__
+from .batch import generate_sample_databases
+from .generate_cli import add_decoy_args, add_sources_to_argument_parser
+from .reference_cache import (
+    load_or_build_reference_peptides,
+    reference_cache_path,
+)
+from .transcript_snapshot import TranscriptSnapshot
+
+from pyensembl import EnsemblRelease
+from varcode import load_maf, load_vcf
+from varcode.reference import genome_for_reference_name
+
+
+def create_argument_parser():
+    parser = ArgumentParser(
+        "msmhc-generate-batch",
+        description=(
+            "Write a FASTA file of hits and decoys for every sample in a "
+            "manifest, sharing one reference peptide index between them"))
+    parser.add_argument(
+        "--manifest",
+        required=True,
+        help=(
+            "Tab separated file with a sample name and the path of its VCF "
+            "or MAF file on each line, lines starting with '#' are skipped"))
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        help="Directory for the '<sample>.fa' file of each sample")
+    parser.add_argument(
+        "--genome",
+        default=None,
+        help=(
+            "Reference genome name or Ensembl release of all samples "
+            "(default: the genome of --transcript-snapshot, otherwise "
+            "grch37)"))
+    add_sources_to_argument_parser(parser)
+    peptide_group = parser.add_argument_group("Peptides")
+    peptide_group.add_argument(
+        "--min-peptide-length",
+        default=7,
+        type=int,
+        help="Shortest peptide to include in output")
+    peptide_group.add_argument(
+        "--max-peptide-length",
+        default=15,
+        type=int,
+        help="Longest peptide to include in output")
+    peptide_group.add_argument(
+        "--reference-cache-dir",
+        default=None,
+        help=(
+            "Directory for the collapsed reference peptides, see "
+            "msmhc-generate --reference-cache-dir (default: a "
+            "'reference-cache' directory inside --output-dir)"))
+    peptide_group.add_argument(
+        "--processes",
+        default=1,
+        type=int,
+        help=(
+            "Number of worker processes, each generating one sample at a "
+            "time. Also used for building the reference peptides."))
+    add_decoy_args(parser)
+    return parser
+
+
+parser = create_argument_parser()
+
+
+def read_manifest(path):
+    """
+    Returns
+    -------
+    List of pairs of sample name and variant file path, relative paths
+    are taken relative to the manifest's directory
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    samples = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) != 2:
+                raise ValueError(
+                    "Expected a sample name and a variant file on line %d of %s" % (
+                        line_number,
+                        path))
+            sample, variants_path = fields
+            samples.append((sample, os.path.join(manifest_dir, variants_path)))
+    sample_names = [sample for (sample, _) in samples]
+    if len(set(sample_names)) != len(sample_names):
+        raise ValueError("Sample names in %s aren't unique" % path)
+    return samples
+
+
+def variant_genome(args, reference_genome):
+    """
+    Genome which the samples' variants are loaded and annotated with, the
+    one the reference peptides came from. A transcript snapshot stands in
+    for the genome it was exported from, so --genome may only name that
+    genome.
+    """
+    if not isinstance(reference_genome, TranscriptSnapshot):
+        return reference_genome
+    if reference_genome.reference_name is None:
+        if args.genome is None:
+            parser.error(
+                "Transcript snapshot %s doesn't record its genome, give it "
+                "with --genome" % reference_genome.path)
+        return genome_for_reference_name(args.genome)
+    if args.genome is not None:
+        reference_name = genome_for_reference_name(args.genome).reference_name
+        if reference_name != reference_genome.reference_name:
+            parser.error(
+                "--genome %s doesn't match the genome %s of transcript "
+                "snapshot %s" % (
+                    args.genome,
+                    reference_genome.reference_name,
+                    reference_genome.path))
+    if isinstance(reference_genome.release, int):
+        return EnsemblRelease.cached(
+            release=reference_genome.release,
+            species=reference_genome.species)
+    return genome_for_reference_name(reference_genome.reference_name)
+
+
+def load_variants(variants_path, genome):
+    if variants_path.endswith(".maf"):
+        return load_maf(variants_path)
+    return load_vcf(variants_path, genome=genome)
+
+
+def run(args_list=None):
+    if args_list is None:
+        args_list = sys.argv[1:]
+    args = parser.parse_args(args_list)
+    print("MS-MHC version %s" % __version__)
+    samples = read_manifest(args.manifest)
+    print("Generating databases for %d samples" % len(samples))
+    if args.transcript_snapshot:
+        reference_genome = TranscriptSnapshot(args.transcript_snapshot)
+    else:
+        reference_genome = genome_for_reference_name(args.genome or "grch37")
+    print("Using reference genome %s" % reference_genome)
+    genome = variant_genome(args, reference_genome)
+    if genome is not reference_genome:
+        print("Loading variants with genome %s" % genome)
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    cache_dir = args.reference_cache_dir
+    if cache_dir is None:
+        cache_dir = os.path.join(args.output_dir, "reference-cache")
+    reference_options = dict(
+        upstream_reading_frames=args.upstream_reading_frames,
+        downstream_reading_frames=args.downstream_reading_frames,
+        skip_exons=args.skip_exons,
+        restrict_sources_to_gene_name=args.gene_name,
+        min_length=args.min_peptide_length,
+        max_length=args.max_peptide_length,
+        start_codons=args.start_codons,
+        min_translation_initiation_score=args.min_translation_initiation_score)
+    reference_peptides = load_or_build_reference_peptides(
+        cache_dir,
+        reference_genome,
+        n_processes=args.processes,
+        **reference_options)
+    print("Loaded %d reference peptides" % len(reference_peptides))
+    del reference_peptides
+    reference_path = reference_cache_path(cache_dir, reference_genome, **reference_options)
+
+    generate_sample_databases(
+        samples,
+        reference_path,
+        args.output_dir,
+        genome,
+        load_variants,
+        min_length=args.min_peptide_length,
+        max_length=args.max_peptide_length,
+        n_decoys_per_hit=args.num_decoys_per_hit,
+        random_seed=args.random_seed,
+        decoy_strategy=args.decoy_strategy,
+        n_processes=args.processes)
+    print("Done.")
@@ -0,0 +1,411 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import Counter
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .common import convert_to_string
+from .packed_peptides import searchsorted_keys, unpack_keys
+from .peptides import (
+    class_priority_list,
+    combine_source_attributes,
+    keep_max_priority_sequences,
+    peptide_name_group,
+    sequence_type_priority_key_function,
+)
+from .sequence import Sequence
+
+
+def _attribute_table_key(attributes):
+    return tuple(sorted(
+        (k, frozenset(v)) for (k, v) in attributes.items()))
+
+
+def _json_value(value):
+    """
+    Attribute value as it's kept in a saved table: JSON scalars keep their
+    type so that they're formatted exactly as before saving, anything
+    else is stored as its FASTA string.
+    """
+    if value is None or type(value) in (str, bool, int, float):
+        return value
+    return convert_to_string(value)
+
+
+class AttributeTable(object):
+    """
+    Distinct attribute dictionaries of collapsed peptides, each mapping
+    field to a set of values.
+
+    A saved table is dictionary-encoded in the same way as the attribute
+    sets of msmhc.peptide_database, but with values stored as JSON rather
+    than as their FASTA strings: distinct values which print the same
+    (e.g. two close translation initiation scores) have to stay distinct
+    for a loaded table to give the same FASTA as the one which was saved.
+    Loaded entries are memory-mapped and decoded each time they're
+    looked up, entries added afterwards (e.g. by merging in a sample's
+    peptides) are kept as dictionaries after them.
+    """
+    __slots__ = [
+        "fields",
+        "values",
+        "offsets",
+        "field_ids",
+        "value_ids",
+        "entries",
+    ]
+
+    def __init__(
+            self,
+            entries=(),
+            fields=(),
+            values=(),
+            offsets=None,
+            field_ids=None,
+            value_ids=None):
+        self.fields = fields
+        self.values = values
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.field_ids = field_ids
+        self.value_ids = value_ids
+        self.entries = list(entries)
+
+    @property
+    def n_encoded(self):
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return self.n_encoded + len(self.entries)
+
+    def __getitem__(self, i):
+        n_encoded = self.n_encoded
+        if i >= n_encoded:
+            return self.entries[i - n_encoded]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        attributes = {}
+        for field_id, value_id in zip(
+                self.field_ids[start:end].tolist(),
+                self.value_ids[start:end].tolist()):
+            attributes.setdefault(self.fields[field_id], set()).add(
+                self.values[value_id])
+        return attributes
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def extended(self, entries):
+        """
+        New table with the given attribute dictionaries after these ones,
+        sharing the encoded entries.
+        """
+        return AttributeTable(
+            entries=self.entries + list(entries),
+            fields=self.fields,
+            values=self.values,
+            offsets=self.offsets,
+            field_ids=self.field_ids,
+            value_ids=self.value_ids)
+
+    def save(self, path):
+        """
+        Write the encoded table into an existing directory.
+        """
+        fields = {}
+        values = {}
+        offsets = [0]
+        field_ids = []
+        value_ids = []
+        for attributes in self:
+            for field, field_values in sorted(attributes.items()):
+                field_id = fields.setdefault(field, len(fields))
+                for value in sorted(map(_json_value, field_values), key=repr):
+                    field_ids.append(field_id)
+                    # keyed on the type too, since 1 == 1.0 == True
+                    value_ids.append(values.setdefault(
+                        (type(value), value), len(values)))
+            offsets.append(len(field_ids))
+        np.save(
+            os.path.join(path, "attribute_offsets.npy"),
+            np.array(offsets, dtype=np.int64))
+        np.save(
+            os.path.join(path, "attribute_field_ids.npy"),
+            np.array(field_ids, dtype=np.int32))
+        np.save(
+            os.path.join(path, "attribute_value_ids.npy"),
+            np.array(value_ids, dtype=np.int32))
+        with open(os.path.join(path, "attributes.json"), "w") as f:
+            json.dump({
+                "fields": sorted(fields, key=fields.get),
+                "values": [value for (_, value) in sorted(values, key=values.get)],
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "attributes.json")) as f:
+            dictionaries = json.load(f)
+        return cls(
+            fields=dictionaries["fields"],
+            values=dictionaries["values"],
+            offsets=np.load(
+                os.path.join(path, "attribute_offsets.npy"), mmap_mode="r"),
+            field_ids=np.load(
+                os.path.join(path, "attribute_field_ids.npy"), mmap_mode="r"),
+            value_ids=np.load(
+                os.path.join(path, "attribute_value_ids.npy"), mmap_mode="r"))
+
+
+class CollapsedPeptides(object):
+    """
+    Peptides whose sources have already been collapsed, without names.
+
+    Each peptide (a sorted packed key, see msmhc.packed_peptides) has the
+    index of its source type in msmhc.peptides.class_priority_list and
+    the index of its combined attributes in an AttributeTable of distinct
+    attribute dictionaries. Names depend on every other peptide in the
+    output, so they're only assigned by iter_sequences.
+    """
+    __slots__ = [
+        "keys",
+        "type_ids",
+        "attribute_ids",
+        "attribute_table",
+    ]
+
+    def __init__(self, keys, type_ids, attribute_ids, attribute_table):
+        self.keys = keys
+        self.type_ids = type_ids
+        self.attribute_ids = attribute_ids
+        self.attribute_table = attribute_table
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Collapse the sources of every peptide in a packed PeptideSourceIndex.
+        """
+        index = keep_max_priority_sequences(index)
+        type_ids = np.empty(len(index), dtype=np.int8)
+        attribute_ids = np.empty(len(index), dtype=np.int32)
+        attribute_table = []
+        table_positions = {}
+        # many peptides come from exactly the same sources, so only combine
+        # the attributes of each distinct group of sources once
+        collapsed_groups = {}
+        for i, group_key in enumerate(index.source_group_keys()):
+            collapsed = collapsed_groups.get(group_key)
+            if collapsed is None:
+                sources = index.source_group(group_key)
+                attributes = combine_source_attributes(sources)
+                table_key = _attribute_table_key(attributes)
+                if table_key not in table_positions:
+                    table_positions[table_key] = len(attribute_table)
+                    attribute_table.append(dict(attributes))
+                # the sources of a peptide all have its highest priority type
+                collapsed = (
+                    -sequence_type_priority_key_function(type(sources[0])),
+                    table_positions[table_key])
+                collapsed_groups[group_key] = collapsed
+            type_ids[i], attribute_ids[i] = collapsed
+        return cls(index.keys, type_ids, attribute_ids, AttributeTable(attribute_table))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def merge(self, other):
+        """
+        Combine with the collapsed peptides of other sources, following the
+        same priority rules as collapsing all of their sources together: a
+        peptide in both keeps the record of its higher priority source type,
+        or the union of both records' attributes if the types are equal.
+
+        Returns
+        -------
+        CollapsedPeptides
+        """
+        if len(other) == 0:
+            return self
+        if len(self) == 0:
+            return other
+        (merged,) = self.iter_merged(other, chunk_size=len(self) + len(other))
+        return merged
+
+    def iter_merged(self, other, chunk_size=2 ** 16):
+        """
+        Same peptides as merge, yielded as consecutive chunks of chunk_size
+        peptides which share one AttributeTable. Only a chunk of this
+        object's arrays is read at a time, so merging a small collection
+        into a memory-mapped one never copies the whole of it.
+
+        Returns
+        -------
+        Generator of CollapsedPeptides
+        """
+        n_self_attributes = len(self.attribute_table)
+        other_attribute_ids = other.attribute_ids.astype(np.int64) + n_self_attributes
+        positions = searchsorted_keys(self.keys, other.keys)
+        found = positions < len(self)
+        found[found] = (
+            np.asarray(self.keys[positions[found]]) == other.keys[found]).all(axis=1)
+
+        # records of peptides in both, at their positions in this object
+        found_positions = positions[found]
+        found_type_ids = np.array(self.type_ids[found_positions])
+        found_attribute_ids = np.array(
+            self.attribute_ids[found_positions], dtype=np.int64)
+        other_types = other.type_ids[found]
+        other_ids = other_attribute_ids[found]
+        replace = other_types < found_type_ids
+        found_type_ids[replace] = other_types[replace]
+        found_attribute_ids[replace] = other_ids[replace]
+        tie = other_types == found_type_ids
+        tie &= ~replace
+        n_attributes = n_self_attributes + len(other.attribute_table)
+        combined_entries = []
+        for i, other_id in zip(np.flatnonzero(tie), other_ids[tie]):
+            combined = {}
+            for attributes in (
+                    self.attribute_table[found_attribute_ids[i]],
+                    other.attribute_table[other_id - n_self_attributes]):
+                for k, v in attributes.items():
+                    combined.setdefault(k, set()).update(v)
+            found_attribute_ids[i] = n_attributes + len(combined_entries)
+            combined_entries.append(combined)
+        attribute_table = self.attribute_table.extended(
+            list(other.attribute_table) + combined_entries)
+        attribute_id_dtype = np.int32 if len(attribute_table) < 2 ** 31 else np.int64
+
+        # the new peptides are sorted, so the i-th of them goes before the
+        # peptide of this object at its searchsorted position and ends up i
+        # places further along in the merged peptides
+        new = ~found
+        new_keys = other.keys[new]
+        new_type_ids = other.type_ids[new]
+        new_attribute_ids = other_attribute_ids[new]
+        new_positions = positions[new] + np.arange(len(new_keys))
+        n_merged = len(self) + len(new_keys)
+        for chunk_start in range(0, n_merged, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, n_merged)
+            new_start, new_end = np.searchsorted(new_positions, [chunk_start, chunk_end])
+            self_start = chunk_start - new_start
+            self_end = chunk_end - new_end
+            is_new = np.zeros(chunk_end - chunk_start, dtype=bool)
+            is_new[new_positions[new_start:new_end] - chunk_start] = True
+            keys = np.empty((len(is_new), self.keys.shape[1]), dtype=self.keys.dtype)
+            keys[is_new] = new_keys[new_start:new_end]
+            keys[~is_new] = self.keys[self_start:self_end]
+            type_ids = np.empty(len(is_new), dtype=self.type_ids.dtype)
+            type_ids[is_new] = new_type_ids[new_start:new_end]
+            attribute_ids = np.empty(len(is_new), dtype=np.int64)
+            attribute_ids[is_new] = new_attribute_ids[new_start:new_end]
+
+            self_type_ids = np.array(self.type_ids[self_start:self_end])
+            self_attribute_ids = np.array(
+                self.attribute_ids[self_start:self_end], dtype=np.int64)
+            found_start, found_end = np.searchsorted(
+                found_positions, [self_start, self_end])
+            rows = found_positions[found_start:found_end] - self_start
+            self_type_ids[rows] = found_type_ids[found_start:found_end]
+            self_attribute_ids[rows] = found_attribute_ids[found_start:found_end]
+            type_ids[~is_new] = self_type_ids
+            attribute_ids[~is_new] = self_attribute_ids
+            yield CollapsedPeptides(
+                keys,
+                type_ids,
+                attribute_ids.astype(attribute_id_dtype),
+                attribute_table)
+
+    def iter_sequences(self, name_group_counts=None, chunk_size=2 ** 16):
+        """
+        Yield a named Sequence for each peptide, in sorted order, named the
+        same way as msmhc.peptides.iter_collapsed_peptide_sources.
+        """
+        if name_group_counts is None:
+            name_group_counts = Counter()
+        name_groups = {}
+        for chunk_start in range(0, len(self), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(self))
+            peptides = unpack_keys(self.keys[chunk_start:chunk_end])
+            type_ids = self.type_ids[chunk_start:chunk_end].tolist()
+            attribute_ids = self.attribute_ids[chunk_start:chunk_end].tolist()
+            # peptides of a chunk with the same attributes share one
+            # dictionary, without keeping every decoded entry alive
+            chunk_attributes = {}
+            for peptide, type_id, attribute_id in zip(
+                    peptides, type_ids, attribute_ids):
+                attributes = chunk_attributes.get(attribute_id)
+                if attributes is None:
+                    attributes = self.attribute_table[attribute_id]
+                    chunk_attributes[attribute_id] = attributes
+                group_key = (type_id, attribute_id)
+                if group_key not in name_groups:
+                    name_groups[group_key] = peptide_name_group(
+                        class_priority_list[type_id].__name__,
+                        attributes)
+                name_group = name_groups[group_key]
+                name_group_counts[name_group] += 1
+                yield Sequence(
+                    name="%s-%d" % (name_group, name_group_counts[name_group]),
+                    amino_acids=peptide,
+                    attributes=attributes)
+
+    def save(self, path):
+        """
+        Write to a new directory, which is only renamed into place once
+        complete so that readers never see a partial result.
+
+        Returns
+        -------
+        False if another process saved to the same path first, in which
+        case its result is kept and this one is discarded, otherwise True
+        """
+        temp_path = "%s.tmp-%d" % (path, os.getpid())
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, "keys.npy"), np.asarray(self.keys))
+        np.save(os.path.join(temp_path, "type_ids.npy"), np.asarray(self.type_ids))
+        np.save(
+            os.path.join(temp_path, "attribute_ids.npy"),
+            np.asarray(self.attribute_ids))
+        self.attribute_table.save(temp_path)
+        with open(os.path.join(temp_path, "types.json"), "w") as f:
+            json.dump([t.__name__ for t in class_priority_list], f)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+            shutil.rmtree(temp_path)
+            return False
+        return True
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read collapsed peptides written by save, memory-mapping the arrays.
+        """
+        with open(os.path.join(path, "types.json")) as f:
+            saved_type_names = json.load(f)
+        current_type_ids = {
+            t.__name__: i for (i, t) in enumerate(class_priority_list)
+        }
+        # source types are saved by name in case the priority order changed
+        type_id_map = np.array(
+            [current_type_ids[name] for name in saved_type_names],
+            dtype=np.int8)
+        return cls(
+            np.load(os.path.join(path, "keys.npy"), mmap_mode="r"),
+            type_id_map[np.load(os.path.join(path, "type_ids.npy"))],
+            np.load(os.path.join(path, "attribute_ids.npy"), mmap_mode="r"),
+            AttributeTable.load(path))
@@ -14,12 +14,40 @@ def convert_to_string(v):
     t = type(v)
     if t == bool:
         return "1" if v else "0"
-    elif t in (tuple, list, set):
+    elif t in (tuple, list):
         elt_strings = map(convert_to_string, v)
         return ";".join(elt_strings)
+    elif t in (set, frozenset):
+        # sets have no order of their own, sort them so that output doesn't
+        # depend on string hashing (which differs between processes)
+        elt_strings = sorted(map(convert_to_string, v))
+        return ";".join(elt_strings)
     elif t == float:
         return "%0.2f" % v
     else:
         return str(v)
 
 
+_memory_size_suffixes = {
+    "": 1,
+    "K": 2 ** 10,
+    "M": 2 ** 20,
+    "G": 2 ** 30,
+    "T": 2 ** 40,
+}
+
+def parse_memory_size(s):
+    """
+    Parse a human readable memory size such as "8G" or "512M" into a
+    number of bytes.
+    """
+    s = s.strip().upper()
+    if s.endswith("B"):
+        s = s[:-1]
+    suffix = s[-1:] if s[-1:] in _memory_size_suffixes else ""
+    number = s[:len(s) - len(suffix)]
+    try:
+        value = float(number)
+    except ValueError:
+        raise ValueError("Invalid memory size '%s'" % (s,))
+    return int(value * _memory_size_suffixes[suffix])
@@ -10,29 +10,81 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from progressbar import progressbar
-from random import shuffle, seed
+from functools import partial
+from itertools import islice
+import multiprocessing
 
+import numpy as np
+
+from .packed_peptides import (
+    isin_keys,
+    key_boundaries,
+    lexsort_keys,
+    pack_codes,
+    pack_peptides,
+    packed_lengths,
+    unpack_codes,
+    unpack_keys,
+)
 from .sequence import Sequence
 
-class Decoy(Sequence):
-    decoy_counter = 0
+# shared by all decoys, Sequence doesn't copy its attributes
+_decoy_attributes = {"source": "decoy"}
+
+# "reverse" reverses each hit, "pseudo-reverse" reverses all but its
+# C-terminal residue, which is kept as the anchor residue of MHC ligands
+DECOY_STRATEGIES = ("shuffle", "reverse", "pseudo-reverse")
 
-    def __init__(self, amino_acids):
-        Decoy.decoy_counter += 1
-        name = "Decoy-%d" % (Decoy.decoy_counter,)
+class Decoy(Sequence):
+    def __init__(self, amino_acids, name):
         Sequence.__init__(
             self,
             name=name,
             amino_acids=amino_acids,
-            attributes={"source": "decoy"})
+            attributes=_decoy_attributes)
+
+
+class DecoySequences(object):
+    """
+    Decoys stored as packed keys, which are only turned into Decoy
+    objects when iterated over or indexed. They're numbered consecutively
+    from first_number, so every pass over them gives the same names.
+    """
+    __slots__ = [
+        "keys",
+        "first_number",
+    ]
+
+    def __init__(self, keys, first_number=1):
+        self.keys = keys
+        self.first_number = first_number
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Decoy index out of range")
+        amino_acids = unpack_keys(self.keys[i:i + 1])[0]
+        return Decoy(amino_acids, name="Decoy-%d" % (self.first_number + i))
+
+    def __iter__(self, chunk_size=2 ** 16):
+        for chunk_start in range(0, len(self), chunk_size):
+            peptides = unpack_keys(self.keys[chunk_start:chunk_start + chunk_size])
+            for i, amino_acids in enumerate(peptides, self.first_number + chunk_start):
+                yield Decoy(amino_acids, name="Decoy-%d" % i)
 
 
 def generate_decoys(
         sequences,
         n_decoys=None,
         max_scrambling_attempts_per_decoy=3,
-        random_seed=0):
+        random_seed=0,
+        first_decoy_number=1,
+        n_processes=1,
+        strategy="shuffle"):
     """
     Parameters
     ----------
@@ -48,43 +100,464 @@ def generate_decoys(
     random_seed : int
         Initial random seed to make scrambling determinstic
 
+    first_decoy_number : int
+        Number in the name of the first decoy, the rest are numbered
+        consecutively after it.
+
+    n_processes : int
+        Number of worker processes to scramble hits in, doesn't change
+        which decoys are generated.
 
-    Returns list of Decoy
+    strategy : str
+        One of DECOY_STRATEGIES. With "reverse" or "pseudo-reverse" the
+        first decoy of each hit is its reversal, unless that's also a hit
+        in which case it's scrambled instead, and any further decoys are
+        scrambled.
+
+    Returns DecoySequences
     -------
 
     """
-    if n_decoys <= 0:
-        return []
+    return generate_decoys_from_peptides(
+        [s.amino_acids for s in sequences],
+        n_decoys=n_decoys,
+        max_scrambling_attempts_per_decoy=max_scrambling_attempts_per_decoy,
+        random_seed=random_seed,
+        first_decoy_number=first_decoy_number,
+        n_processes=n_processes,
+        strategy=strategy)
+
+
+def generate_decoys_from_peptides(
+        peptides,
+        n_decoys=None,
+        max_scrambling_attempts_per_decoy=3,
+        random_seed=0,
+        first_decoy_number=1,
+        n_processes=1,
+        chunk_size=2 ** 16,
+        strategy="shuffle"):
+    """
+    Same as generate_decoys but takes the amino acid strings of the hits,
+    so that the hits themselves don't have to be kept in memory.
+
+    The distinct hits are packed and sorted, then split into chunks of
+    chunk_size which are turned into decoys by iter_decoy_keys.
+
+    Parameters
+    ----------
+    peptides : list of str
+
+    n_decoys : int
+        Number of decoys to generate, if None then make one for each hit.
+
+    max_scrambling_attempts_per_decoy : int
+        Number of times to try to scramble a sequence before giving up if all
+        scrambled results were already in the hit sequences.
+
+    random_seed : int
+        Initial random seed to make scrambling determinstic
+
+    first_decoy_number : int
 
-    seed(random_seed)
-    real_peptide_set = {s.amino_acids for s in sequences}
-    real_peptide_list = list(real_peptide_set)
-    shuffle(real_peptide_list)
-    n_hits = len(real_peptide_list)
-    decoys = []
-    print("Generating decoy sequences by scrambling...")
+    n_processes : int
+
+    chunk_size : int
+        Number of hits in each chunk, changing it changes the decoys.
+
+    strategy : str
+        One of DECOY_STRATEGIES
+
+    Returns DecoySequences
+    -------
+
+    """
+    keys = pack_peptides(peptides)
+    # sorted distinct hits, which are also what decoys are checked against
+    keys = keys[lexsort_keys(keys)]
+    target_keys = keys[key_boundaries(keys)]
+    del keys
     if n_decoys is None:
-        n_decoys = len(real_peptide_list)
+        n_decoys = len(target_keys)
+    print("Generating %d decoy sequences from %d peptides..." % (
+        n_decoys,
+        len(target_keys)))
+    decoy_keys = _concatenate_keys(
+        (
+            decoys.keys
+            for decoys in iter_decoys_of_keys(
+                target_keys,
+                n_decoys=n_decoys,
+                max_scrambling_attempts_per_decoy=max_scrambling_attempts_per_decoy,
+                random_seed=random_seed,
+                n_processes=n_processes,
+                chunk_size=chunk_size,
+                strategy=strategy)
+        ),
+        target_keys.shape[1])
+    print("Generated %d decoy sequences" % len(decoy_keys))
+    return DecoySequences(decoy_keys, first_decoy_number)
 
-    outer_iter = 0
-    while len(decoys) < n_decoys:
-        outer_iter += 1
-        expected_iters = n_decoys / n_hits
 
-        if outer_iter > 100 * expected_iters:
-            print("Warning: failed to generate sufficient decoys")
+def iter_decoys_of_keys(
+        hit_keys,
+        n_decoys=None,
+        max_scrambling_attempts_per_decoy=3,
+        random_seed=0,
+        first_decoy_number=1,
+        n_processes=1,
+        chunk_size=2 ** 16,
+        strategy="shuffle"):
+    """
+    Make decoys of hits given as sorted distinct packed keys, which may be
+    memory-mapped (e.g. from msmhc.output.load_hit_keys), yielding the
+    decoys of each chunk of hits as soon as they're made so that neither
+    the hits nor the decoys have to be held in memory. The decoys are the
+    same as from generate_decoys_from_peptides for the same hits.
 
-        for peptide in progressbar(real_peptide_list):
-            if len(decoys) >= n_decoys:
-                break
-            list_of_amino_acids = list(peptide)
-            for attempt in range(max_scrambling_attempts_per_decoy):
-                shuffle(list_of_amino_acids)
-                scrambled = "".join(list_of_amino_acids)
-                if scrambled not in real_peptide_set:
-                    decoys.append(Decoy(amino_acids=scrambled))
-                    break
+    Parameters
+    ----------
+    hit_keys : 2d array of uint64
+
+    n_decoys : int
+        Number of decoys to generate, if None then make one for each hit.
 
-    print("Generated %d decoy sequences" % len(decoys))
+    max_scrambling_attempts_per_decoy : int
 
-    return decoys
\ No newline at end of file
+    random_seed : int
+
+    first_decoy_number : int
+
+    n_processes : int
+
+    chunk_size : int
+
+    strategy : str
+        One of DECOY_STRATEGIES
+
+    Returns
+    -------
+    Generator of DecoySequences, numbered consecutively
+    """
+    if n_decoys is None:
+        n_decoys = len(hit_keys)
+    return iter_numbered_decoys(
+        iter_decoy_keys(
+            partial(iter_key_chunks, hit_keys, chunk_size),
+            hit_keys,
+            n_decoys,
+            max_scrambling_attempts_per_decoy=max_scrambling_attempts_per_decoy,
+            random_seed=random_seed,
+            strategy=strategy,
+            n_processes=n_processes),
+        first_decoy_number)
+
+
+def iter_numbered_decoys(decoy_key_chunks, first_decoy_number=1):
+    """
+    DecoySequences of each array of packed decoy keys (e.g. from
+    iter_decoy_keys), numbered consecutively across all of them.
+    """
+    decoy_number = first_decoy_number
+    for decoy_keys in decoy_key_chunks:
+        yield DecoySequences(decoy_keys, decoy_number)
+        decoy_number += len(decoy_keys)
+
+
+def generate_decoys_avoiding_keys(
+        peptides,
+        target_keys,
+        n_decoys_per_peptide=1,
+        max_scrambling_attempts_per_decoy=3,
+        random_seed=0,
+        first_decoy_number=1,
+        strategy="shuffle"):
+    """
+    Make decoys for some of the hits, checked against the packed keys of
+    all of them. Unlike generate_decoys_from_peptides, the targets are
+    given as sorted packed keys (see msmhc.packed_peptides), which may be
+    memory-mapped, so decoys can be made for a stream of hits without
+    holding all of them in memory.
+
+    Parameters
+    ----------
+    peptides : list of str
+
+    target_keys : 2d array of uint64
+        Sorted packed keys of all target peptides
+
+    n_decoys_per_peptide : int
+
+    max_scrambling_attempts_per_decoy : int
+        Number of times to try to scramble a peptide before giving up on
+        that decoy.
+
+    random_seed : int or tuple of int
+        Give each group of a stream of hits its own seed, e.g. the overall
+        seed and the group's index, so that groups don't get the same
+        scrambles.
+
+    first_decoy_number : int
+        Number in the name of the first decoy, the rest are numbered
+        consecutively after it.
+
+    strategy : str
+        One of DECOY_STRATEGIES
+
+    Returns DecoySequences
+    """
+    keys = pack_peptides(peptides, n_words=target_keys.shape[1])
+    decoy_keys = _concatenate_keys(
+        iter_decoy_keys(
+            partial(iter_key_chunks, keys),
+            target_keys,
+            len(keys) * n_decoys_per_peptide,
+            max_scrambling_attempts_per_decoy=max_scrambling_attempts_per_decoy,
+            random_seed=random_seed,
+            strategy=strategy),
+        target_keys.shape[1])
+    return DecoySequences(decoy_keys, first_decoy_number)
+
+
+def iter_key_chunks(keys, chunk_size=2 ** 16):
+    """
+    Consecutive chunks of an array of packed keys, which may be
+    memory-mapped.
+    """
+    for chunk_start in range(0, len(keys), chunk_size):
+        yield np.asarray(keys[chunk_start:chunk_start + chunk_size])
+
+
+def _concatenate_keys(key_chunks, n_words):
+    key_chunks = list(key_chunks)
+    if not key_chunks:
+        return np.zeros((0, n_words), dtype=np.uint64)
+    return np.concatenate(key_chunks)
+
+
+def iter_decoy_keys(
+        make_hit_key_chunks,
+        target_keys,
+        n_decoys,
+        max_scrambling_attempts_per_decoy=3,
+        random_seed=0,
+        strategy="shuffle",
+        n_processes=1):
+    """
+    Make decoys from chunks of packed hit keys, yielding the packed keys
+    of each chunk's decoys as soon as they're made, n_decoys in total
+    unless too few hits can be scrambled.
+
+    Each pass over the chunks makes at most one decoy per hit and passes
+    are repeated until there are enough decoys, or a pass makes none. On
+    the first pass, the reversal strategies reverse every hit and only
+    scramble the hits whose reversals are targets, otherwise hits are
+    scrambled. Every chunk is scrambled with its own
+    numpy.random.Generator, seeded from random_seed and the number of
+    chunks before it, so the decoys are the same whether chunks are
+    scrambled in one process or in n_processes worker processes.
+
+    Parameters
+    ----------
+    make_hit_key_chunks : callable
+        Returns a new iterator over arrays of packed hit keys, with the same
+        chunks every time
+
+    target_keys : 2d array of uint64 or list of them
+        Sorted packed keys which decoys mustn't be, which may be
+        memory-mapped. Worker processes reopen memory-mapped arrays
+        instead of receiving a copy.
+
+    n_decoys : int
+
+    max_scrambling_attempts_per_decoy : int
+
+    random_seed : int or tuple of int
+
+    strategy : str
+        One of DECOY_STRATEGIES
+
+    n_processes : int
+    """
+    if strategy not in DECOY_STRATEGIES:
+        raise ValueError("Unknown decoy strategy: %s" % (strategy,))
+    if isinstance(target_keys, np.ndarray):
+        target_keys = [target_keys]
+    if not isinstance(random_seed, tuple):
+        random_seed = (random_seed,)
+    decoy_args = (
+        target_keys,
+        max_scrambling_attempts_per_decoy,
+        tuple(random_seed),
+        strategy)
+    pool = None
+    if n_processes > 1:
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(
+            n_processes,
+            initializer=_set_decoy_args,
+            initargs=(
+                [_shared_keys(keys) for keys in target_keys],
+            ) + decoy_args[1:])
+    n_generated = 0
+    n_chunks_per_pass = None
+    pass_index = 0
+    try:
+        while n_generated < n_decoys:
+            tasks = (
+                (pass_index, pass_index * (n_chunks_per_pass or 0) + i, keys)
+                for (i, keys) in enumerate(make_hit_key_chunks()))
+            if pool is None:
+                results = (_decoy_keys_of_chunk(task, *decoy_args) for task in tasks)
+            else:
+                results = _imap_in_windows(
+                    pool,
+                    _decoy_keys_of_chunk_in_worker,
+                    tasks,
+                    window_size=2 * n_processes)
+            n_chunks = 0
+            n_generated_in_pass = 0
+            for chunk_decoy_keys in results:
+                n_chunks += 1
+                chunk_decoy_keys = chunk_decoy_keys[:n_decoys - n_generated]
+                n_generated += len(chunk_decoy_keys)
+                n_generated_in_pass += len(chunk_decoy_keys)
+                yield chunk_decoy_keys
+                if n_generated >= n_decoys:
+                    return
+            if n_generated_in_pass == 0:
+                print("Warning: failed to generate sufficient decoys")
+                return
+            n_chunks_per_pass = n_chunks
+            pass_index += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _imap_in_windows(pool, function, tasks, window_size):
+    # Pool.imap would read every task up front, so only hand it a few
+    # chunks at a time
+    tasks = iter(tasks)
+    while True:
+        window = list(islice(tasks, window_size))
+        if not window:
+            return
+        for result in pool.imap(function, window):
+            yield result
+
+
+def _shared_keys(keys):
+    """
+    Memory-mapped arrays are passed to worker processes as their file
+    and reopened, everything else is pickled.
+    """
+    if isinstance(keys, np.memmap) and keys.filename is not None:
+        return (keys.filename, keys.offset, keys.dtype.str, keys.shape)
+    return np.asarray(keys)
+
+
+def _unshared_keys(shared):
+    if isinstance(shared, tuple):
+        filename, offset, dtype, shape = shared
+        return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return shared
+
+
+def _decoy_keys_of_chunk(task, target_keys, max_attempts, random_seed, strategy):
+    """
+    Packed keys of the decoys of one chunk of hits, in the order of the
+    hits, leaving out hits which couldn't be turned into a decoy.
+    """
+    pass_index, chunk_index, keys = task
+    lengths = packed_lengths(keys)
+    rng = np.random.default_rng(list(random_seed) + [chunk_index])
+    if pass_index == 0 and strategy != "shuffle":
+        decoy_keys = _reverse_keys(
+            keys,
+            lengths,
+            keep_last_residue=(strategy == "pseudo-reverse"))
+        # scramble the hits whose reversals are targets instead
+        rows = np.flatnonzero(_is_target(target_keys, decoy_keys))
+    else:
+        decoy_keys = np.zeros_like(keys)
+        rows = np.arange(len(keys))
+    scrambled_keys, scrambled = _scramble_keys(
+        target_keys,
+        keys[rows],
+        lengths[rows],
+        max_attempts,
+        rng)
+    decoy_keys[rows] = scrambled_keys
+    is_decoy = np.ones(len(keys), dtype=bool)
+    is_decoy[rows[~scrambled]] = False
+    return decoy_keys[is_decoy]
+
+
+# arguments of _decoy_keys_of_chunk other than the task, set once in each
+# worker process
+_decoy_args = None
+
+
+def _set_decoy_args(shared_target_keys, *args):
+    global _decoy_args
+    _decoy_args = ([_unshared_keys(keys) for keys in shared_target_keys],) + args
+
+
+def _decoy_keys_of_chunk_in_worker(task):
+    return _decoy_keys_of_chunk(task, *_decoy_args)
+
+
+def _is_target(target_keys, keys):
+    is_target = np.zeros(len(keys), dtype=bool)
+    for sorted_keys in target_keys:
+        if len(sorted_keys) > 0:
+            is_target |= isin_keys(sorted_keys, keys)
+    return is_target
+
+
+def _reverse_keys(keys, lengths, keep_last_residue=False):
+    """
+    Packed keys of the reversed peptides, reversing all but the last
+    residue of each if keep_last_residue is True.
+    """
+    n_words = keys.shape[1]
+    reversed_keys = np.zeros_like(keys)
+    for k in np.unique(lengths).tolist():
+        rows = np.flatnonzero(lengths == k)
+        codes = unpack_codes(keys[rows])[:, :k]
+        n_reversed = k - 1 if keep_last_residue else k
+        codes[:, :n_reversed] = codes[:, :n_reversed][:, ::-1].copy()
+        reversed_keys[rows] = pack_codes(codes, n_words)
+    return reversed_keys
+
+
+def _scramble_keys(target_keys, keys, lengths, max_attempts, rng):
+    """
+    Shuffle the residues of each packed peptide, rejecting and retrying
+    shuffles which are in any of the sorted arrays of target keys.
+
+    Returns
+    -------
+    Packed keys of the scrambled peptides and a mask of which ones were
+    scrambled into something other than a target
+    """
+    n_words = keys.shape[1]
+    scrambled_keys = np.zeros_like(keys)
+    scrambled = np.zeros(len(keys), dtype=bool)
+    for k in np.unique(lengths).tolist():
+        rows = np.flatnonzero(lengths == k)
+        codes = unpack_codes(keys[rows])[:, :k]
+        for _ in range(max_attempts):
+            if len(rows) == 0:
+                break
+            # independent random permutation of the residues of every row
+            permutations = rng.random(codes.shape).argsort(axis=1)
+            candidates = pack_codes(
+                np.take_along_axis(codes, permutations, axis=1), n_words)
+            accepted = ~_is_target(target_keys, candidates)
+            scrambled_keys[rows[accepted]] = candidates[accepted]
+            scrambled[rows[accepted]] = True
+            rows = rows[~accepted]
+            codes = codes[~accepted]
+    return scrambled_keys, scrambled
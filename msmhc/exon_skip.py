@@ -0,0 +1,172 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .genetic_code import translate_cdna
+from .protein_changes import changed_interval, peptide_window
+from .sequence import Sequence
+from .reference_sequence import ReferenceSequence
+from .transcript_record import transcript_exon_intervals
+
+
+class ExonSkipSequence(Sequence):
+    """
+    Protein sequence around the new exon-exon junction of a transcript
+    with one of its internal exons skipped.
+
+    Only the part of the protein which differs from the reference, along
+    with enough of the reference on either side for every peptide spanning
+    the junction, is kept. Peptides further away from the junction are
+    the same as the reference transcript's.
+    """
+    __slots__ = [
+        "original_sequence_name",
+        "transcript_id",
+        "transcript_name",
+        "gene_id",
+        "gene_name",
+        "skipped_exon_number",
+        "protein_start",
+        "frameshift",
+    ]
+
+    def __init__(
+            self,
+            original_sequence_name,
+            transcript_id,
+            transcript_name,
+            gene_id,
+            gene_name,
+            skipped_exon_number,
+            protein_start,
+            frameshift,
+            amino_acids):
+        assert len(amino_acids) > 0
+        self.original_sequence_name = original_sequence_name
+        self.transcript_id = transcript_id
+        self.transcript_name = transcript_name
+        self.gene_id = gene_id
+        self.gene_name = gene_name
+        self.skipped_exon_number = skipped_exon_number
+        self.protein_start = protein_start
+        self.frameshift = frameshift
+        Sequence.__init__(
+            self,
+            name="ExonSkip-%s-exon%d" % (
+                original_sequence_name,
+                skipped_exon_number),
+            amino_acids=amino_acids)
+
+    def base_attributes(self):
+        # built from the slots rather than stored a second time
+        return {
+            "source": "skipped-exon",
+            "original_sequence_name": self.original_sequence_name,
+            "gene_name": self.gene_name,
+            "gene_id": self.gene_id,
+            "transcript_name": self.transcript_name,
+            "transcript_id": self.transcript_id,
+            "skipped_exon_number": self.skipped_exon_number,
+            "protein_start": self.protein_start,
+            "frameshift": self.frameshift,
+        }
+
+
+def generate_exon_skip_sequences(
+        sequence_obj,
+        min_peptide_length=7,
+        max_peptide_length=20):
+    """
+    Parameters
+    ----------
+    sequence_obj : ReferenceSequence
+
+    min_peptide_length : int
+        Skip junctions without any peptides of this length
+
+    max_peptide_length : int or None
+        Longest peptide which will be extracted, determines how much of the
+        reference protein is kept on either side of the changed residues.
+        If None then keep the whole protein.
+
+    Returns
+    -------
+    list of ExonSkipSequence, one for each internal exon whose skipping
+    changes the protein
+    """
+    if type(sequence_obj) != ReferenceSequence:
+        return []
+    transcript = sequence_obj.transcript
+    exon_intervals = transcript_exon_intervals(transcript)
+    if not exon_intervals or len(exon_intervals) < 3:
+        return []
+    cdna_sequence = transcript.sequence
+    exon_lengths = [end - start + 1 for (start, end) in exon_intervals]
+    if sum(exon_lengths) != len(cdna_sequence):
+        # can't tell where the exons are in the spliced sequence
+        return []
+    reference_protein = transcript.protein_sequence
+    start_codon_offset = min(transcript.start_codon_spliced_offsets)
+    coding_end = start_codon_offset + len(transcript.coding_sequence)
+    results = []
+    exon_start = exon_lengths[0]
+    for exon_index in range(1, len(exon_lengths) - 1):
+        exon_length = exon_lengths[exon_index]
+        exon_end = exon_start + exon_length
+        junction = exon_start
+        exon_start = exon_end
+        if junction < start_codon_offset + 3 or junction >= coding_end:
+            # skipping exons of the UTRs or the one with the start codon
+            # doesn't change the annotated protein
+            continue
+        first_codon = (junction - start_codon_offset) // 3
+        codon_start = start_codon_offset + 3 * first_codon
+        frameshift = exon_length % 3 != 0
+        if not frameshift and exon_end + 3 <= coding_end:
+            # in-frame skip which keeps the stop codon, only the codon
+            # spanning the junction is new
+            junction_codon = (
+                cdna_sequence[codon_start:junction] +
+                cdna_sequence[exon_end:exon_end + 3 - (junction - codon_start)])
+            try:
+                amino_acid, _ = translate_cdna(junction_codon)
+            except KeyError:
+                continue
+            protein = reference_protein[:first_codon] + amino_acid
+            if amino_acid:
+                protein += reference_protein[first_codon + 1 + exon_length // 3:]
+        else:
+            try:
+                amino_acids, _ = translate_cdna(
+                    cdna_sequence[codon_start:junction] + cdna_sequence[exon_end:])
+            except KeyError:
+                continue
+            protein = reference_protein[:first_codon] + amino_acids
+        if protein == reference_protein:
+            continue
+        window_start, window_end = peptide_window(
+            *changed_interval(protein, reference_protein, first_codon),
+            protein_length=len(protein),
+            max_peptide_length=max_peptide_length)
+        amino_acids = protein[window_start:window_end]
+        if len(amino_acids) < min_peptide_length:
+            continue
+        results.append(ExonSkipSequence(
+            original_sequence_name=sequence_obj.name,
+            transcript_id=transcript.transcript_id,
+            transcript_name=transcript.transcript_name,
+            gene_id=transcript.gene_id,
+            gene_name=transcript.gene_name,
+            skipped_exon_number=exon_index + 1,
+            protein_start=window_start,
+            frameshift=frameshift,
+            amino_acids=amino_acids))
+    return results
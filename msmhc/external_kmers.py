@@ -0,0 +1,248 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+External-memory k-mer extraction: proteins are processed in batches sized
+to fit a memory budget, each batch's sorted k-mer index is spilled to disk
+as one run, and the runs are then k-way merged in sorted order as a stream
+of small PeptideSourceIndex blocks.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .packed_peptides import (
+    extract_packed_kmers,
+    lexsort_keys,
+    merge_key_groups,
+    n_words_for_length,
+    searchsorted_keys,
+)
+from .peptide_source_index import PeptideSourceIndex
+
+# rough number of bytes used per residue and per peptide length while a
+# batch of proteins is being indexed by extract_packed_kmers
+_BATCH_BYTES_PER_WINDOW = 64
+
+
+def residues_per_batch(memory_budget, min_length, max_length):
+    """
+    Number of residues to index at a time so that a batch stays within
+    the memory budget (in bytes).
+    """
+    n_lengths = max(1, max_length - min_length + 1)
+    bytes_per_window = _BATCH_BYTES_PER_WINDOW + 8 * n_words_for_length(max_length)
+    return max(max_length, memory_budget // (n_lengths * bytes_per_window))
+
+
+def save_run(directory, run_index, keys, offsets, source_ids):
+    """
+    Write one sorted run (packed keys with a CSR of source IDs) to disk.
+
+    Returns
+    -------
+    Tuple of paths to the keys, offsets and source IDs
+    """
+    paths = tuple(
+        os.path.join(directory, "run-%05d-%s.npy" % (run_index, name))
+        for name in ("keys", "offsets", "source_ids"))
+    for path, array in zip(paths, (keys, offsets, source_ids)):
+        np.save(path, array)
+    return paths
+
+
+def write_kmer_runs(
+        sequences,
+        directory,
+        memory_budget,
+        min_length=7,
+        max_length=20,
+        prefix_range=None):
+    """
+    Index the k-mers of batches of sequences and write each batch's index
+    to disk as a sorted run.
+
+    Parameters
+    ----------
+    sequences : list of Sequence
+
+    directory : str
+        Where to write the runs
+
+    memory_budget : int
+        Approximate number of bytes to use while indexing each batch
+
+    min_length : int
+
+    max_length : int
+
+    prefix_range : tuple of int or None
+        Only keep k-mers in this range of prefixes, see
+        msmhc.packed_peptides.extract_packed_kmers
+
+    Returns
+    -------
+    list of tuples of paths to the keys, offsets and source IDs of each run
+    """
+    batch_residues = residues_per_batch(memory_budget, min_length, max_length)
+    runs = []
+    batch_start = 0
+    while batch_start < len(sequences):
+        batch_end = batch_start
+        n_residues = 0
+        while batch_end < len(sequences) and (
+                batch_end == batch_start or n_residues < batch_residues):
+            n_residues += len(sequences[batch_end].amino_acids)
+            batch_end += 1
+        keys, offsets, source_ids = extract_packed_kmers(
+            [s.amino_acids for s in sequences[batch_start:batch_end]],
+            min_length=min_length,
+            max_length=max_length,
+            prefix_range=prefix_range)
+        if len(keys) > 0:
+            source_ids = source_ids.astype(np.int64) + batch_start
+            runs.append(save_run(directory, len(runs), keys, offsets, source_ids))
+        del keys, offsets, source_ids
+        batch_start = batch_end
+    return runs
+
+
+def iter_merged_kmer_runs(sources, runs, block_size=2 ** 16):
+    """
+    Merge sorted runs written by write_kmer_runs, yielding PeptideSourceIndex
+    blocks whose concatenation is the index of all sequences.
+
+    Parameters
+    ----------
+    sources : sequence
+        Source table which the source IDs of all runs refer to, usually
+        a list of Sequence objects
+
+    runs : list of tuples of paths
+
+    block_size : int
+        Number of peptides to read from each run at a time
+    """
+    run_arrays = [
+        tuple(np.load(path, mmap_mode="r") for path in paths)
+        for paths in runs
+    ]
+    cursors = [0] * len(run_arrays)
+    while True:
+        active = [
+            i for i, (keys, _, _) in enumerate(run_arrays)
+            if cursors[i] < len(keys)
+        ]
+        if not active:
+            return
+        blocks = {}
+        for i in active:
+            keys = run_arrays[i][0]
+            blocks[i] = np.asarray(keys[cursors[i]:cursors[i] + block_size])
+        # every key up to the smallest last key of the runs which still have
+        # more data is guaranteed to have been loaded from all runs
+        bounds = [
+            blocks[i][-1]
+            for i in active
+            if cursors[i] + len(blocks[i]) < len(run_arrays[i][0])
+        ]
+        if bounds:
+            bounds = np.array(bounds)
+            bound = bounds[lexsort_keys(bounds)[0]][np.newaxis]
+        else:
+            bound = None
+
+        key_chunks = []
+        count_chunks = []
+        source_id_chunks = []
+        for i in active:
+            keys, offsets, source_ids = run_arrays[i]
+            block = blocks[i]
+            if bound is None:
+                n_taken = len(block)
+            else:
+                n_taken = int(searchsorted_keys(block, bound)[0])
+                if n_taken < len(block) and (block[n_taken] == bound[0]).all():
+                    n_taken += 1
+            if n_taken == 0:
+                continue
+            start = cursors[i]
+            block_offsets = np.asarray(offsets[start:start + n_taken + 1])
+            key_chunks.append(block[:n_taken])
+            count_chunks.append(np.diff(block_offsets))
+            source_id_chunks.append(
+                np.asarray(source_ids[block_offsets[0]:block_offsets[-1]]))
+            cursors[i] += n_taken
+
+        # concatenating in run order and sorting stably keeps the source IDs
+        # of a peptide which occurs in several runs in ascending order
+        keys, offsets, source_ids = merge_key_groups(
+            np.concatenate(key_chunks),
+            np.concatenate(count_chunks),
+            np.concatenate(source_id_chunks))
+        yield PeptideSourceIndex(sources, keys, offsets, source_ids)
+
+
+def iter_external_peptide_index(
+        sequences,
+        memory_budget,
+        min_length=7,
+        max_length=20,
+        temp_dir=None,
+        prefix_range=None):
+    """
+    Index the k-mers of sequences within a memory budget, spilling sorted
+    runs to a temporary directory, and yield the merged index in blocks.
+    The temporary directory is removed once the generator is exhausted
+    or closed.
+
+    Parameters
+    ----------
+    sequences : list of Sequence
+
+    memory_budget : int
+        Approximate number of bytes to use
+
+    min_length : int
+
+    max_length : int
+
+    temp_dir : str or None
+        Parent directory for spilled runs, defaults to the system temporary
+        directory.
+
+    prefix_range : tuple of int or None
+        Only keep k-mers in this range of prefixes
+    """
+    sequences = list(sequences)
+    directory = tempfile.mkdtemp(prefix="msmhc-kmers-", dir=temp_dir)
+    try:
+        runs = write_kmer_runs(
+            sequences,
+            directory,
+            memory_budget=memory_budget,
+            min_length=min_length,
+            max_length=max_length,
+            prefix_range=prefix_range)
+        print("Spilled %d sorted k-mer runs to %s" % (len(runs), directory))
+        # spend about a quarter of the budget on the blocks being merged
+        bytes_per_peptide = 8 * n_words_for_length(max_length) + 24
+        block_size = max(
+            256,
+            memory_budget // (4 * bytes_per_peptide * max(1, len(runs))))
+        for block in iter_merged_kmer_runs(sequences, runs, block_size=block_size):
+            yield block
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -13,15 +13,40 @@
 
 from . import __version__
 
-from collections import defaultdict
 from argparse import ArgumentParser
+from itertools import chain
+import os
+import shutil
 from sys import argv
+import tempfile
 
-from progressbar import progressbar
-
-from .main import generate_protein_sequences
+from .alt_orf import START_CODONS
+from .common import parse_memory_size
+from .kozak import ALT_START_CODONS, MAX_TRANSLATION_INITIATION_SCORE
+from .main import (
+    generate_mutant_sequences,
+    generate_protein_sequences,
+    generate_protein_sequence_groups,
+)
 from .peptides import extract_peptides, collapse_peptide_sources
-from .decoys import generate_decoys
+from .peptide_source_index import PeptideSourceIndex
+from .external_kmers import iter_external_peptide_index
+from .decoys import DECOY_STRATEGIES, generate_decoys, iter_decoys_of_keys
+from .output import (
+    RecordWriter,
+    load_hit_keys,
+    write_collapsed_hits,
+    write_fasta_records,
+)
+from .packed_peptides import n_words_for_length
+from .sharded_peptides import write_sharded_hits
+from .streaming import write_streaming_hits_and_decoys
+from .reference_cache import (
+    load_or_build_reference_peptides,
+    write_hits_with_reference_peptides,
+)
+from .peptide_database import PeptideDatabaseWriter
+from .transcript_snapshot import TranscriptSnapshot
 
 from varcode.reference import genome_for_reference_name
 
@@ -42,11 +67,40 @@ def add_sources_to_argument_parser(parser):
         action="store_true",
         help="Include downstream reading frames from use of alternative start codons")
 
+    sources_group.add_argument(
+        "--start-codons",
+        default=["ATG"],
+        nargs="+",
+        choices=sorted(START_CODONS),
+        help=(
+            "Start codons of upstream and downstream reading frames "
+            "(default: ATG), the near-cognate starts %s find about four "
+            "times as many reading frames" % " ".join(sorted(ALT_START_CODONS))))
+
+    sources_group.add_argument(
+        "--min-translation-initiation-score",
+        default=0.0,
+        type=float,
+        help=(
+            "Only translate upstream and downstream reading frames whose "
+            "start codon and Kozak context have at least this translation "
+            "initiation score, between 0 and 1. An ATG start codon alone "
+            "scores %0.2f." % (100 / MAX_TRANSLATION_INITIATION_SCORE)))
+
     sources_group.add_argument(
         "--skip-exons",
         default=False,
         action="store_true",
-        help="Include sequences by skipping exons in a coding sequence")
+        help=(
+            "Include the protein sequence around each new junction made by "
+            "skipping an internal exon of a coding sequence"))
+
+    sources_group.add_argument(
+        "--transcript-snapshot",
+        default=None,
+        help=(
+            "Read reference transcripts from a snapshot directory written by "
+            "msmhc-snapshot instead of querying pyensembl"))
 
     sources_group.add_argument(
         "--gene-name",
@@ -60,11 +114,69 @@ def add_peptide_params_to_argument_parser(parser):
     peptide_group.add_argument(
         "--min-peptide-length",
         default=7,
+        type=int,
         help="Shortest peptide to include in output")
     peptide_group.add_argument(
         "--max-peptide-length",
         default=15,
+        type=int,
         help="Longest peptide to include in output")
+    peptide_group.add_argument(
+        "--peptide-extraction-engine",
+        default="packed",
+        choices=("packed", "python"),
+        help=(
+            "Extract peptides by packing each k-mer into fixed-width integers "
+            "and deduplicating with NumPy ('packed') or by slicing every "
+            "k-mer into a Python string ('python')"))
+    peptide_group.add_argument(
+        "--memory-budget",
+        default=None,
+        type=parse_memory_size,
+        help=(
+            "Approximate memory to use for k-mer extraction (e.g. '8G'), "
+            "sorted runs of k-mers are spilled to disk and merged as they "
+            "are written out. Implies the packed extraction engine."))
+    peptide_group.add_argument(
+        "--temp-dir",
+        default=None,
+        help=(
+            "Directory for k-mer runs spilled when using --memory-budget, "
+            "for partial outputs when using --processes, for the sources "
+            "spooled by --streaming and for the packed hits which decoys are "
+            "made from"))
+    peptide_group.add_argument(
+        "--processes",
+        default=1,
+        type=int,
+        help=(
+            "Number of worker processes for generating reference sequences, "
+            "split by contig, for predicting variant effects, split into "
+            "chunks of variants, and for peptide extraction and collapse, each "
+            "handling its own shard of k-mer space, and for scrambling decoys "
+            "in chunks, which gives the same decoys as one process. Implies "
+            "the packed extraction engine."))
+    peptide_group.add_argument(
+        "--streaming",
+        default=False,
+        action="store_true",
+        help=(
+            "Generate, collapse and write the peptides of one gene at a time, "
+            "with decoys written alongside their hits, so that peak memory "
+            "doesn't grow with the proteome. Sources are generated once and "
+            "spooled to --temp-dir, but output only starts after a first "
+            "pass over every gene has found the peptides shared between "
+            "genes. Requires --extract-peptides and can't be combined with "
+            "--reference-cache-dir."))
+    peptide_group.add_argument(
+        "--reference-cache-dir",
+        default=None,
+        help=(
+            "Directory for caching the collapsed peptides of reference "
+            "transcripts and reading frames, keyed on the genome release, "
+            "source options and peptide lengths. Later runs with the same "
+            "options only have to collapse mutant peptides. Requires "
+            "--extract-peptides."))
     return parser
 
 
@@ -80,11 +192,28 @@ def add_decoy_args(parser):
         default=0,
         type=int,
         help="Random seed to make scrambling of sequences deterministic")
+    decoy_group.add_argument(
+        "--decoy-strategy",
+        default="shuffle",
+        choices=DECOY_STRATEGIES,
+        help=(
+            "Make decoys by shuffling the residues of hits, by reversing "
+            "them or by reversing all but their C-terminal residue. The "
+            "reversal strategies only shuffle hits whose reversal is also a "
+            "hit, and for decoys after the first of each hit."))
     return parser
 
 def create_argument_parser():
     parser = ArgumentParser("MS-MHC")
     parser.add_argument("--output", required=True, help="Name of output FASTA file")
+    parser.add_argument(
+        "--output-format",
+        default="fasta",
+        choices=("fasta", "database", "both"),
+        help=(
+            "Write a FASTA file, a memory-mappable binary peptide database "
+            "directory (see msmhc.peptide_database) or both, in which case "
+            "the database is written to '<output>.db'"))
     add_sources_to_argument_parser(parser)
     add_peptide_params_to_argument_parser(parser)
     add_decoy_args(parser)
@@ -98,14 +227,109 @@ def run(args_list=None):
     if args_list is None:
         args_list = argv[1:]
     args = parser.parse_args(args_list)
+    if args.streaming and not args.extract_peptides:
+        parser.error("--streaming requires --extract-peptides")
+    if args.streaming and args.reference_cache_dir:
+        parser.error("--streaming can't be combined with --reference-cache-dir")
+    if args.reference_cache_dir and not args.extract_peptides:
+        parser.error("--reference-cache-dir requires --extract-peptides")
     print("MS-MHC version %s" % __version__)
-    reference_genome = genome_for_reference_name(args.genome if args.genome else "grch37")
+    if args.transcript_snapshot:
+        reference_genome = TranscriptSnapshot(args.transcript_snapshot)
+    else:
+        reference_genome = genome_for_reference_name(args.genome if args.genome else "grch37")
     print("Using reference genome %s" % reference_genome)
     if args.vcf or args.maf or args.variant or args.json_variants:
         variants = variant_collection_from_args(args)
     else:
         variants = []
 
+    fasta_file = None
+    database_writer = None
+    if args.output_format == "database":
+        database_writer = PeptideDatabaseWriter(args.output)
+    else:
+        fasta_file = open(args.output, "w")
+        if args.output_format == "both":
+            database_writer = PeptideDatabaseWriter(args.output + ".db")
+    with RecordWriter(fasta_file, database_writer) as output:
+        generate_records(args, reference_genome, variants, output)
+    print("Done.")
+
+
+def generate_records(args, reference_genome, variants, output):
+    """
+    Generate hits and decoys for the parsed command line arguments and
+    write them to a FASTA file and/or peptide database.
+    """
+
+    if args.streaming:
+        print("Extracting %dmer-%dmer peptides one gene at a time" % (
+            args.min_peptide_length,
+            args.max_peptide_length))
+
+        sequence_groups = generate_protein_sequence_groups(
+            genome=reference_genome,
+            variants=variants,
+            upstream_reading_frames=args.upstream_reading_frames,
+            downstream_reading_frames=args.downstream_reading_frames,
+            skip_exons=args.skip_exons,
+            min_peptide_length=args.min_peptide_length,
+            max_peptide_length=args.max_peptide_length,
+            restrict_sources_to_gene_name=args.gene_name,
+            start_codons=args.start_codons,
+            min_translation_initiation_score=args.min_translation_initiation_score,
+            n_processes=args.processes)
+        n_hits, n_decoys = write_streaming_hits_and_decoys(
+            sequence_groups,
+            output,
+            min_length=args.min_peptide_length,
+            max_length=args.max_peptide_length,
+            n_decoys_per_hit=args.num_decoys_per_hit,
+            random_seed=args.random_seed,
+            memory_budget=args.memory_budget or 2 ** 30,
+            temp_dir=args.temp_dir,
+            decoy_strategy=args.decoy_strategy)
+        print("Wrote %d records (%d hits, %d decoys)" % (
+            n_hits + n_decoys,
+            n_hits,
+            n_decoys))
+        return
+
+    if args.reference_cache_dir:
+        reference_peptides = load_or_build_reference_peptides(
+            args.reference_cache_dir,
+            reference_genome,
+            upstream_reading_frames=args.upstream_reading_frames,
+            downstream_reading_frames=args.downstream_reading_frames,
+            skip_exons=args.skip_exons,
+            restrict_sources_to_gene_name=args.gene_name,
+            min_length=args.min_peptide_length,
+            max_length=args.max_peptide_length,
+            start_codons=args.start_codons,
+            min_translation_initiation_score=args.min_translation_initiation_score,
+            n_processes=args.processes)
+        print("Loaded %d reference peptides" % len(reference_peptides))
+        if variants:
+            print("Generating sequences from %d variants" % len(variants))
+            mutant_sequences = generate_mutant_sequences(
+                variants,
+                max_peptide_length=args.max_peptide_length,
+                n_processes=args.processes)
+        else:
+            mutant_sequences = []
+        write_hits_with_reference_peptides(
+            reference_peptides,
+            mutant_sequences,
+            output,
+            min_length=args.min_peptide_length,
+            max_length=args.max_peptide_length,
+            n_decoys_per_hit=args.num_decoys_per_hit,
+            random_seed=args.random_seed,
+            n_processes=args.processes,
+            decoy_strategy=args.decoy_strategy)
+        return
+
     hits = generate_protein_sequences(
         genome=reference_genome,
         variants=variants,
@@ -113,37 +337,101 @@ def run(args_list=None):
         downstream_reading_frames=args.downstream_reading_frames,
         skip_exons=args.skip_exons,
         min_peptide_length=args.min_peptide_length,
-        restrict_sources_to_gene_name=args.gene_name)
+        # without peptide extraction whole proteins are written out
+        max_peptide_length=(
+            args.max_peptide_length if args.extract_peptides else None),
+        restrict_sources_to_gene_name=args.gene_name,
+        start_codons=args.start_codons,
+        min_translation_initiation_score=args.min_translation_initiation_score,
+        n_processes=args.processes)
+
+    if args.extract_peptides and (
+            args.memory_budget is not None or args.processes > 1):
+        print("Extracting %dmer-%dmer peptides from generated sequences" % (
+            args.min_peptide_length,
+            args.max_peptide_length))
+        # the packed keys of the hits are kept on disk for making decoys
+        key_directory = tempfile.mkdtemp(prefix="msmhc-hits-", dir=args.temp_dir)
+        key_path = os.path.join(key_directory, "hits.keys")
+        try:
+            with open(key_path, "wb") as key_file:
+                if args.processes > 1:
+                    print("Using %d processes" % args.processes)
+                    n_hits = write_sharded_hits(
+                        hits,
+                        output,
+                        n_processes=args.processes,
+                        min_length=args.min_peptide_length,
+                        max_length=args.max_peptide_length,
+                        memory_budget=args.memory_budget,
+                        temp_dir=args.temp_dir,
+                        key_file=key_file)
+                else:
+                    print("Using a memory budget of %d bytes" % args.memory_budget)
+                    n_hits = write_collapsed_hits(
+                        iter_external_peptide_index(
+                            hits,
+                            memory_budget=args.memory_budget,
+                            min_length=args.min_peptide_length,
+                            max_length=args.max_peptide_length,
+                            temp_dir=args.temp_dir),
+                        output,
+                        key_file=key_file)
+            del hits
+            hit_keys = load_hit_keys(
+                key_path,
+                n_words_for_length(args.max_peptide_length))
+            n_decoys = write_fasta_records(
+                chain.from_iterable(iter_decoys_of_keys(
+                    hit_keys,
+                    n_decoys=n_hits * args.num_decoys_per_hit,
+                    random_seed=args.random_seed,
+                    n_processes=args.processes,
+                    strategy=args.decoy_strategy)),
+                output)
+            del hit_keys
+        finally:
+            shutil.rmtree(key_directory, ignore_errors=True)
+        print("Wrote %d records (%d hits, %d decoys)" % (
+            n_hits + n_decoys,
+            n_hits,
+            n_decoys))
+        return
 
     if args.extract_peptides:
         print("Extracting %dmer-%dmer peptides from generated sequences" % (
             args.min_peptide_length,
             args.max_peptide_length))
-        sequence_dict = extract_peptides(
-            hits,
-            min_length=args.min_peptide_length,
-            max_length=args.max_peptide_length)
+        if args.peptide_extraction_engine == "packed":
+            sequence_dict = PeptideSourceIndex.from_sequences(
+                hits,
+                min_length=args.min_peptide_length,
+                max_length=args.max_peptide_length,
+                verbose=True)
+        else:
+            sequence_dict = extract_peptides(
+                hits,
+                min_length=args.min_peptide_length,
+                max_length=args.max_peptide_length)
     else:
         # make sure we don't have repeated protein sequences
-        sequence_dict = defaultdict(list)
-        for sequence_obj in hits:
-            sequence_dict[sequence_obj.amino_acids].append(sequence_obj)
+        sequence_dict = PeptideSourceIndex.from_full_sequences(hits)
 
     hits = collapse_peptide_sources(sequence_dict)
 
     decoys = generate_decoys(
         hits,
         n_decoys=len(hits) * args.num_decoys_per_hit,
-        random_seed=args.random_seed)
+        random_seed=args.random_seed,
+        n_processes=args.processes,
+        strategy=args.decoy_strategy)
 
-    combined_sequences = hits + decoys
-    print("Writing %d FASTA records (%d hits, %d decoys)" % (
-        len(combined_sequences),
+    print("Writing %d records (%d hits, %d decoys)" % (
+        len(hits) + len(decoys),
         len(hits),
         len(decoys)))
 
-    with open(args.output, "w") as f:
-        for seq in progressbar(combined_sequences):
-            seq.write_to_fasta_file(f)
-    print("Done.")
+    write_fasta_records(hits, output)
+    # decoys are only created as they're written
+    write_fasta_records(decoys, output)
 
@@ -20,6 +20,48 @@ sequence: the set of valid start and stop codons, as well as which
 amino acid each DNA triplet is translated into.
 """
 
+import numpy as np
+
+NUCLEOTIDES = "ACGT"
+
+# codon index of codons containing anything other than A, C, G or T
+UNKNOWN_CODON_INDEX = 64
+
+# code of each nucleotide byte, 0-3 for A, C, G and T and 4 for anything else
+_nucleotide_codes = np.full(256, 4, dtype=np.uint8)
+for _i, _nucleotide in enumerate(NUCLEOTIDES):
+    _nucleotide_codes[ord(_nucleotide)] = _i
+
+
+def encode_cdna(cdna_sequence):
+    """
+    Map a cDNA sequence to a uint8 array with the code of each nucleotide,
+    0-3 for A, C, G and T and 4 for anything else.
+    """
+    return _nucleotide_codes[
+        np.frombuffer(str(cdna_sequence).encode("ascii"), dtype=np.uint8)]
+
+
+def codon_indices(nucleotide_codes, frame=0):
+    """
+    Index 16 * a + 4 * b + c of every complete codon in one reading frame
+    of an array made by encode_cdna, or UNKNOWN_CODON_INDEX for codons
+    which contain other letters.
+
+    Parameters
+    ----------
+    nucleotide_codes : np.ndarray of uint8
+
+    frame : int
+        Offset of the first codon, 0, 1 or 2
+    """
+    n_codons = max(0, (len(nucleotide_codes) - frame) // 3)
+    codons = nucleotide_codes[frame:frame + 3 * n_codons].reshape((n_codons, 3))
+    indices = (codons[:, 0] << 4) | (codons[:, 1] << 2) | codons[:, 2]
+    if n_codons > 0 and codons.max() == 4:
+        indices[(codons == 4).any(axis=1)] = UNKNOWN_CODON_INDEX
+    return indices
+
 
 class GeneticCode(object):
     """
@@ -32,6 +74,19 @@ class GeneticCode(object):
         self.stop_codons = set(stop_codons)
         self.codon_table = dict(codon_table)
         self._check_codons()
+        # ASCII amino acid and whether it's a start codon for each codon
+        # index, see codon_indices
+        codons = [
+            a + b + c
+            for a in NUCLEOTIDES
+            for b in NUCLEOTIDES
+            for c in NUCLEOTIDES
+        ]
+        self._codon_lookup_table = np.array(
+            [ord(self.codon_table[codon]) for codon in codons] + [ord("?")],
+            dtype=np.uint8)
+        self._start_codon_mask = np.array(
+            [codon in self.start_codons for codon in codons] + [False])
 
     def _check_codons(self):
         """
@@ -107,6 +162,86 @@ class GeneticCode(object):
         amino_acids = "".join(amino_acid_list)
         return amino_acids, ends_with_stop_codon
 
+    def translate_codons(self, cdna_sequence, frame=0):
+        """
+        Translate every complete codon of one reading frame, including
+        codons after stop codons, into a string with one character per codon.
+        Stop codons become '*' and codons which aren't in the codon table
+        (e.g. containing N) become '?'.
+
+        Parameters
+        ----------
+        cdna_sequence : str
+
+        frame : int
+            Offset of the first codon, 0, 1 or 2
+        """
+        amino_acids = self._codon_lookup_table[
+            codon_indices(encode_cdna(cdna_sequence), frame)]
+        return amino_acids.tobytes().decode("ascii")
+
+    def translate_batch(self, cdna_sequences, first_codon_is_start=False):
+        """
+        Translate many cDNA sequences at once, giving the same results as
+        calling translate on each of them. All codons are translated in one
+        pass through a lookup table indexed by codon_indices.
+
+        Parameters
+        ----------
+        cdna_sequences : list of str
+            cDNA sequences which are each aligned to a reading frame
+
+        first_codon_is_start : bool
+            Is the first codon of each sequence a start codon?
+
+        Returns
+        -------
+        list of (amino acids, ends_with_stop_codon) pairs
+        """
+        cdna_sequences = [str(s) for s in cdna_sequences]
+        # drop dangling nucleotides so that the codons of every sequence
+        # line up in the concatenated sequence
+        n_codons = np.array([len(s) // 3 for s in cdna_sequences], dtype=np.int64)
+        codon_ends = np.cumsum(n_codons)
+        codon_starts = codon_ends - n_codons
+        indices = codon_indices(encode_cdna("".join([
+            s[:3 * n] for (s, n) in zip(cdna_sequences, n_codons.tolist())])))
+        amino_acids = self._codon_lookup_table[indices]
+
+        has_start_codon = np.zeros(len(n_codons), dtype=bool)
+        if first_codon_is_start:
+            nonempty = n_codons > 0
+            has_start_codon[nonempty] = self._start_codon_mask[
+                indices[codon_starts[nonempty]]]
+        translation_starts = codon_starts + has_start_codon
+
+        def next_position(positions):
+            # first of the sorted positions at or after the start of each
+            # translation, or the end of its sequence if there isn't one
+            i = np.searchsorted(positions, translation_starts)
+            next_positions = np.append(positions, codon_ends[-1:])[i]
+            return np.minimum(next_positions, codon_ends)
+
+        translation_ends = next_position(np.flatnonzero(amino_acids == ord("*")))
+        ends_with_stop_codon = translation_ends < codon_ends
+        unknown_positions = next_position(
+            np.flatnonzero(indices == UNKNOWN_CODON_INDEX))
+        reaches_unknown_codon = unknown_positions < translation_ends
+        if reaches_unknown_codon.any():
+            i = int(np.flatnonzero(reaches_unknown_codon)[0])
+            offset = 3 * int(unknown_positions[i] - codon_starts[i])
+            raise KeyError(cdna_sequences[i][offset:offset + 3])
+
+        text = amino_acids.tobytes().decode("ascii")
+        return [
+            ("M" + text[start:end] if is_start else text[start:end], ends_with_stop)
+            for (start, end, is_start, ends_with_stop) in zip(
+                translation_starts.tolist(),
+                translation_ends.tolist(),
+                has_start_codon.tolist(),
+                ends_with_stop_codon.tolist())
+        ]
+
     def copy(
             self,
             name,
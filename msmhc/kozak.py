@@ -10,32 +10,123 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+
+from .genetic_code import NUCLEOTIDES, encode_cdna
+
 KOZAK_CONSENSUS_SEQUENCE_BEFORE_START = "gccRcc"
 ALT_START_CODONS = {"CTG", "GTG", "TTG"}
 KOZAK_CONSENSEUS_SEQUENCE_AFTER_START = "Gcg"
 
+MAX_TRANSLATION_INITIATION_SCORE = 100 + 5 + 10 + 10 + 2
 
-def translation_initiation_score(sequence_before_start, start_codon, sequence_after_start):
+
+def _start_codon_score(start_codon):
     if start_codon == "ATG":
-        score = 100
+        return 100
     elif start_codon in ALT_START_CODONS:
-        score = 10
+        return 10
+    else:
+        return 0
+
+
+def _consensus_weights(consensus):
+    """
+    Score of each nucleotide at every position of a consensus sequence,
+    10 for a match of an upper case position and 1 for a lower case one.
+    """
+    weights = []
+    for letter in consensus:
+        upper = letter.upper()
+        valid = "AG" if upper == "R" else upper
+        weights.append({
+            nucleotide: (10 if letter == upper else 1)
+            for nucleotide in valid
+        })
+    return weights
+
+
+_weights_before_start = _consensus_weights(KOZAK_CONSENSUS_SEQUENCE_BEFORE_START)
+_weights_after_start = _consensus_weights(KOZAK_CONSENSEUS_SEQUENCE_AFTER_START)
+
+
+def translation_initiation_score(sequence_before_start, start_codon, sequence_after_start):
+    score = _start_codon_score(start_codon)
+    # the consensus before the start codon is aligned to the start codon
+    # when sequence_before_start is shorter, e.g. near the transcript start
+    if sequence_before_start:
+        weights_before_start = _weights_before_start[-len(sequence_before_start):]
     else:
-        score = 0
-
-    for pair in [
-            zip(KOZAK_CONSENSUS_SEQUENCE_BEFORE_START[-len(sequence_before_start):], sequence_before_start),
-            zip(KOZAK_CONSENSEUS_SEQUENCE_AFTER_START, sequence_after_start)]:
-        for (consensus, observed) in pair:
-            consensus_upper = consensus.upper()
-            if consensus_upper == "R":
-                valid = {"A", "G"}
-            else:
-                valid = {consensus_upper}
-            match = observed in valid
-            if consensus == consensus_upper:
-                score += 10 * match
-            else:
-                score += match
-    max_score = 100 + 5 + 10 + 10 + 2
-    return score / max_score
+        weights_before_start = _weights_before_start
+    for weights, sequence in [
+            (weights_before_start, sequence_before_start),
+            (_weights_after_start, sequence_after_start)]:
+        for (nucleotide_weights, observed) in zip(weights, sequence):
+            score += nucleotide_weights.get(observed, 0)
+    return score / MAX_TRANSLATION_INITIATION_SCORE
+
+
+def _weight_table(nucleotide_weights):
+    # indexed by the nucleotide codes of encode_cdna
+    return np.array(
+        [nucleotide_weights.get(nucleotide, 0) for nucleotide in NUCLEOTIDES] + [0],
+        dtype=np.int64)
+
+
+# start codon scores indexed by 25 * a + 5 * b + c for nucleotide codes a, b, c
+_start_codon_score_table = np.array([
+    _start_codon_score(a + b + c)
+    for a in NUCLEOTIDES + "N"
+    for b in NUCLEOTIDES + "N"
+    for c in NUCLEOTIDES + "N"
+], dtype=np.int64)
+
+_weight_tables_before_start = [_weight_table(w) for w in _weights_before_start]
+_weight_tables_after_start = [_weight_table(w) for w in _weights_after_start]
+
+
+def translation_initiation_scores(
+        cdna_sequence,
+        length_before_start_codon=6,
+        length_after_start_codon=3):
+    """
+    Vectorized translation_initiation_score for a start codon at every
+    position of a cDNA sequence, using the context lengths of
+    alt_orf.generate_alt_reading_frames.
+
+    Parameters
+    ----------
+    cdna_sequence : str
+
+    length_before_start_codon : int
+        Nucleotides before the start codon compared with
+        KOZAK_CONSENSUS_SEQUENCE_BEFORE_START, at most 6
+
+    length_after_start_codon : int
+        Nucleotides after the start codon compared with
+        KOZAK_CONSENSEUS_SEQUENCE_AFTER_START, at most 3
+
+    Returns
+    -------
+    np.ndarray of float64 with the same length as cdna_sequence
+    """
+    if length_before_start_codon > len(_weight_tables_before_start):
+        raise ValueError(
+            "Can't score more than %d nucleotides before the start codon" % (
+                len(_weight_tables_before_start)))
+    if length_after_start_codon > len(_weight_tables_after_start):
+        raise ValueError(
+            "Can't score more than %d nucleotides after the start codon" % (
+                len(_weight_tables_after_start)))
+    codes = encode_cdna(cdna_sequence).astype(np.int64)
+    n = len(codes)
+    scores = np.zeros(n, dtype=np.int64)
+    if n >= 3:
+        scores[:n - 2] = _start_codon_score_table[
+            25 * codes[:n - 2] + 5 * codes[1:n - 1] + codes[2:]]
+    for j in range(1, length_before_start_codon + 1):
+        # j nucleotides before the start codon
+        scores[j:] += _weight_tables_before_start[-j][codes[:max(0, n - j)]]
+    for j in range(length_after_start_codon):
+        scores[:max(0, n - 3 - j)] += _weight_tables_after_start[j][codes[3 + j:]]
+    return scores / MAX_TRANSLATION_INITIATION_SCORE
@@ -10,66 +10,300 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import defaultdict
+import multiprocessing
+
 from progressbar import progressbar
 
-from .alt_orf import generate_alt_reading_frames
+from .alt_orf import ReadingFrameMemo, generate_alt_reading_frames
+from .exon_skip import generate_exon_skip_sequences
 from .reference_sequence import ReferenceSequence
-from .mutant_sequence import MutantSequence
+from .mutant_sequence import MutantSequence, mutant_effect_record
 from .peptides import collapse_peptide_sources, extract_peptides
+from .transcript_record import TranscriptRecord
+from .transcript_snapshot import TranscriptSnapshot
 
 def generate_reference_sequences(
         genome,
-        restrict_sources_to_gene_name=None):
+        restrict_sources_to_gene_name=None,
+        n_processes=1):
     """
     Generate list of ReferenceSequence objects which may
     repeat the same protein sequence.
 
     Parameters
     ----------
-    genome : pyensembl.Genome
+    genome : pyensembl.Genome or TranscriptSnapshot
 
     restrict_sources_to_gene_name : str or None
 
+    n_processes : int
+        If more than one, split genes by contig between worker processes,
+        see generate_sources_by_contig
+
     Returns
     -------
     list of ReferenceTranscript
     """
+    if n_processes > 1 and not isinstance(genome, TranscriptSnapshot):
+        sequences, _, _ = generate_sources_by_contig(
+            genome,
+            n_processes,
+            restrict_sources_to_gene_name=restrict_sources_to_gene_name)
+        return sequences
     sequences = []
     print("Gathering reference genes...")
+    for _, gene_sequences in _iter_reference_sequences_by_gene(
+            genome,
+            restrict_sources_to_gene_name=restrict_sources_to_gene_name):
+        sequences.extend(gene_sequences)
+    return sequences
+
+
+def _iter_reference_sequences_by_gene(genome, restrict_sources_to_gene_name=None):
+    """
+    Pairs of gene ID and list of ReferenceSequence for each gene of a
+    pyensembl Genome or a TranscriptSnapshot.
+    """
+    if isinstance(genome, TranscriptSnapshot):
+        for gene_id, records in genome.transcript_records_by_gene(
+                gene_name=restrict_sources_to_gene_name):
+            yield gene_id, [ReferenceSequence(record) for record in records]
+        return
     if restrict_sources_to_gene_name:
         genes = genome.genes_by_name(restrict_sources_to_gene_name)
     else:
         genes = genome.genes()
-
     for g in progressbar(genes):
-        if g.is_protein_coding:
-            for t in g.transcripts:
-                if t.is_protein_coding and t.complete and t.protein_sequence is not None:
-                    sequences.append(ReferenceSequence(t))
-    return sequences
+        yield g.gene_id, _reference_sequences_of_gene(g)
+
+
+def _reference_transcripts_of_gene(gene):
+    if not gene.is_protein_coding:
+        return []
+    return [
+        t
+        for t in gene.transcripts
+        if t.is_protein_coding and t.complete and t.protein_sequence is not None
+    ]
+
 
-def generate_mutant_sequences(variants):
+def _reference_sequences_of_gene(gene):
+    return [ReferenceSequence(t) for t in _reference_transcripts_of_gene(gene)]
+
+
+def _generate_contig_sources(
+        genome,
+        contig,
+        restrict_sources_to_gene_name,
+        upstream_reading_frames,
+        downstream_reading_frames,
+        min_peptide_length,
+        start_codons,
+        min_translation_initiation_score):
+    # runs in a worker process with its own unpickled copy of the genome
+    transcript_tuples = []
+    upstream_sequences = []
+    downstream_sequences = []
+    memo = ReadingFrameMemo()
+    for gene in genome.genes(contig=contig):
+        if restrict_sources_to_gene_name and \
+                gene.gene_name != restrict_sources_to_gene_name:
+            continue
+        for transcript in _reference_transcripts_of_gene(gene):
+            record = TranscriptRecord.from_transcript(transcript)
+            transcript_tuples.append(record.to_tuple())
+            sequence = ReferenceSequence(record)
+            if upstream_reading_frames:
+                upstream_sequences.extend(
+                    _upstream_reading_frames(
+                        sequence,
+                        min_peptide_length=min_peptide_length,
+                        start_codons=start_codons,
+                        min_translation_initiation_score=min_translation_initiation_score,
+                        memo=memo))
+            if downstream_reading_frames:
+                downstream_sequences.extend(
+                    _downstream_reading_frames(
+                        sequence,
+                        min_peptide_length=min_peptide_length,
+                        start_codons=start_codons,
+                        min_translation_initiation_score=min_translation_initiation_score,
+                        memo=memo))
+    return (
+        transcript_tuples,
+        upstream_sequences,
+        downstream_sequences,
+        memo.n_translated,
+        memo.n_reused,
+    )
+
+
+def generate_sources_by_contig(
+        genome,
+        n_processes,
+        restrict_sources_to_gene_name=None,
+        upstream_reading_frames=False,
+        downstream_reading_frames=False,
+        min_peptide_length=7,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0):
+    """
+    Generate reference sequences, and optionally upstream and downstream
+    reading frames, in a pool of worker processes which each handle the
+    genes of one contig at a time.
+
+    Workers are spawned rather than forked and receive a pickled copy of
+    the genome, so each one opens its own pyensembl database and FASTA
+    handles. Transcripts come back as tuples of TranscriptRecord fields
+    instead of pyensembl objects.
+
+    Parameters
+    ----------
+    genome : pyensembl.Genome
+
+    n_processes : int
+
+    Other parameters are the same as for generate_protein_sequences.
+
+    Returns
+    -------
+    Lists of ReferenceSequence, UpstreamORF and DownstreamORF
+    """
+    tasks = [
+        (
+            genome,
+            contig,
+            restrict_sources_to_gene_name,
+            upstream_reading_frames,
+            downstream_reading_frames,
+            min_peptide_length,
+            tuple(start_codons),
+            min_translation_initiation_score,
+        )
+        for contig in genome.contigs()
+    ]
+    print("Gathering reference genes from %d contigs with %d processes" % (
+        len(tasks),
+        n_processes))
+    reference_sequences = []
+    upstream_sequences = []
+    downstream_sequences = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_processes) as pool:
+        results = pool.starmap(_generate_contig_sources, tasks, chunksize=1)
+    n_translated = n_reused = 0
+    for (transcript_tuples,
+            contig_upstream,
+            contig_downstream,
+            contig_n_translated,
+            contig_n_reused) in results:
+        n_translated += contig_n_translated
+        n_reused += contig_n_reused
+        reference_sequences.extend(
+            ReferenceSequence(TranscriptRecord.from_tuple(fields))
+            for fields in transcript_tuples)
+        upstream_sequences.extend(contig_upstream)
+        downstream_sequences.extend(contig_downstream)
+    if upstream_reading_frames:
+        print("Generated %d upstream reading frames" % len(upstream_sequences))
+    if downstream_reading_frames:
+        print("Generated %d downstream reading frames" % len(downstream_sequences))
+    _print_reused_translations(n_translated, n_reused)
+    return reference_sequences, upstream_sequences, downstream_sequences
+
+def generate_mutant_sequences(variants, max_peptide_length=None, n_processes=1):
     """
     Parameters
     ----------
     variants : varcode.VariantCollection
 
+    max_peptide_length : int or None
+        If given, only keep the part of each mutant protein whose peptides
+        up to this length overlap the mutation, see MutantSequence
+
+    n_processes : int
+        If more than one, predict the effects of chunks of variants in
+        worker processes, see generate_mutant_effect_records
+
     Returns
     -------
     list of MutantSequence
     """
+    if n_processes > 1 and len(variants) > 1:
+        return [
+            MutantSequence.from_effect_record(
+                record,
+                max_peptide_length=max_peptide_length)
+            for record in generate_mutant_effect_records(variants, n_processes)
+        ]
     sequences = []
     effects = variants.effects()
     for effect in effects.top_priority_effect_per_variant().values():
         if effect.modifies_protein_sequence:
-            if effect.mutant_protein_sequence is not None:
-                sequences.append(MutantSequence(effect))
+            if effect.mutant_protein_sequence:
+                sequences.append(
+                    MutantSequence(effect, max_peptide_length=max_peptide_length))
     return sequences
 
 
+def _mutant_effect_records_of_chunk(variants):
+    # runs in a worker process, the variants' genome is unpickled and
+    # opens its own database
+    records = []
+    effects = variants.effects()
+    for effect in effects.top_priority_effect_per_variant().values():
+        if effect.modifies_protein_sequence and effect.mutant_protein_sequence:
+            records.append(mutant_effect_record(effect))
+    return records
+
+
+def generate_mutant_effect_records(variants, n_processes, n_chunks_per_process=4):
+    """
+    Predict the top priority effect of every variant in a pool of spawned
+    worker processes, each handling a contiguous chunk of the variants as
+    its own VariantCollection.
+
+    Records come back in the order of the variants, so that the result is
+    the same as from the top_priority_effect_per_variant of
+    variants.effects() in one process.
+
+    Parameters
+    ----------
+    variants : varcode.VariantCollection
+
+    n_processes : int
+
+    n_chunks_per_process : int
+        Smaller chunks balance the work better between processes
+
+    Returns
+    -------
+    list of tuples from mutant_sequence.mutant_effect_record, for the
+    variants whose top priority effect changes the protein sequence
+    """
+    elements = list(variants)
+    n_chunks = min(len(elements), n_processes * n_chunks_per_process)
+    chunk_size = -(-len(elements) // n_chunks)
+    chunks = [
+        variants.clone_with_new_elements(elements[i:i + chunk_size])
+        for i in range(0, len(elements), chunk_size)
+    ]
+    print("Predicting effects of %d variants in %d chunks with %d processes" % (
+        len(elements),
+        len(chunks),
+        n_processes))
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_processes) as pool:
+        chunk_records = pool.map(_mutant_effect_records_of_chunk, chunks, chunksize=1)
+    return [record for records in chunk_records for record in records]
+
+
 def generate_upstream_reading_frames(
         sequences,
-        min_peptide_length=7):
+        min_peptide_length=7,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0):
     """
 
     Parameters
@@ -78,26 +312,53 @@ def generate_upstream_reading_frames(
 
     min_peptide_length : int
 
+    start_codons : collection of str
+        ATG and/or the near-cognate start codons in kozak.ALT_START_CODONS
+
+    min_translation_initiation_score : float
+        Skip start codons with a lower kozak.translation_initiation_score
+
     Returns
     -------
     list of AltORF
     """
     results = []
+    memo = ReadingFrameMemo()
     for sequence in progressbar(sequences):
         results.extend(
-            generate_alt_reading_frames(
+            _upstream_reading_frames(
                 sequence,
                 min_peptide_length=min_peptide_length,
-                search_start_offset=None,
-                search_end_offset=0))
+                start_codons=start_codons,
+                min_translation_initiation_score=min_translation_initiation_score,
+                memo=memo))
     print("Generated %d upstream reading frames" % len(results))
+    _print_reused_translations(memo.n_translated, memo.n_reused)
     return results
 
 
+def _upstream_reading_frames(
+        sequence,
+        min_peptide_length=7,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        memo=None):
+    return generate_alt_reading_frames(
+        sequence,
+        min_peptide_length=min_peptide_length,
+        search_start_offset=None,
+        search_end_offset=0,
+        start_codons=start_codons,
+        min_translation_initiation_score=min_translation_initiation_score,
+        memo=memo)
+
+
 def generate_downstream_reading_frames(
         sequences,
         min_peptide_length=7,
-        search_end_offset=500):
+        search_end_offset=500,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0):
     """
     Parameters
     ----------
@@ -111,32 +372,83 @@ def generate_downstream_reading_frames(
         "miniMAVS, you complete me!" managed to find an alternative start
         site 400bp downstream from the annotated start of MAVS.
 
+    start_codons : collection of str
+        ATG and/or the near-cognate start codons in kozak.ALT_START_CODONS
+
+    min_translation_initiation_score : float
+        Skip start codons with a lower kozak.translation_initiation_score
+
     Returns
     -------
     list of DownstreamORF
     """
     results = []
+    memo = ReadingFrameMemo()
     for sequence in progressbar(sequences):
         results.extend(
-            generate_alt_reading_frames(
+            _downstream_reading_frames(
                 sequence,
                 min_peptide_length=min_peptide_length,
-                search_start_offset=3,
-                search_end_offset=search_end_offset))
+                search_end_offset=search_end_offset,
+                start_codons=start_codons,
+                min_translation_initiation_score=min_translation_initiation_score,
+                memo=memo))
     print("Generated %d downstream reading frames" % len(results))
+    _print_reused_translations(memo.n_translated, memo.n_reused)
     return results
 
-def generate_skipped_exon_sequences(sequences):
+
+def _downstream_reading_frames(
+        sequence,
+        min_peptide_length=7,
+        search_end_offset=500,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        memo=None):
+    return generate_alt_reading_frames(
+        sequence,
+        min_peptide_length=min_peptide_length,
+        search_start_offset=3,
+        search_end_offset=search_end_offset,
+        start_codons=start_codons,
+        min_translation_initiation_score=min_translation_initiation_score,
+        memo=memo)
+
+def _print_reused_translations(n_translated, n_reused):
+    if n_reused:
+        print("Avoided %d of %d reading frame translations shared between isoforms" % (
+            n_reused,
+            n_translated + n_reused))
+
+
+def generate_skipped_exon_sequences(
+        sequences,
+        min_peptide_length=7,
+        max_peptide_length=20):
     """
     Parameters
     ----------
     sequences : list of ReferenceSequence
 
+    min_peptide_length : int
+
+    max_peptide_length : int
+        Longest peptide which will be extracted, only peptides up to this
+        length which span a new junction are kept
+
     Returns
     -------
     list of ExonSkipSequence
     """
-    pass
+    results = []
+    for sequence in progressbar(sequences):
+        results.extend(
+            generate_exon_skip_sequences(
+                sequence,
+                min_peptide_length=min_peptide_length,
+                max_peptide_length=max_peptide_length))
+    print("Generated %d skipped exon sequences" % len(results))
+    return results
 
 
 def generate_protein_sequences(
@@ -146,12 +458,16 @@ def generate_protein_sequences(
         downstream_reading_frames=False,
         skip_exons=False,
         restrict_sources_to_gene_name=None,
-        min_peptide_length=7):
+        min_peptide_length=7,
+        max_peptide_length=20,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        n_processes=1):
     """
 
     Parameters
     ----------
-    genome : pyensembl.Genome
+    genome : pyensembl.Genome or TranscriptSnapshot
 
     variants : varcode.VariantCollection
 
@@ -165,31 +481,148 @@ def generate_protein_sequences(
 
     min_peptide_length : int
 
+    max_peptide_length : int or None
+        Longest peptide which will be extracted, limits the sequences of
+        skipped exons and mutations to the peptides spanning the change.
+        If None then keep their whole proteins.
+
+    start_codons : collection of str
+        Start codons of upstream and downstream reading frames
+
+    min_translation_initiation_score : float
+        Lowest translation initiation score of their start codons
+
+    n_processes : int
+        Number of worker processes for generating reference sequences and
+        reading frames, see generate_sources_by_contig, and for predicting
+        variant effects, see generate_mutant_effect_records
+
     Returns list of msmhc.Sequence
     """
-    print("Generating sequences from reference transcripts")
-    reference_sequences = generate_reference_sequences(
-        genome,
-        restrict_sources_to_gene_name=restrict_sources_to_gene_name)
-    sequences = reference_sequences.copy()
-    if upstream_reading_frames:
-        print("Generating sequences from upstream reading frames")
-        sequences.extend(
-            generate_upstream_reading_frames(
-                reference_sequences,
-                min_peptide_length=min_peptide_length))
-    if downstream_reading_frames:
-        print("Generating sequences from downstream reading frames")
-        sequences.extend(
-            generate_downstream_reading_frames(
-                reference_sequences,
-                min_peptide_length=min_peptide_length))
+    if n_processes > 1 and not isinstance(genome, TranscriptSnapshot):
+        # reading frames are generated by the same workers as the
+        # transcripts they come from
+        reference_sequences, upstream_sequences, downstream_sequences = \
+            generate_sources_by_contig(
+                genome,
+                n_processes,
+                restrict_sources_to_gene_name=restrict_sources_to_gene_name,
+                upstream_reading_frames=upstream_reading_frames,
+                downstream_reading_frames=downstream_reading_frames,
+                min_peptide_length=min_peptide_length,
+                start_codons=start_codons,
+                min_translation_initiation_score=min_translation_initiation_score)
+        sequences = reference_sequences + upstream_sequences + downstream_sequences
+    else:
+        print("Generating sequences from reference transcripts")
+        reference_sequences = generate_reference_sequences(
+            genome,
+            restrict_sources_to_gene_name=restrict_sources_to_gene_name)
+        sequences = reference_sequences.copy()
+        if upstream_reading_frames:
+            print("Generating sequences from upstream reading frames")
+            sequences.extend(
+                generate_upstream_reading_frames(
+                    reference_sequences,
+                    min_peptide_length=min_peptide_length,
+                    start_codons=start_codons,
+                    min_translation_initiation_score=min_translation_initiation_score))
+        if downstream_reading_frames:
+            print("Generating sequences from downstream reading frames")
+            sequences.extend(
+                generate_downstream_reading_frames(
+                    reference_sequences,
+                    min_peptide_length=min_peptide_length,
+                    start_codons=start_codons,
+                    min_translation_initiation_score=min_translation_initiation_score))
     if skip_exons:
         print("Generating sequences from skipped exons")
-        sequences.extend(generate_skipped_exon_sequences(reference_sequences))
+        sequences.extend(
+            generate_skipped_exon_sequences(
+                reference_sequences,
+                min_peptide_length=min_peptide_length,
+                max_peptide_length=max_peptide_length))
     if variants:
         print("Generating sequences from %d variants" % len(variants))
-        sequences.extend(generate_mutant_sequences(variants))
+        sequences.extend(
+            generate_mutant_sequences(
+                variants,
+                max_peptide_length=max_peptide_length,
+                n_processes=n_processes))
     return sequences
 
 
+def generate_protein_sequence_groups(
+        genome,
+        variants=[],
+        upstream_reading_frames=False,
+        downstream_reading_frames=False,
+        skip_exons=False,
+        restrict_sources_to_gene_name=None,
+        min_peptide_length=7,
+        max_peptide_length=20,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        n_processes=1):
+    """
+    Generator version of generate_protein_sequences which yields the
+    sequences of one gene at a time, so that the sequences of the whole
+    genome never have to be in memory at once.
+
+    Parameters are the same as for generate_protein_sequences, but
+    n_processes is only used for predicting variant effects.
+
+    Yields
+    ------
+    Pairs of gene ID and list of msmhc.Sequence, every sequence derived
+    from the gene's transcripts or from variants affecting them
+    """
+    mutant_sequences_by_gene = defaultdict(list)
+    if variants:
+        print("Generating sequences from %d variants" % len(variants))
+        for sequence in generate_mutant_sequences(
+                variants,
+                max_peptide_length=max_peptide_length,
+                n_processes=n_processes):
+            gene_id = sequence.base_attributes().get("gene_id")
+            mutant_sequences_by_gene[gene_id].append(sequence)
+
+    print("Generating sequences one gene at a time")
+    memo = ReadingFrameMemo()
+    for gene_id, reference_sequences in _iter_reference_sequences_by_gene(
+            genome,
+            restrict_sources_to_gene_name=restrict_sources_to_gene_name):
+        sequences = list(reference_sequences)
+        if upstream_reading_frames:
+            for sequence in reference_sequences:
+                sequences.extend(
+                    _upstream_reading_frames(
+                        sequence,
+                        min_peptide_length=min_peptide_length,
+                        start_codons=start_codons,
+                        min_translation_initiation_score=min_translation_initiation_score,
+                        memo=memo))
+        if downstream_reading_frames:
+            for sequence in reference_sequences:
+                sequences.extend(
+                    _downstream_reading_frames(
+                        sequence,
+                        min_peptide_length=min_peptide_length,
+                        start_codons=start_codons,
+                        min_translation_initiation_score=min_translation_initiation_score,
+                        memo=memo))
+        if skip_exons:
+            for sequence in reference_sequences:
+                sequences.extend(
+                    generate_exon_skip_sequences(
+                        sequence,
+                        min_peptide_length=min_peptide_length,
+                        max_peptide_length=max_peptide_length))
+        sequences.extend(mutant_sequences_by_gene.pop(gene_id, []))
+        if sequences:
+            yield gene_id, sequences
+    _print_reused_translations(memo.n_translated, memo.n_reused)
+
+    # variants in genes which weren't visited above still get their own group
+    for gene_id in sorted(mutant_sequences_by_gene, key=str):
+        yield gene_id, mutant_sequences_by_gene[gene_id]
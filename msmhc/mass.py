@@ -10,6 +10,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+
 mass_table = """
 # letter mono-isotropic-mass average-mass three-letters
 A	71.037114	71.0779	Ala
@@ -44,6 +46,16 @@ for line in mass_table.split("\n"):
         average_mass = float(parts[2])
         mass_dict[letter] = average_mass
 
+# peptides longer than this get their masses one at a time, so that the
+# padded array of residue masses in masses_of_peptides stays small
+_max_batch_length = 64
+
+_mass_table = np.full(256, np.nan)
+_mass_table[0] = 0.0
+for _letter, _mass in mass_dict.items():
+    _mass_table[ord(_letter)] = _mass
+
+
 def mass_of_peptide(peptide):
     """
     Add up average monomeric masses for each residue in peptide
@@ -59,4 +71,37 @@ def mass_of_peptide(peptide):
     return sum([mass_dict[amino_acid] for amino_acid in peptide])
 
 
+def masses_of_peptides(peptides):
+    """
+    Masses of many peptides at once, identical to calling mass_of_peptide
+    on each of them: residue masses are added one position at a time in
+    the same left to right order as sum().
 
+    Parameters
+    ----------
+    peptides : list of str
+
+    Returns
+    -------
+    float64 array
+    """
+    n = len(peptides)
+    masses = np.zeros(n)
+    lengths = np.fromiter((len(p) for p in peptides), dtype=np.int64, count=n)
+    is_short = lengths <= _max_batch_length
+    short_peptides = [p for (p, short) in zip(peptides, is_short) if short]
+    width = int(lengths[is_short].max(initial=0))
+    if width > 0:
+        # fixed width bytes are padded with NUL, whose mass is 0
+        raw = np.array(short_peptides, dtype="S%d" % width).view(np.uint8).reshape(
+            len(short_peptides), width)
+        residue_masses = _mass_table[raw]
+        if np.isnan(residue_masses).any():
+            raise KeyError(chr(raw[np.isnan(residue_masses)][0]))
+        short_masses = np.zeros(len(short_peptides))
+        for j in range(width):
+            short_masses += residue_masses[:, j]
+        masses[is_short] = short_masses
+    for i in np.flatnonzero(~is_short):
+        masses[i] = mass_of_peptide(peptides[i])
+    return masses
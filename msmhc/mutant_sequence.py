@@ -10,8 +10,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from .protein_changes import changed_interval, peptide_window
 from .sequence import Sequence
 
+def mutant_effect_record(effect):
+    """
+    Fields of a protein changing varcode effect which MutantSequence
+    uses, as a tuple which is cheap to send between processes:
+    variant description, effect description, transcript ID, transcript
+    name, gene ID, gene name, mutant protein sequence, and the start and
+    end of the changed residues in the mutant protein.
+    """
+    mutant_protein = effect.mutant_protein_sequence
+    # residues before the effect's start offset are unchanged, the
+    # comparison finds where the mutant protein rejoins the original
+    mutation_start, mutation_end = changed_interval(
+        mutant_protein,
+        effect.transcript.protein_sequence or "",
+        start=getattr(effect, "aa_mutation_start_offset", None) or 0)
+    return (
+        effect.variant.short_description,
+        effect.short_description.replace(" ", "-"),
+        effect.transcript.transcript_id,
+        effect.transcript.transcript_name,
+        effect.transcript.gene.gene_id,
+        effect.transcript.gene.gene_name,
+        mutant_protein,
+        mutation_start,
+        mutation_end,
+    )
+
+
 class MutantSequence(Sequence):
     """
     Representation of protein sequences from reference transcripts
@@ -20,24 +49,68 @@ class MutantSequence(Sequence):
     __slots__ = [
         "effect",
         "_sanitized_effect_description",
+        "mutation_start",
+        "mutation_end",
+        "protein_start",
     ]
 
-    def __init__(self, effect):
+    def __init__(self, effect, max_peptide_length=None):
+        """
+        Parameters
+        ----------
+        effect : varcode.effects.MutationEffect
+            Effect which modifies the protein sequence of its transcript
+
+        max_peptide_length : int or None
+            If given, only keep the residues of the mutant protein which
+            are part of a peptide up to this length overlapping the
+            mutation. Everything downstream of a frameshift or a lost stop
+            codon is kept.
+        """
         self.effect = effect
-        self._sanitized_effect_description = \
-            self.effect.short_description.replace(" ", "-")
+        self._init_from_record(
+            mutant_effect_record(effect),
+            max_peptide_length=max_peptide_length)
+
+    @classmethod
+    def from_effect_record(cls, record, max_peptide_length=None):
+        """
+        Create a MutantSequence from the result of mutant_effect_record,
+        without the effect itself.
+        """
+        sequence = cls.__new__(cls)
+        sequence.effect = None
+        sequence._init_from_record(record, max_peptide_length=max_peptide_length)
+        return sequence
+
+    def _init_from_record(self, record, max_peptide_length):
+        (
+            variant_description,
+            effect_description,
+            transcript_id,
+            transcript_name,
+            gene_id,
+            gene_name,
+            mutant_protein,
+            self.mutation_start,
+            self.mutation_end,
+        ) = record
+        self._sanitized_effect_description = effect_description
+        self.protein_start, protein_end = peptide_window(
+            self.mutation_start,
+            self.mutation_end,
+            protein_length=len(mutant_protein),
+            max_peptide_length=max_peptide_length)
         Sequence.__init__(
             self,
-            name="mut-%s-%s" % (
-                self._sanitized_effect_description,
-                effect.transcript.transcript_id),
-            amino_acids=self.effect.mutant_protein_sequence,
+            name="mut-%s-%s" % (effect_description, transcript_id),
+            amino_acids=mutant_protein[self.protein_start:protein_end],
             attributes={
                 "source": "mutation",
-                "genomic_variant": effect.variant.short_description,
-                "protein_effect": self._sanitized_effect_description,
-                "transcript_id": effect.transcript.transcript_id,
-                "transcript_name": effect.transcript.transcript_name,
-                "gene_id": effect.transcript.gene.gene_id,
-                "gene_name": effect.transcript.gene.gene_name,
+                "genomic_variant": variant_description,
+                "protein_effect": effect_description,
+                "transcript_id": transcript_id,
+                "transcript_name": transcript_name,
+                "gene_id": gene_id,
+                "gene_name": gene_name,
             })
@@ -1,4 +1,4 @@
-from math import log, ceil
+import numpy as np
 
 classical_amino_acids = "RHKDESTNQCGPAVILMFYW"
 assert len(classical_amino_acids) == 20
@@ -19,11 +19,9 @@ def peptide_to_int(sequence):
 
 def int_to_peptide(numerical_representation):
     letters = []
-    while numerical_representation >= n_aa:
-        current_idx = numerical_representation % base - 1
-        numerical_representation = numerical_representation // base
-        letters.append(amino_acids[current_idx])
-    letters.append(amino_acids[numerical_representation - 1])
+    while numerical_representation > 0:
+        numerical_representation, digit = divmod(numerical_representation, base)
+        letters.append(amino_acids[digit - 1])
     return "".join(letters)
 
 
@@ -31,10 +29,162 @@ def drop_first_letter(numerical_representation):
     return numerical_representation // base
 
 def peptide_length(numerical_representation):
-    if numerical_representation < base:
-        return 1
-    exponent = log(numerical_representation, base)
-    return int(ceil(exponent))
+    # count digits with integer division, a floating point logarithm
+    # rounds the wrong way for large values
+    length = 0
+    while numerical_representation > 0:
+        numerical_representation //= base
+        length += 1
+    return length
 
 def drop_last_letter(numerical_representation):
     return numerical_representation % (base ** (peptide_length(numerical_representation) - 1))
+
+
+# Batch versions of the functions above, on NumPy arrays of uint64.
+# Every residue is one base-22 digit (never 0, which marks the end of the
+# peptide), so LETTERS_PER_WORD residues fit in one uint64 and peptides up to
+# MAX_BATCH_LENGTH residues use two words: an array of shape (n, 2) holding
+# the first LETTERS_PER_WORD residues in column 0 and the rest in column 1,
+# i.e. the integer of peptide_to_int split as divmod(x, base ** LETTERS_PER_WORD)
+# in reverse order. Peptides which all fit in one word use a 1d array.
+
+LETTERS_PER_WORD = 14
+MAX_BATCH_LENGTH = 2 * LETTERS_PER_WORD
+assert base ** LETTERS_PER_WORD < 2 ** 64
+
+_powers = np.array(
+    [base ** i for i in range(LETTERS_PER_WORD + 1)],
+    dtype=np.uint64)
+
+_digit_table = np.zeros(256, dtype=np.uint8)
+_letter_table = np.zeros(base, dtype=np.uint8)
+for _i, _aa in enumerate(amino_acids):
+    _digit_table[ord(_aa)] = _i + 1
+    _letter_table[_i + 1] = ord(_aa)
+
+
+def _as_words(values):
+    values = np.asarray(values, dtype=np.uint64)
+    if values.ndim == 1:
+        return values[:, np.newaxis]
+    return values
+
+
+def _from_words(words):
+    if words.shape[1] == 1:
+        return words[:, 0]
+    return words
+
+
+def peptides_to_ints(peptides, two_words=None):
+    """
+    Encode a list of peptides into an array of integers.
+
+    Parameters
+    ----------
+    peptides : list of str
+
+    two_words : bool or None
+        Whether to use the two word encoding, by default only if some
+        peptide is longer than LETTERS_PER_WORD.
+
+    Returns
+    -------
+    uint64 array of shape (n,) or (n, 2)
+    """
+    n = len(peptides)
+    width = max((len(p) for p in peptides), default=0)
+    if width > MAX_BATCH_LENGTH:
+        raise ValueError(
+            "Peptides longer than %d can't be encoded, got length %d" % (
+                MAX_BATCH_LENGTH, width))
+    if two_words is None:
+        two_words = width > LETTERS_PER_WORD
+    elif not two_words and width > LETTERS_PER_WORD:
+        raise ValueError(
+            "Peptide of length %d does not fit in one word" % width)
+    n_words = 2 if two_words else 1
+    words = np.zeros((n, n_words), dtype=np.uint64)
+    if n == 0 or width == 0:
+        return _from_words(words)
+    # a fixed width bytes array pads each peptide with NUL bytes, which
+    # map to the digit 0 and so don't change the encoded value
+    raw = np.array(peptides, dtype="S%d" % width).view(np.uint8).reshape(n, width)
+    digits = _digit_table[raw]
+    bad = (digits == 0) & (raw != 0)
+    if bad.any():
+        raise KeyError(chr(raw[bad][0]))
+    for word_index in range(n_words):
+        first = word_index * LETTERS_PER_WORD
+        last = min(width, first + LETTERS_PER_WORD)
+        # Horner's rule from the last residue of the word, all in exact
+        # integer arithmetic since the result is below base ** LETTERS_PER_WORD
+        word = words[:, word_index]
+        for j in range(last - 1, first - 1, -1):
+            word *= np.uint64(base)
+            word += digits[:, j]
+    return _from_words(words)
+
+
+def peptide_lengths(values):
+    """
+    Exact number of residues of each encoded peptide.
+    """
+    words = _as_words(values)
+    lengths = np.zeros(len(words), dtype=np.int64)
+    for word_index in range(words.shape[1]):
+        # a word with d digits lies in [base ** (d - 1), base ** d)
+        lengths += np.searchsorted(
+            _powers[:LETTERS_PER_WORD], words[:, word_index], side="right")
+    return lengths
+
+
+def ints_to_peptides(values):
+    """
+    Decode an array made by peptides_to_ints back into a list of str.
+    """
+    words = _as_words(values)
+    n, n_words = words.shape
+    width = n_words * LETTERS_PER_WORD
+    ascii_bytes = np.empty((n, width + 1), dtype=np.uint8)
+    for word_index in range(n_words):
+        remaining = words[:, word_index].copy()
+        for j in range(LETTERS_PER_WORD):
+            digit = remaining % np.uint64(base)
+            remaining //= np.uint64(base)
+            ascii_bytes[:, word_index * LETTERS_PER_WORD + j] = _letter_table[digit]
+    # decode all peptides as one newline separated string, digits past the
+    # end of each peptide decode to NUL characters which are dropped
+    ascii_bytes[:, width] = ord("\n")
+    text = ascii_bytes.tobytes().decode("ascii").replace("\0", "")
+    return text.split("\n")[:-1]
+
+
+def drop_first_letters(values, n_letters=1):
+    """
+    Remove the first n_letters residues from every encoded peptide.
+    """
+    if not 0 <= n_letters <= LETTERS_PER_WORD:
+        raise ValueError("Can only drop 0-%d letters at once" % LETTERS_PER_WORD)
+    words = _as_words(values).copy()
+    divisor = _powers[n_letters]
+    words[:, 0] //= divisor
+    if words.shape[1] == 2:
+        # digits shifted out of the second word move into the top of the first
+        words[:, 0] += (words[:, 1] % divisor) * _powers[LETTERS_PER_WORD - n_letters]
+        words[:, 1] //= divisor
+    return _from_words(words)
+
+
+def drop_last_letters(values, n_letters=1):
+    """
+    Remove the last n_letters residues from every encoded peptide.
+    """
+    words = _as_words(values).copy()
+    new_lengths = np.maximum(peptide_lengths(words) - n_letters, 0)
+    in_first_word = np.minimum(new_lengths, LETTERS_PER_WORD)
+    words[:, 0] %= _powers[in_first_word]
+    if words.shape[1] == 2:
+        words[:, 1] %= _powers[new_lengths - in_first_word]
+    return _from_words(words)
@@ -0,0 +1,162 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import Counter
+import os
+
+import numpy as np
+from progressbar import progressbar
+
+from .mass import masses_of_peptides
+from .peptides import iter_collapsed_peptide_sources
+
+
+class RecordWriter(object):
+    """
+    Destination of generated records: an open FASTA file, a
+    msmhc.peptide_database.PeptideDatabaseWriter or both. Can be given
+    instead of a file handle to every function here which writes records,
+    so that a peptide database is written straight from the generated
+    sequences.
+    """
+    __slots__ = ["fasta_file", "database_writer"]
+
+    def __init__(self, fasta_file=None, database_writer=None):
+        self.fasta_file = fasta_file
+        self.database_writer = database_writer
+
+    def write_chunk(self, sequences):
+        if self.fasta_file is not None:
+            write_fasta_chunk(sequences, self.fasta_file)
+        if self.database_writer is not None:
+            self.database_writer.write(sequences)
+
+    def close(self):
+        if self.fasta_file is not None:
+            self.fasta_file.close()
+        if self.database_writer is not None:
+            self.database_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_fasta_records(sequences, file_handle):
+    """
+    Write every sequence to an open FASTA file.
+
+    Parameters
+    ----------
+    sequences : iterable of Sequence
+
+    file_handle : file or RecordWriter
+
+    Returns
+    -------
+    Number of records written
+    """
+    n_records = 0
+    for chunk in _chunks(progressbar(sequences), chunk_size=2 ** 14):
+        write_fasta_chunk(chunk, file_handle)
+        n_records += len(chunk)
+    return n_records
+
+
+def write_fasta_chunk(sequences, file_handle):
+    """
+    Write a list of sequences to an open FASTA file without a progress bar,
+    computing the masses of all of them at once.
+    """
+    if isinstance(file_handle, RecordWriter):
+        file_handle.write_chunk(sequences)
+        return
+    masses = masses_of_peptides([seq.amino_acids for seq in sequences]).tolist()
+    # collapsed peptides share attribute dictionaries, so only format each
+    # one once. The dictionaries are kept alive in the cache so that their
+    # ids can't be reused by other dictionaries while it's in use.
+    formatted_cache = {}
+    for seq, mass in zip(sequences, masses):
+        base_attributes = seq.base_attributes()
+        cached = formatted_cache.get(id(base_attributes))
+        if cached is None:
+            cached = (
+                base_attributes,
+                seq.formatted_base_attributes(base_attributes))
+            formatted_cache[id(base_attributes)] = cached
+        file_handle.write(seq.fasta_string(
+            mass=mass,
+            formatted_base_attributes=cached[1]))
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_collapsed_hits(
+        peptide_index_blocks,
+        file_handle,
+        name_group_counts=None,
+        key_file=None):
+    """
+    Collapse the sources of a stream of peptide index blocks and write each
+    resulting hit to a FASTA file as soon as it's been named.
+
+    Parameters
+    ----------
+    peptide_index_blocks : iterable of PeptideSourceIndex
+        Blocks of one index in sorted order, such as the output of
+        msmhc.external_kmers.iter_external_peptide_index
+
+    file_handle : file or RecordWriter
+
+    name_group_counts : collections.Counter or None
+        Names already used by earlier hits, updated in place
+
+    key_file : binary file or None
+        If given, the packed keys of the hits are appended to it, so that
+        decoys can be made from them afterwards (see load_hit_keys)
+
+    Returns
+    -------
+    Number of hits written
+    """
+    if name_group_counts is None:
+        name_group_counts = Counter()
+    n_hits = 0
+    for block in peptide_index_blocks:
+        if key_file is not None:
+            key_file.write(np.ascontiguousarray(block.keys).tobytes())
+        hits = iter_collapsed_peptide_sources(block, name_group_counts)
+        for chunk in _chunks(hits, chunk_size=2 ** 14):
+            write_fasta_chunk(chunk, file_handle)
+            n_hits += len(chunk)
+    return n_hits
+
+
+def load_hit_keys(path, n_words):
+    """
+    Memory-map the packed keys written to a key file by
+    write_collapsed_hits, which are sorted and distinct.
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, n_words), dtype=np.uint64)
+    return np.memmap(path, dtype=np.uint64, mode="r").reshape(-1, n_words)
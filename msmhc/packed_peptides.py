@@ -0,0 +1,566 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fixed-width integer encoding of peptides, used to extract and deduplicate
+k-mers from many protein sequences with NumPy instead of Python strings.
+
+Every residue is stored in 5 bits, with residue codes assigned in ASCII
+order and 0 reserved for padding. Each peptide is packed big-endian into one
+or more uint64 words (12 residues per word), so sorting the packed keys
+lexicographically by word gives the same order as sorting the peptide strings.
+"""
+
+import numpy as np
+
+BITS_PER_RESIDUE = 5
+RESIDUES_PER_WORD = 64 // BITS_PER_RESIDUE
+
+# number of leading residues used to partition k-mer space into shards
+PREFIX_RESIDUES = 2
+N_PREFIXES = 2 ** (BITS_PER_RESIDUE * PREFIX_RESIDUES)
+
+# all uppercase letters (covers ambiguity codes such as X, B, Z as well as
+# selenocysteine U and pyrrolysine O) plus the stop codon symbol
+packed_alphabet = "".join(sorted("ABCDEFGHIJKLMNOPQRSTUVWXYZ*"))
+assert len(packed_alphabet) < 2 ** BITS_PER_RESIDUE
+
+_encode_table = np.zeros(256, dtype=np.uint8)
+_decode_table = np.zeros(2 ** BITS_PER_RESIDUE, dtype=np.uint8)
+for _i, _aa in enumerate(packed_alphabet):
+    _encode_table[ord(_aa)] = _i + 1
+    _decode_table[_i + 1] = ord(_aa)
+
+
+def n_words_for_length(max_length):
+    """
+    Number of uint64 words needed to pack peptides of the given length.
+    """
+    return max(1, (max_length + RESIDUES_PER_WORD - 1) // RESIDUES_PER_WORD)
+
+
+def encode_amino_acids(amino_acid_strings):
+    """
+    Encode a collection of protein sequences into one concatenated buffer of
+    residue codes.
+
+    Parameters
+    ----------
+    amino_acid_strings : list of str
+
+    Returns
+    -------
+    Tuple of two arrays:
+        - uint8 residue codes for all sequences back to back
+        - int64 offsets of length n_sequences + 1, sequence i occupies
+          residues[offsets[i]:offsets[i + 1]]
+    """
+    n = len(amino_acid_strings)
+    lengths = np.fromiter(
+        (len(s) for s in amino_acid_strings),
+        dtype=np.int64,
+        count=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    try:
+        raw = "".join(amino_acid_strings).encode("ascii")
+    except UnicodeEncodeError:
+        raise ValueError("Protein sequences must only contain ASCII letters")
+    residues = _encode_table[np.frombuffer(raw, dtype=np.uint8)]
+    if len(residues) > 0 and residues.min() == 0:
+        bad_letter = chr(raw[int(np.argmin(residues))])
+        raise ValueError("Unsupported amino acid '%s'" % (bad_letter,))
+    return residues, offsets
+
+
+def window_starts(offsets, k):
+    """
+    Positions in the concatenated residue buffer at which a window of
+    length k starts without running past the end of its sequence.
+
+    Returns
+    -------
+    Tuple of int64 start positions and int32 index of the sequence
+    containing each window.
+    """
+    lengths = np.diff(offsets)
+    n_windows = np.maximum(lengths - k + 1, 0)
+    sequence_ids = np.repeat(
+        np.arange(len(lengths), dtype=np.int32),
+        n_windows)
+    # position of each window within its own sequence
+    first_window_index = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(n_windows, out=first_window_index[1:])
+    local_starts = (
+        np.arange(first_window_index[-1], dtype=np.int64) -
+        np.repeat(first_window_index[:-1], n_windows))
+    starts = np.repeat(offsets[:-1], n_windows) + local_starts
+    return starts, sequence_ids
+
+
+def window_prefixes(residues, starts, k):
+    """
+    Integer made of the first PREFIX_RESIDUES residue codes of each window,
+    ordered the same way as the packed keys of the windows. Used to split
+    k-mer space into contiguous ranges.
+    """
+    prefixes = np.zeros(len(starts), dtype=np.int64)
+    for j in range(PREFIX_RESIDUES):
+        prefixes <<= BITS_PER_RESIDUE
+        if j < k:
+            prefixes |= residues[starts + j]
+    return prefixes
+
+
+def balanced_prefix_ranges(amino_acid_strings, n_ranges):
+    """
+    Split the space of window prefixes into contiguous ranges which each
+    hold roughly the same number of k-mers, estimated from how often each
+    pair of adjacent residues occurs.
+
+    Returns
+    -------
+    list of (start, end) tuples, half-open and covering every prefix
+    """
+    residues, _ = encode_amino_acids(amino_acid_strings)
+    if len(residues) > 1:
+        pairs = (residues[:-1].astype(np.int64) << BITS_PER_RESIDUE) | residues[1:]
+    else:
+        pairs = residues.astype(np.int64) << BITS_PER_RESIDUE
+    cumulative = np.cumsum(np.bincount(pairs, minlength=N_PREFIXES))
+    targets = cumulative[-1] * np.arange(1, n_ranges) / n_ranges
+    boundaries = np.searchsorted(cumulative, targets, side="right")
+    boundaries = [0] + [int(b) for b in boundaries] + [N_PREFIXES]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def pack_windows(residues, starts, k, n_words):
+    """
+    Pack every length-k window of the residue buffer beginning at the given
+    start positions into n_words uint64 words per window.
+
+    Returns
+    -------
+    uint64 array of shape (len(starts), n_words)
+    """
+    keys = np.zeros((len(starts), n_words), dtype=np.uint64)
+    if len(starts) == 0 or len(residues) < k:
+        return keys
+    # one strided view per residue position within the window, so that the
+    # window contents never have to be copied out of the residue buffer
+    n_positions = len(residues) - k + 1
+    for word_index in range(n_words):
+        first = word_index * RESIDUES_PER_WORD
+        last = min(k, first + RESIDUES_PER_WORD)
+        word = np.zeros(n_positions, dtype=np.uint64)
+        for j in range(first, last):
+            shift = np.uint64(
+                BITS_PER_RESIDUE * (RESIDUES_PER_WORD - 1 - (j - first)))
+            word |= residues[j:j + n_positions].astype(np.uint64) << shift
+        keys[:, word_index] = word[starts]
+    return keys
+
+
+def pack_codes(codes, n_words):
+    """
+    Pack a matrix of residue codes, one peptide of the same length per
+    row, into keys comparable with the output of pack_windows.
+
+    Parameters
+    ----------
+    codes : uint8 array of shape (n_peptides, k)
+
+    n_words : int
+
+    Returns
+    -------
+    uint64 array of shape (n_peptides, n_words)
+    """
+    n, k = codes.shape
+    if k > n_words * RESIDUES_PER_WORD:
+        raise ValueError(
+            "Peptide of length %d does not fit in %d words" % (k, n_words))
+    keys = np.zeros((n, n_words), dtype=np.uint64)
+    for j in range(k):
+        shift = np.uint64(
+            BITS_PER_RESIDUE * (RESIDUES_PER_WORD - 1 - j % RESIDUES_PER_WORD))
+        keys[:, j // RESIDUES_PER_WORD] |= codes[:, j].astype(np.uint64) << shift
+    return keys
+
+
+def lexsort_keys(keys, n_significant_words=None):
+    """
+    Indices which stably sort packed keys, with the first word most
+    significant.
+
+    Parameters
+    ----------
+    keys : uint64 array of shape (n, n_words)
+
+    n_significant_words : int or None
+        Only compare this many leading words, useful when the trailing
+        words are known to be all zero (e.g. keys of a single short length).
+    """
+    if n_significant_words is None:
+        n_significant_words = keys.shape[1]
+    if n_significant_words == 1:
+        return np.argsort(keys[:, 0], kind="stable")
+    return np.lexsort([
+        keys[:, i]
+        for i in range(n_significant_words - 1, -1, -1)
+    ])
+
+
+def searchsorted_keys(sorted_keys, query_keys):
+    """
+    For each query key, the first position in sorted_keys whose key is
+    greater than or equal to it, i.e. numpy.searchsorted with side="left"
+    generalized to multi-word keys.
+    """
+    n = len(sorted_keys)
+    n_words = sorted_keys.shape[1]
+    if n_words == 1:
+        return np.searchsorted(sorted_keys[:, 0], query_keys[:, 0])
+    lo = np.zeros(len(query_keys), dtype=np.int64)
+    hi = np.full(len(query_keys), n, dtype=np.int64)
+    active = lo < hi
+    while active.any():
+        mid = (lo + hi) // 2
+        mid_keys = sorted_keys[np.minimum(mid, n - 1)]
+        # lexicographic "mid key < query key" over the words
+        less = np.zeros(len(query_keys), dtype=bool)
+        equal_so_far = np.ones(len(query_keys), dtype=bool)
+        for word_index in range(n_words):
+            a = mid_keys[:, word_index]
+            b = query_keys[:, word_index]
+            less |= equal_so_far & (a < b)
+            equal_so_far &= a == b
+        lo = np.where(active & less, mid + 1, lo)
+        hi = np.where(active & ~less, mid, hi)
+        active = lo < hi
+    return lo
+
+
+def isin_keys(sorted_keys, query_keys):
+    """
+    Boolean mask which is True for each query key present in sorted_keys.
+    """
+    n = len(sorted_keys)
+    if n == 0:
+        return np.zeros(len(query_keys), dtype=bool)
+    positions = searchsorted_keys(sorted_keys, query_keys)
+    found = positions < n
+    found[found] = (
+        np.asarray(sorted_keys[positions[found]]) == query_keys[found]).all(axis=1)
+    return found
+
+
+def key_boundaries(sorted_keys):
+    """
+    Boolean mask which is True at the first occurrence of each distinct key
+    in an array of sorted keys.
+    """
+    n = len(sorted_keys)
+    mask = np.ones(n, dtype=bool)
+    if n > 1:
+        mask[1:] = (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)
+    return mask
+
+
+def packed_lengths(keys):
+    """
+    Number of residues in each packed key.
+    """
+    return (unpack_codes(keys) != 0).sum(axis=1)
+
+
+def unpack_codes(keys):
+    """
+    Residue codes of packed keys as a uint8 array of shape
+    (n_peptides, n_words * RESIDUES_PER_WORD), zero after the end of
+    each peptide.
+    """
+    n, n_words = keys.shape
+    shifts = BITS_PER_RESIDUE * (
+        RESIDUES_PER_WORD - 1 - np.arange(RESIDUES_PER_WORD, dtype=np.uint64))
+    codes = np.zeros((n, n_words * RESIDUES_PER_WORD), dtype=np.uint8)
+    for word_index in range(n_words):
+        word = keys[:, word_index]
+        codes[:, word_index * RESIDUES_PER_WORD:(word_index + 1) * RESIDUES_PER_WORD] = (
+            (word[:, np.newaxis] >> shifts) & np.uint64(31))
+    return codes
+
+
+def unpack_keys(keys, chunk_size=2 ** 20):
+    """
+    Convert packed keys back into peptide strings.
+
+    Parameters
+    ----------
+    keys : uint64 array of shape (n_peptides, n_words)
+
+    chunk_size : int
+        Number of keys to decode at a time, bounds the size of temporary
+        arrays.
+
+    Returns
+    -------
+    list of str
+    """
+    n, n_words = keys.shape
+    width = n_words * RESIDUES_PER_WORD
+    peptides = []
+    for chunk_start in range(0, n, chunk_size):
+        chunk = keys[chunk_start:chunk_start + chunk_size]
+        ascii_bytes = np.empty((len(chunk), width + 1), dtype=np.uint8)
+        ascii_bytes[:, :width] = _decode_table[unpack_codes(chunk)]
+        # decode the whole chunk as one newline separated string, padding
+        # decodes to NUL characters which are dropped before splitting
+        ascii_bytes[:, width] = ord("\n")
+        text = ascii_bytes.tobytes().decode("ascii").replace("\0", "")
+        peptides.extend(text.split("\n")[:-1])
+    return peptides
+
+
+def pack_peptides(peptides, n_words=None):
+    """
+    Pack a list of peptide strings into keys comparable with the output
+    of pack_windows.
+    """
+    if n_words is None:
+        max_length = max((len(p) for p in peptides), default=1)
+        n_words = n_words_for_length(max_length)
+    residues, offsets = encode_amino_acids(peptides)
+    lengths = np.diff(offsets)
+    keys = np.zeros((len(peptides), n_words), dtype=np.uint64)
+    for k in np.unique(lengths).tolist():
+        mask = lengths == k
+        # residues of all peptides of this length, one row per peptide
+        codes = residues[offsets[:-1][mask][:, np.newaxis] + np.arange(k)]
+        keys[mask] = pack_codes(codes, n_words)
+    return keys
+
+
+def merge_key_groups(keys, counts, values):
+    """
+    Sort groups of values by their packed keys, combining groups which
+    share a key.
+
+    Parameters
+    ----------
+    keys : uint64 array of shape (n_groups, n_words)
+
+    counts : int array
+        Number of values in each group
+
+    values : array
+        Values of all groups back to back, in the same order as the keys.
+        Groups with equal keys are concatenated in their input order.
+
+    Returns
+    -------
+    Tuple of sorted distinct keys, int64 offsets of length n_keys + 1 and
+    the reordered values.
+    """
+    group_starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=group_starts[1:])
+    order = lexsort_keys(keys)
+    keys = np.take(keys, order, axis=0)
+    counts = np.take(counts, order)
+    group_starts = np.take(group_starts, order)
+    del order
+    value_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=value_offsets[1:])
+    gather = np.repeat(group_starts - value_offsets[:-1], counts)
+    gather += np.arange(value_offsets[-1], dtype=np.int64)
+    values = np.take(values, gather)
+    del gather
+    is_new = key_boundaries(keys)
+    offsets = np.append(value_offsets[:-1][is_new], value_offsets[-1])
+    return keys[is_new], offsets, values
+
+
+def group_identical_strings(strings):
+    """
+    Group the indices of identical strings.
+
+    Returns
+    -------
+    Tuple of the distinct strings in order of first occurrence, int64
+    offsets of length n_distinct + 1 and the int64 indices of each distinct
+    string's occurrences, in ascending order within each group.
+    """
+    groups = {}
+    for i, string in enumerate(strings):
+        if string in groups:
+            groups[string].append(i)
+        else:
+            groups[string] = [i]
+    group_offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum([len(group) for group in groups.values()], out=group_offsets[1:])
+    members = np.zeros(len(strings), dtype=np.int64)
+    for group, start in zip(groups.values(), group_offsets[:-1].tolist()):
+        members[start:start + len(group)] = group
+    return list(groups), group_offsets, members
+
+
+def count_windows(lengths, min_length, max_length):
+    """
+    Number of k-mer windows, over all lengths from min_length to
+    max_length, in sequences of the given lengths.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return int(sum(
+        np.maximum(lengths - k + 1, 0).sum()
+        for k in range(min_length, max_length + 1)))
+
+
+def _expand_groups(offsets, group_ids, group_offsets, group_members):
+    """
+    Replace every group ID in rows of compressed sparse row data with the
+    members of the group, keeping the members of each row sorted.
+    """
+    group_sizes = np.diff(group_offsets)
+    sizes = group_sizes[group_ids]
+    cumulative_sizes = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=cumulative_sizes[1:])
+    new_offsets = cumulative_sizes[offsets]
+    gather = np.repeat(group_offsets[group_ids] - cumulative_sizes[:-1], sizes)
+    gather += np.arange(cumulative_sizes[-1], dtype=np.int64)
+    members = np.take(group_members, gather).astype(group_ids.dtype)
+    del gather
+    # only rows with more than one group can have members out of order
+    multiple_groups = np.diff(offsets) > 1
+    if multiple_groups.any():
+        row_sizes = np.diff(new_offsets)
+        in_multiple = np.repeat(multiple_groups, row_sizes)
+        rows = np.repeat(np.arange(len(row_sizes)), row_sizes)[in_multiple]
+        unsorted_members = members[in_multiple]
+        members[in_multiple] = unsorted_members[np.lexsort((unsorted_members, rows))]
+    return new_offsets, members
+
+
+def extract_packed_kmers(
+        amino_acid_strings,
+        min_length=7,
+        max_length=20,
+        prefix_range=None,
+        verbose=False):
+    """
+    Find all distinct k-mers in a collection of protein sequences along with
+    the sequences which contain them.
+
+    Identical sequences (e.g. transcripts with the same protein) are only
+    scanned once, their sequence indices are expanded afterwards.
+
+    Parameters
+    ----------
+    amino_acid_strings : list of str
+
+    min_length : int
+
+    max_length : int
+
+    prefix_range : tuple of int or None
+        If given, only keep k-mers whose residue prefix (see
+        window_prefixes) falls in the half-open range (start, end)
+
+    verbose : bool
+        Print how many windows were skipped by deduplicating sequences
+
+    Returns
+    -------
+    Tuple of three arrays:
+        - sorted distinct packed keys, shape (n_peptides, n_words)
+        - int64 offsets of length n_peptides + 1 into the sequence indices
+        - int32 indices of sequences containing each peptide, sorted
+          within each peptide
+    """
+    amino_acid_strings = list(amino_acid_strings)
+    distinct_strings, group_offsets, group_members = group_identical_strings(
+        amino_acid_strings)
+    n_duplicates = len(amino_acid_strings) - len(distinct_strings)
+    if verbose and n_duplicates > 0:
+        n_windows = count_windows(
+            [len(s) for s in amino_acid_strings], min_length, max_length)
+        n_distinct_windows = count_windows(
+            [len(s) for s in distinct_strings], min_length, max_length)
+        print("Scanning %d distinct of %d sequences, %d of %d windows (%d fewer)" % (
+            len(distinct_strings),
+            len(amino_acid_strings),
+            n_distinct_windows,
+            n_windows,
+            n_windows - n_distinct_windows))
+    keys, offsets, distinct_ids = _extract_packed_kmers_of_distinct_strings(
+        distinct_strings,
+        min_length=min_length,
+        max_length=max_length,
+        prefix_range=prefix_range)
+    if n_duplicates == 0:
+        # distinct strings are in their original order
+        return keys, offsets, distinct_ids
+    offsets, sequence_ids = _expand_groups(
+        offsets, distinct_ids, group_offsets, group_members)
+    return keys, offsets, sequence_ids
+
+
+def _extract_packed_kmers_of_distinct_strings(
+        amino_acid_strings,
+        min_length,
+        max_length,
+        prefix_range):
+    n_words = n_words_for_length(max_length)
+    residues, offsets = encode_amino_acids(amino_acid_strings)
+    key_chunks = []
+    count_chunks = []
+    sequence_id_chunks = []
+    for k in range(min_length, max_length + 1):
+        starts, sequence_ids = window_starts(offsets, k)
+        if prefix_range is not None:
+            prefixes = window_prefixes(residues, starts, k)
+            in_range = (prefixes >= prefix_range[0]) & (prefixes < prefix_range[1])
+            starts = starts[in_range]
+            sequence_ids = sequence_ids[in_range]
+            del prefixes, in_range
+        if len(starts) == 0:
+            continue
+        keys = pack_windows(residues, starts, k, n_words)
+        del starts
+        # windows are generated in order of their sequence, so a stable sort
+        # on the keys leaves the sequence IDs of each k-mer in ascending order
+        order = lexsort_keys(keys, n_words_for_length(k))
+        keys = np.take(keys, order, axis=0)
+        sequence_ids = np.take(sequence_ids, order)
+        del order
+        # drop repeated occurrences of a k-mer within the same sequence
+        new_key = key_boundaries(keys)
+        distinct_pair = new_key.copy()
+        distinct_pair[1:] |= sequence_ids[1:] != sequence_ids[:-1]
+        keys = keys[distinct_pair]
+        sequence_ids = sequence_ids[distinct_pair]
+        new_key = new_key[distinct_pair]
+        key_chunks.append(keys[new_key])
+        count_chunks.append(np.diff(np.append(np.flatnonzero(new_key), len(keys))))
+        sequence_id_chunks.append(sequence_ids)
+        del keys, new_key, distinct_pair
+
+    if len(key_chunks) == 0:
+        return (
+            np.zeros((0, n_words), dtype=np.uint64),
+            np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int32))
+
+    # each length was sorted separately, combine them into one global order
+    return merge_key_groups(
+        np.concatenate(key_chunks),
+        np.concatenate(count_chunks),
+        np.concatenate(sequence_id_chunks))
@@ -0,0 +1,419 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Binary peptide database, a directory of flat arrays which can all be
+memory-mapped instead of parsing a FASTA file:
+
+- residues.bin: ASCII amino acids of all records back to back, with
+  residue_offsets.npy giving where each record starts and ends
+- names.bin and name_offsets.npy: the same for record names
+- record_attribute_ids.npy: index of each record's attribute set
+- attribute_offsets.npy, attribute_field_ids.npy, attribute_value_ids.npy:
+  attribute sets in compressed sparse row form, each entry is an index
+  into the field and value dictionaries of attributes.json
+- sorted_order.npy: record indices ordered by amino acids, for lookups
+
+Attribute values are stored as their FASTA strings. Length and mass are
+left out since they're recomputed from the amino acids.
+
+There's no separate source-ID CSR: records are written from collapsed
+peptides, which only keep the combined attributes of their sources (the
+reference cache doesn't store the sources themselves). The identifiers
+of a record's sources, such as their transcript_id or gene_id values,
+are entries of its attribute set, so the attribute CSR doubles as the
+source CSR and PeptideDatabase.source_ids reads them as integer IDs
+without decoding any strings.
+"""
+
+from array import array
+import json
+import os
+import re
+
+import numpy as np
+
+from .common import convert_to_string
+from .packed_peptides import (
+    RESIDUES_PER_WORD,
+    _encode_table,
+    lexsort_keys,
+    n_words_for_length,
+    pack_windows,
+)
+from .output import write_fasta_records
+from .sequence import Sequence
+
+# attributes which every Sequence recomputes from its own amino acids
+_derived_attributes = {"length", "mass"}
+
+# longest records for which the lookup order is computed with packed keys
+_max_packed_sort_length = 5 * RESIDUES_PER_WORD
+
+_array_names = [
+    "residue_offsets",
+    "name_offsets",
+    "record_attribute_ids",
+    "attribute_offsets",
+    "attribute_field_ids",
+    "attribute_value_ids",
+    "sorted_order",
+]
+
+
+def _attribute_value_strings(value):
+    if type(value) in (set, frozenset):
+        return sorted(convert_to_string(v) for v in value)
+    return [convert_to_string(value)]
+
+
+def iter_fasta_records(file_handle):
+    """
+    Parse a FASTA file written by msmhc, yielding a Sequence per record
+    whose attributes map each field to a set of value strings.
+    """
+    name = None
+    header_attributes = None
+    lines = []
+
+    def make_record():
+        attributes = {}
+        for field_and_values in header_attributes:
+            field, values = field_and_values.split("=", 1)
+            if field not in _derived_attributes:
+                attributes[field] = set(values.split(";"))
+        return Sequence(
+            name=name,
+            amino_acids="".join(lines),
+            attributes=attributes)
+
+    for line in file_handle:
+        line = line.rstrip("\n")
+        if line.startswith(">"):
+            if name is not None:
+                yield make_record()
+            # values (e.g. variant descriptions) may contain spaces, so only
+            # split before something which looks like the next field
+            parts = re.split(r" (?=\w+=)", line[1:])
+            name = parts[0]
+            header_attributes = parts[1:]
+            lines = []
+        elif line:
+            lines.append(line)
+    if name is not None:
+        yield make_record()
+
+
+def _lookup_order(residues, residue_offsets, chunk_size=2 ** 20):
+    lengths = np.diff(residue_offsets)
+    max_length = int(lengths.max(initial=0))
+    if max_length <= _max_packed_sort_length:
+        n_words = n_words_for_length(max_length)
+        keys = np.zeros((len(lengths), n_words), dtype=np.uint64)
+        # pack a chunk of records at a time, since pack_windows works on
+        # every position of the residue buffer it's given
+        for chunk_start in range(0, len(lengths), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(lengths))
+            first, last = residue_offsets[chunk_start], residue_offsets[chunk_end]
+            codes = _encode_table[np.asarray(residues[first:last])]
+            if len(codes) > 0 and codes.min() == 0:
+                # letters outside the packed alphabet, sort as strings instead
+                break
+            chunk_starts = residue_offsets[chunk_start:chunk_end] - first
+            chunk_lengths = lengths[chunk_start:chunk_end]
+            for length in np.unique(chunk_lengths):
+                if length > 0:
+                    records = np.flatnonzero(chunk_lengths == length)
+                    keys[chunk_start + records] = pack_windows(
+                        codes, chunk_starts[records], int(length), n_words)
+        else:
+            return lexsort_keys(keys).astype(np.int64)
+    amino_acids = np.empty(len(lengths), dtype=object)
+    amino_acids[:] = [
+        residues[start:end].tobytes()
+        for (start, end) in zip(residue_offsets[:-1], residue_offsets[1:])
+    ]
+    return np.argsort(amino_acids, kind="stable").astype(np.int64)
+
+
+class PeptideDatabaseWriter(object):
+    """
+    Writes records to a new binary peptide database directory as they're
+    generated, so that they never have to be held in memory or formatted
+    as FASTA first. The lookup order and the attribute dictionaries are
+    saved by close.
+    """
+    __slots__ = [
+        "path",
+        "residue_file",
+        "name_file",
+        "residue_lengths",
+        "name_lengths",
+        "record_attribute_ids",
+        "fields",
+        "values",
+        "attribute_sets",
+        "attribute_offsets",
+        "attribute_field_ids",
+        "attribute_value_ids",
+    ]
+
+    def __init__(self, path):
+        os.makedirs(path)
+        self.path = path
+        self.residue_file = open(os.path.join(path, "residues.bin"), "wb")
+        self.name_file = open(os.path.join(path, "names.bin"), "wb")
+        # typed arrays rather than lists, there's one entry per record
+        self.residue_lengths = array("q")
+        self.name_lengths = array("q")
+        self.record_attribute_ids = array("q")
+        self.fields = {}
+        self.values = {}
+        self.attribute_sets = {}
+        self.attribute_offsets = [0]
+        self.attribute_field_ids = []
+        self.attribute_value_ids = []
+
+    def __len__(self):
+        return len(self.residue_lengths)
+
+    def write(self, sequences):
+        """
+        Append sequences to the database.
+
+        Parameters
+        ----------
+        sequences : iterable of Sequence
+
+        Returns
+        -------
+        Number of records written
+        """
+        n_records = len(self)
+        attribute_sets = self.attribute_sets
+        for seq in sequences:
+            residues = seq.amino_acids.encode("ascii")
+            name = seq.name.encode("utf-8")
+            self.residue_file.write(residues)
+            self.name_file.write(name)
+            self.residue_lengths.append(len(residues))
+            self.name_lengths.append(len(name))
+            attribute_set = tuple(sorted(
+                (field, tuple(_attribute_value_strings(value)))
+                for (field, value) in seq.base_attributes().items()
+                if field not in _derived_attributes))
+            if attribute_set not in attribute_sets:
+                attribute_sets[attribute_set] = len(attribute_sets)
+                for field, field_values in attribute_set:
+                    field_id = self.fields.setdefault(field, len(self.fields))
+                    for value in field_values:
+                        self.attribute_field_ids.append(field_id)
+                        self.attribute_value_ids.append(
+                            self.values.setdefault(value, len(self.values)))
+                self.attribute_offsets.append(len(self.attribute_field_ids))
+            self.record_attribute_ids.append(attribute_sets[attribute_set])
+        return len(self) - n_records
+
+    def close(self):
+        """
+        Finish the database by saving its arrays and dictionaries.
+
+        Returns
+        -------
+        Number of records written
+        """
+        self.residue_file.close()
+        self.name_file.close()
+        path = self.path
+
+        def offsets_from_lengths(lengths):
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(np.frombuffer(lengths, dtype=np.int64), out=offsets[1:])
+            return offsets
+
+        residue_offsets = offsets_from_lengths(self.residue_lengths)
+        if residue_offsets[-1] > 0:
+            residues = np.memmap(
+                os.path.join(path, "residues.bin"), dtype=np.uint8, mode="r")
+        else:
+            residues = np.zeros(0, dtype=np.uint8)
+        arrays = {
+            "residue_offsets": residue_offsets,
+            "name_offsets": offsets_from_lengths(self.name_lengths),
+            "record_attribute_ids": np.frombuffer(
+                self.record_attribute_ids, dtype=np.int64).astype(np.int32),
+            "attribute_offsets": np.array(self.attribute_offsets, dtype=np.int64),
+            "attribute_field_ids": np.array(self.attribute_field_ids, dtype=np.int32),
+            "attribute_value_ids": np.array(self.attribute_value_ids, dtype=np.int32),
+            "sorted_order": _lookup_order(residues, residue_offsets),
+        }
+        del residues
+        for array_name in _array_names:
+            np.save(os.path.join(path, array_name + ".npy"), arrays[array_name])
+        with open(os.path.join(path, "attributes.json"), "w") as f:
+            json.dump({
+                "fields": sorted(self.fields, key=self.fields.get),
+                "values": sorted(self.values, key=self.values.get),
+            }, f)
+        return len(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_peptide_database(sequences, path):
+    """
+    Write sequences to a new binary peptide database directory.
+
+    Parameters
+    ----------
+    sequences : iterable of Sequence
+
+    path : str
+
+    Returns
+    -------
+    Number of records written
+    """
+    with PeptideDatabaseWriter(path) as writer:
+        writer.write(sequences)
+    return len(writer)
+
+
+class PeptideDatabase(object):
+    """
+    Reader for a binary peptide database written by PeptideDatabaseWriter,
+    every array is memory-mapped so opening one is cheap regardless of
+    its size.
+    """
+    __slots__ = [
+        "path",
+        "residues",
+        "names",
+        "fields",
+        "values",
+    ] + _array_names
+
+    def __init__(self, path):
+        self.path = path
+        for array_name in _array_names:
+            setattr(
+                self,
+                array_name,
+                np.load(os.path.join(path, array_name + ".npy"), mmap_mode="r"))
+        self.residues = self._load_bytes("residues.bin")
+        self.names = self._load_bytes("names.bin")
+        with open(os.path.join(path, "attributes.json")) as f:
+            dictionaries = json.load(f)
+        self.fields = dictionaries["fields"]
+        self.values = dictionaries["values"]
+
+    def _load_bytes(self, filename):
+        filename = os.path.join(self.path, filename)
+        if os.path.getsize(filename) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(filename, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.residue_offsets) - 1
+
+    def amino_acids(self, i):
+        start, end = self.residue_offsets[i], self.residue_offsets[i + 1]
+        return self.residues[start:end].tobytes().decode("ascii")
+
+    def name(self, i):
+        start, end = self.name_offsets[i], self.name_offsets[i + 1]
+        return self.names[start:end].tobytes().decode("utf-8")
+
+    def attributes(self, i):
+        """
+        Dictionary from field to set of value strings for the i-th record.
+        """
+        attribute_id = self.record_attribute_ids[i]
+        start = self.attribute_offsets[attribute_id]
+        end = self.attribute_offsets[attribute_id + 1]
+        attributes = {}
+        for field_id, value_id in zip(
+                self.attribute_field_ids[start:end],
+                self.attribute_value_ids[start:end]):
+            attributes.setdefault(self.fields[field_id], set()).add(
+                self.values[value_id])
+        return attributes
+
+    def source_ids(self, i, field="transcript_id"):
+        """
+        Identifiers of the sources of the i-th record, given by one of their
+        attribute fields, as indices into the values dictionary.
+
+        Returns
+        -------
+        np.ndarray of int32
+        """
+        if field not in self.fields:
+            return np.zeros(0, dtype=np.int32)
+        attribute_id = self.record_attribute_ids[i]
+        start = self.attribute_offsets[attribute_id]
+        end = self.attribute_offsets[attribute_id + 1]
+        field_ids = np.asarray(self.attribute_field_ids[start:end])
+        value_ids = np.asarray(self.attribute_value_ids[start:end])
+        return value_ids[field_ids == self.fields.index(field)]
+
+    def __getitem__(self, i):
+        return Sequence(
+            name=self.name(i),
+            amino_acids=self.amino_acids(i),
+            attributes=self.attributes(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lookup(self, peptide):
+        """
+        All records whose amino acids are exactly the given peptide.
+
+        Returns
+        -------
+        list of Sequence
+        """
+        target = peptide.encode("ascii")
+
+        def record_at(position):
+            i = self.sorted_order[position]
+            start, end = self.residue_offsets[i], self.residue_offsets[i + 1]
+            return self.residues[start:end].tobytes()
+
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        results = []
+        while lo < len(self) and record_at(lo) == target:
+            results.append(self[self.sorted_order[lo]])
+            lo += 1
+        return results
+
+    def write_fasta(self, file_handle):
+        """
+        Export every record to an open FASTA file.
+
+        Returns
+        -------
+        Number of records written
+        """
+        return write_fasta_records(self, file_handle)
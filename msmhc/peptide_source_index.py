@@ -0,0 +1,302 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+
+import numpy as np
+
+from .packed_peptides import (
+    RESIDUES_PER_WORD,
+    extract_packed_kmers,
+    pack_peptides,
+    searchsorted_keys,
+    unpack_keys,
+)
+
+
+def _index_dtype(max_value):
+    if max_value < 2 ** 31:
+        return np.int32
+    return np.int64
+
+
+class PeptideSourceIndex(object):
+    """
+    Compact mapping from distinct peptides to the sequences which contain
+    them. Instead of a list of Sequence objects per peptide, sources are
+    integer IDs into one shared table and are stored in compressed sparse
+    row form: the sources of the i-th peptide are
+    source_ids[offsets[i]:offsets[i + 1]].
+
+    Peptides are kept in sorted order, either as packed integer keys
+    (see msmhc.packed_peptides) or as an object array of strings for
+    sequences too long to pack.
+    """
+    __slots__ = [
+        "sources",
+        "keys",
+        "offsets",
+        "source_ids",
+    ]
+
+    def __init__(self, sources, keys, offsets, source_ids):
+        self.sources = sources
+        self.keys = keys
+        self.offsets = offsets.astype(_index_dtype(offsets[-1]), copy=False)
+        self.source_ids = source_ids.astype(
+            _index_dtype(len(sources)), copy=False)
+
+    @classmethod
+    def from_sequences(
+            cls,
+            sequences,
+            min_length=7,
+            max_length=20,
+            prefix_range=None,
+            verbose=False):
+        """
+        Index all k-mers of the given protein sequences.
+
+        Parameters
+        ----------
+        sequences : list of Sequence
+
+        min_length : int
+
+        max_length : int
+
+        prefix_range : tuple of int or None
+            Only index k-mers in this range of prefixes, see
+            msmhc.packed_peptides.extract_packed_kmers
+
+        verbose : bool
+            Report the windows saved by scanning identical sequences once
+
+        Returns
+        -------
+        PeptideSourceIndex
+        """
+        sequences = list(sequences)
+        keys, offsets, source_ids = extract_packed_kmers(
+            [s.amino_acids for s in sequences],
+            min_length=min_length,
+            max_length=max_length,
+            prefix_range=prefix_range,
+            verbose=verbose)
+        return cls(sequences, keys, offsets, source_ids)
+
+    @classmethod
+    def from_full_sequences(cls, sequences):
+        """
+        Group sequences which have identical amino acids, without
+        extracting any shorter peptides.
+
+        Parameters
+        ----------
+        sequences : list of Sequence
+
+        Returns
+        -------
+        PeptideSourceIndex
+        """
+        sequences = list(sequences)
+        amino_acids = np.empty(len(sequences), dtype=object)
+        amino_acids[:] = [s.amino_acids for s in sequences]
+        order = np.argsort(amino_acids, kind="stable")
+        sorted_amino_acids = amino_acids[order]
+        is_new = np.ones(len(order), dtype=bool)
+        is_new[1:] = sorted_amino_acids[1:] != sorted_amino_acids[:-1]
+        offsets = np.append(np.flatnonzero(is_new), len(order))
+        return cls(sequences, sorted_amino_acids[is_new], offsets, order)
+
+    @property
+    def is_packed(self):
+        return self.keys.dtype == np.uint64
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def source_counts(self):
+        """
+        Number of sources of each peptide.
+        """
+        return np.diff(self.offsets)
+
+    def peptides(self, start=0, end=None):
+        """
+        Peptide strings for a range of indices.
+        """
+        if self.is_packed:
+            return unpack_keys(self.keys[start:end])
+        return self.keys[start:end].tolist()
+
+    def items(self, chunk_size=2 ** 16):
+        """
+        Iterate over pairs of peptide string and list of source objects,
+        in sorted order of the peptides.
+        """
+        source_array = np.empty(len(self.sources), dtype=object)
+        source_array[:] = self.sources
+        for chunk_start in range(0, len(self), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(self))
+            peptides = self.peptides(chunk_start, chunk_end)
+            offsets = self.offsets[chunk_start:chunk_end + 1]
+            flat_sources = source_array[
+                self.source_ids[offsets[0]:offsets[-1]]].tolist()
+            offsets = (offsets - offsets[0]).tolist()
+            for i, peptide in enumerate(peptides):
+                yield peptide, flat_sources[offsets[i]:offsets[i + 1]]
+
+    def items_by_source_group(self, chunk_size=2 ** 16):
+        """
+        Iterate over pairs of peptide string and the raw bytes of its source
+        IDs, a hashable key which is equal for peptides with the same set
+        of sources (source IDs are sorted within each peptide). Use
+        source_group to get the source objects back from a key.
+        """
+        group_keys = self.source_group_keys(chunk_size=chunk_size)
+        for chunk_start in range(0, len(self), chunk_size):
+            for peptide in self.peptides(chunk_start, chunk_start + chunk_size):
+                yield peptide, next(group_keys)
+
+    def source_group_keys(self, chunk_size=2 ** 16):
+        """
+        Iterate over the source group key of each peptide, as in
+        items_by_source_group but without the peptide strings.
+        """
+        itemsize = self.source_ids.itemsize
+        for chunk_start in range(0, len(self), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(self))
+            offsets = self.offsets[chunk_start:chunk_end + 1]
+            source_id_bytes = self.source_ids[offsets[0]:offsets[-1]].tobytes()
+            offsets = ((offsets - offsets[0]) * itemsize).tolist()
+            for i in range(chunk_end - chunk_start):
+                yield source_id_bytes[offsets[i]:offsets[i + 1]]
+
+    def source_group(self, key):
+        """
+        List of source objects for a key from items_by_source_group.
+        """
+        source_ids = np.frombuffer(key, dtype=self.source_ids.dtype)
+        return [self.sources[i] for i in source_ids]
+
+    def to_dict(self):
+        """
+        Convert to a dictionary from peptide to list of source sequences.
+        """
+        # the dictionary is made of millions of small lists which can't form
+        # reference cycles, so don't let the garbage collector rescan them
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return dict(self.items(chunk_size=2 ** 20))
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def find(self, peptides):
+        """
+        Positions of the given peptides in this index, -1 for peptides
+        which are absent.
+
+        Parameters
+        ----------
+        peptides : list of str
+
+        Returns
+        -------
+        int64 array
+        """
+        if len(self) == 0 or len(peptides) == 0:
+            return np.full(len(peptides), -1, dtype=np.int64)
+        if self.is_packed:
+            # peptides too long for this index can't be in it, pack them as
+            # empty keys which never match anything
+            max_length = self.keys.shape[1] * RESIDUES_PER_WORD
+            query = pack_peptides(
+                [p if len(p) <= max_length else "" for p in peptides],
+                n_words=self.keys.shape[1])
+            positions = searchsorted_keys(self.keys, query)
+            found = positions < len(self)
+            found[found] = (self.keys[positions[found]] == query[found]).all(axis=1)
+        else:
+            query = np.empty(len(peptides), dtype=object)
+            query[:] = peptides
+            positions = np.searchsorted(self.keys, query)
+            found = positions < len(self)
+            found[found] = self.keys[positions[found]] == query[found]
+        return np.where(found, positions, -1)
+
+    def sources_of(self, peptide):
+        """
+        List of sequences containing the given peptide, empty if the
+        peptide is not in this index.
+        """
+        i = self.find([peptide])[0]
+        if i < 0:
+            return []
+        return [
+            self.sources[j]
+            for j in self.source_ids[self.offsets[i]:self.offsets[i + 1]]
+        ]
+
+    def keep_max_per_peptide(self, source_scores):
+        """
+        For each peptide keep only the sources whose score is highest
+        among that peptide's sources.
+
+        Parameters
+        ----------
+        source_scores : array with one number per entry of the source table
+
+        Returns
+        -------
+        PeptideSourceIndex
+        """
+        if len(self) == 0:
+            return self
+        scores = np.asarray(source_scores)[self.source_ids]
+        counts = self.source_counts()
+        max_scores = np.maximum.reduceat(scores, self.offsets[:-1])
+        keep = scores == np.repeat(max_scores, counts)
+        kept_counts = np.add.reduceat(keep.astype(np.int64), self.offsets[:-1])
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(kept_counts, out=offsets[1:])
+        return PeptideSourceIndex(
+            self.sources,
+            self.keys,
+            offsets,
+            self.source_ids[keep])
+
+    def subset(self, peptide_mask):
+        """
+        Index restricted to the peptides selected by a boolean mask, with
+        the source table trimmed to the sources which are still referenced.
+        """
+        counts = self.source_counts()
+        entry_mask = np.repeat(peptide_mask, counts)
+        source_ids = self.source_ids[entry_mask]
+        used_source_ids, source_ids = np.unique(source_ids, return_inverse=True)
+        offsets = np.zeros(int(peptide_mask.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[peptide_mask], out=offsets[1:])
+        return PeptideSourceIndex(
+            [self.sources[i] for i in used_source_ids],
+            self.keys[peptide_mask],
+            offsets,
+            source_ids.ravel())
+
+    def nbytes(self):
+        """
+        Memory used by the arrays of this index, not counting the
+        source table.
+        """
+        return self.keys.nbytes + self.offsets.nbytes + self.source_ids.nbytes
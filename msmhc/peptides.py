@@ -12,17 +12,20 @@
 
 from collections import Counter, defaultdict
 
+import numpy as np
 from progressbar import progressbar
 
 from .sequence import Sequence
 from .mutant_sequence import MutantSequence
 from .reference_sequence import ReferenceSequence
 from .alt_orf import AltORF, UpstreamORF, DownstreamORF
-from .numerical_peptide_representation import int_to_peptide, peptide_to_int, drop_last_letter
+from .exon_skip import ExonSkipSequence
+from .peptide_source_index import PeptideSourceIndex
 
 class_priority_list = [
     ReferenceSequence,
     MutantSequence,
+    ExonSkipSequence,
     UpstreamORF,
     DownstreamORF,
     AltORF,
@@ -58,12 +61,21 @@ def keep_max_priority_sequences(sequences):
     and keep only sequences which have the same type.
     Parameters
     ----------
-    sequences : list of objects derived from Sequence
+    sequences : list of objects derived from Sequence or PeptideSourceIndex
+        If given a PeptideSourceIndex then the filtering is applied
+        separately to the sources of each peptide.
 
     Returns
     -------
     list of objects derived from Sequence, all of same type
+    (or a PeptideSourceIndex if that was the input)
     """
+    if isinstance(sequences, PeptideSourceIndex):
+        source_priorities = np.array([
+            sequence_type_priority_key_function(type(s))
+            for s in sequences.sources
+        ], dtype=np.int64)
+        return sequences.keep_max_per_peptide(source_priorities)
     sequences_types = map(type, sequences)
     highest_priority_type = max(
         sequences_types,
@@ -74,65 +86,134 @@ def keep_max_priority_sequences(sequences):
         if type(s) is highest_priority_type
     ]
 
-def collapse_peptide_sources(peptide_dict):
+def combine_source_attributes(sources):
     """
-    Given a dictionary mapping from peptide sequences to all of the
-    different protein sequences which generated that peptide, collapse
-    the protein sequences into an aggregate Sequence object whose
-    attribute dictionary maps field to sets of values.
+    Merge the attribute dictionaries of several sequences into one
+    dictionary from field to set of values. Length and mass are left out
+    since each collapsed peptide has its own.
+    """
+    combined_attributes = defaultdict(set)
+    for s in sources:
+        for k, v in s.base_attributes().items():
+            combined_attributes[k].add(v)
+    return combined_attributes
+
+
+def peptide_name_group(type_name, combined_attributes):
+    """
+    Prefix shared by the names of collapsed peptides with the same source
+    type and genes, e.g. ReferenceSequence-TP53
+    """
+    if "gene_name" in combined_attributes:
+        gene_names = combined_attributes["gene_name"]
+        return "%s-%s" % (type_name, "-".join(sorted(gene_names)))
+    return type_name
+
+
+def iter_collapsed_peptide_sources(peptide_dict, name_group_counts=None):
+    """
+    Generator version of collapse_peptide_sources, yields one aggregate
+    Sequence per peptide as soon as it has been collapsed.
 
     Parameters
     ----------
-    peptide_dict : dict
+    peptide_dict : dict or PeptideSourceIndex
         Dictionary from peptide to list of objects derived from Sequence
 
-    Returns
-    -------
-    List of Sequence corresponding to unique peptides
+    name_group_counts : collections.Counter or None
+        Number of names already used for each name group, updated in place.
+        Share one Counter across calls to collapse a stream of peptide
+        dictionaries as if they were one.
     """
-    name_group_counts = Counter()
-    peptide_sequences = []
-    for peptide in peptide_dict.keys():
-        sources = peptide_dict[peptide]
-        assert len(sources) > 0
-        filtered_sources = keep_max_priority_sequences(sources)
-        assert len(filtered_sources) > 0
-        attribute_dicts = [
-            s.attributes for s in filtered_sources
-        ]
-        combined_attributes = defaultdict(set)
-        for d in attribute_dicts:
-            for k, v in d.items():
-                combined_attributes[k].add(v)
-        type_name = filtered_sources[0].__class__.__name__
-
-        if "gene_name" in combined_attributes:
-            gene_names = combined_attributes["gene_name"]
-            # names will look like ReferenceSequence-TP53
-            name_group = "%s-%s" % (
-                    type_name,
-                    "-".join(sorted(gene_names)))
+    if isinstance(peptide_dict, PeptideSourceIndex):
+        # filter all peptides at once, so the sources of each peptide
+        # already share the highest priority type
+        index = keep_max_priority_sequences(peptide_dict)
+        items = index.items_by_source_group()
+        get_sources = index.source_group
+        prefiltered = True
+    else:
+        items = (
+            (peptide, frozenset(map(id, sources)), sources)
+            for (peptide, sources) in peptide_dict.items())
+        get_sources = None
+        prefiltered = False
+    if name_group_counts is None:
+        name_group_counts = Counter()
+    # neighbouring k-mers of a protein mostly have the same sources, so
+    # combine the attributes of each distinct set of sources only once and
+    # share the resulting sets between all of its peptides
+    collapsed_groups = {}
+    for item in items:
+        if prefiltered:
+            peptide, group_key = item
         else:
-            name_group = type_name
+            peptide, group_key, sources = item
+        collapsed = collapsed_groups.get(group_key)
+        if collapsed is None:
+            if prefiltered:
+                filtered_sources = get_sources(group_key)
+            else:
+                assert len(sources) > 0
+                filtered_sources = keep_max_priority_sequences(sources)
+            assert len(filtered_sources) > 0
+            combined_attributes = combine_source_attributes(filtered_sources)
+            type_name = filtered_sources[0].__class__.__name__
+            collapsed = (
+                combined_attributes,
+                peptide_name_group(type_name, combined_attributes))
+            collapsed_groups[group_key] = collapsed
+        combined_attributes, name_group = collapsed
         name_group_counts[name_group] += 1
         # add a numerical ID to make the sequence names unique
         name = "%s-%d" % (
             name_group,
             name_group_counts[name_group])
-        peptide_sequences.append(Sequence(
+        yield Sequence(
             name=name,
             amino_acids=peptide,
-            attributes=combined_attributes))
-    return peptide_sequences
+            attributes=combined_attributes)
 
 
-def _extract_peptides_with_numerical_encoding(sequences, min_length=7, max_length=20):
+def collapse_peptide_sources(peptide_dict, name_group_counts=None):
     """
-    Failed attempt to use numerical encodings to save on memory.
+    Given a dictionary mapping from peptide sequences to all of the
+    different protein sequences which generated that peptide, collapse
+    the protein sequences into an aggregate Sequence object whose
+    attribute dictionary maps field to sets of values.
 
+    Parameters
+    ----------
+    peptide_dict : dict or PeptideSourceIndex
+        Dictionary from peptide to list of objects derived from Sequence
+
+    name_group_counts : collections.Counter or None
+        Number of names already used for each name group, updated in place.
+
+    Returns
+    -------
+    List of Sequence corresponding to unique peptides
+    """
+    return list(iter_collapsed_peptide_sources(
+        peptide_dict,
+        name_group_counts=name_group_counts))
+
+
+def extract_peptides_with_packed_encoding(
+        sequences,
+        min_length=7,
+        max_length=20):
+    """
     Extract subsequences from full protein sequences, and return dictionary
     mapping each kmer to its source sequences.
 
+    Unlike extract_peptides, this never creates a Python string for each
+    window: every protein is encoded once into an array of residue codes,
+    windows of each length are packed into fixed-width integer keys and
+    deduplicated by sorting. Peptides are returned in sorted order.
+    Use PeptideSourceIndex.from_sequences directly to avoid building
+    a list of sources for every peptide.
+
     Parameters
     ----------
     sequences : list of Sequence
@@ -148,29 +229,10 @@ def _extract_peptides_with_numerical_encoding(sequences, min_length=7, max_lengt
     -------
     Dictionary from str to list of Sequence objects which contained that peptide
     """
-    compact_peptide_dict = defaultdict(list)
-    for sequence_obj in progressbar(sequences):
-        amino_acids = sequence_obj.amino_acids
-        n_aa = len(amino_acids)
-        already_seen = set()
-        for i in range(n_aa - min_length + 1):
-            longest_peptide = amino_acids[i:i + max_length]
-            longest_peptide_length = len(longest_peptide)
-            if longest_peptide_length >= min_length:
-                peptide_as_int = peptide_to_int(longest_peptide)
-                if peptide_as_int not in already_seen:
-                    already_seen.add(peptide_as_int)
-                    compact_peptide_dict[peptide_as_int].append(sequence_obj)
-                for _ in range(longest_peptide_length - 1, min_length - 1, -1):
-                    peptide_as_int = drop_last_letter(peptide_as_int)
-                    if peptide_as_int not in already_seen:
-                        already_seen.add(peptide_as_int)
-                        compact_peptide_dict[peptide_as_int].append(sequence_obj)
-    print("Materializing peptide strings from compact representation:")
-    peptide_dict = {}
-    for (numerical_representation, sequence_objs) in progressbar(compact_peptide_dict.items()):
-        peptide_dict[int_to_peptide(numerical_representation)] = sequence_objs
-    return peptide_dict
+    return PeptideSourceIndex.from_sequences(
+        sequences,
+        min_length=min_length,
+        max_length=max_length).to_dict()
 
 
 def extract_peptides(sequences, min_length=7, max_length=20):
@@ -193,8 +255,7 @@ def extract_peptides(sequences, min_length=7, max_length=20):
     -------
     Dictionary from str to list of Sequence objects which contained that peptide
     """
-    from Bio.trie import trie
-    peptide_dict = trie()
+    peptide_dict = {}
 
     for sequence_obj in progressbar(sequences):
         amino_acids = sequence_obj.amino_acids
@@ -203,7 +264,7 @@ def extract_peptides(sequences, min_length=7, max_length=20):
         for i in range(n_aa - min_length + 1):
             longest_peptide = amino_acids[i:i + max_length]
             longest_peptide_length = len(longest_peptide)
-            for k in range(min_length, longest_peptide_length):
+            for k in range(min_length, longest_peptide_length + 1):
                 kmer = longest_peptide[:k]
                 if kmer not in already_seen_for_protein:
                     already_seen_for_protein.add(kmer)
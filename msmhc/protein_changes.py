@@ -0,0 +1,63 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for keeping only the part of an altered protein whose peptides
+aren't also peptides of the original protein.
+"""
+
+
+def changed_interval(protein, original_protein, start=0):
+    """
+    Half-open interval of residues of protein which differ from
+    original_protein, after removing the longest common prefix and
+    suffix. The interval is empty when residues were only deleted.
+
+    Parameters
+    ----------
+    protein : str
+
+    original_protein : str
+
+    start : int
+        Position up to which the two proteins are known to be the same
+
+    Returns
+    -------
+    Tuple of start and end positions in protein
+    """
+    n = min(len(protein), len(original_protein))
+    changed_start = min(start, n)
+    while changed_start < n and protein[changed_start] == original_protein[changed_start]:
+        changed_start += 1
+    # the suffix can't overlap the prefix in either protein
+    max_suffix_length = n - changed_start
+    suffix_length = 0
+    while suffix_length < max_suffix_length and \
+            protein[-1 - suffix_length] == original_protein[-1 - suffix_length]:
+        suffix_length += 1
+    return changed_start, len(protein) - suffix_length
+
+
+def peptide_window(changed_start, changed_end, protein_length, max_peptide_length):
+    """
+    Smallest interval of a protein which contains every peptide of up to
+    max_peptide_length residues that overlaps the changed residues or,
+    for a deletion, spans the position where residues were removed.
+    The whole protein if max_peptide_length is None.
+    """
+    if max_peptide_length is None:
+        return 0, protein_length
+    return (
+        max(0, changed_start - max_peptide_length + 1),
+        min(protein_length, changed_end + max_peptide_length - 1),
+    )
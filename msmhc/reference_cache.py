@@ -0,0 +1,251 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk cache of the collapsed peptides of everything which doesn't depend
+on a sample's variants (reference transcripts and their alternative reading
+frames), so that per-sample runs only have to collapse mutant peptides.
+"""
+
+from collections import Counter
+from itertools import chain
+import os
+import re
+
+from .collapsed_peptides import CollapsedPeptides
+from .decoys import iter_decoy_keys, iter_numbered_decoys
+from .main import generate_protein_sequences
+from .output import write_fasta_chunk, write_fasta_records
+from .peptide_source_index import PeptideSourceIndex
+
+# increment whenever the cached data would differ for the same options
+CACHE_FORMAT_VERSION = 3
+
+
+def _genome_cache_name(genome):
+    species = getattr(genome, "species", None)
+    # a TranscriptSnapshot only has the name of its genome's species
+    species = getattr(species, "latin_name", species)
+    release = getattr(genome, "release", None)
+    if release is None:
+        release = getattr(genome, "annotation_version", None)
+    return "-".join(
+        str(part)
+        for part in (species, genome.reference_name, release)
+        if part is not None)
+
+
+def reference_cache_path(
+        cache_dir,
+        genome,
+        upstream_reading_frames=False,
+        downstream_reading_frames=False,
+        skip_exons=False,
+        restrict_sources_to_gene_name=None,
+        min_length=7,
+        max_length=20,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0):
+    """
+    Path of the cached reference peptides for one genome and set of
+    source and peptide length options.
+    """
+    name = "v%d-%s-upstream%d-downstream%d-skip%d-%d-%dmer" % (
+        CACHE_FORMAT_VERSION,
+        _genome_cache_name(genome),
+        upstream_reading_frames,
+        downstream_reading_frames,
+        skip_exons,
+        min_length,
+        max_length)
+    if restrict_sources_to_gene_name:
+        name += "-gene-%s" % restrict_sources_to_gene_name
+    if (upstream_reading_frames or downstream_reading_frames) and \
+            set(start_codons) != {"ATG"}:
+        name += "-start-%s" % "-".join(sorted(set(start_codons)))
+    if (upstream_reading_frames or downstream_reading_frames) and \
+            min_translation_initiation_score > 0:
+        name += "-min-score-%r" % float(min_translation_initiation_score)
+    return os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", name))
+
+
+def load_or_build_reference_peptides(
+        cache_dir,
+        genome,
+        upstream_reading_frames=False,
+        downstream_reading_frames=False,
+        skip_exons=False,
+        restrict_sources_to_gene_name=None,
+        min_length=7,
+        max_length=20,
+        start_codons=("ATG",),
+        min_translation_initiation_score=0.0,
+        n_processes=1):
+    """
+    Load the collapsed reference peptides from the cache, generating and
+    saving them first if they haven't been cached yet.
+
+    Parameters
+    ----------
+    cache_dir : str
+
+    genome : pyensembl.Genome
+
+    upstream_reading_frames : bool
+
+    downstream_reading_frames : bool
+
+    skip_exons : bool
+
+    restrict_sources_to_gene_name : str or None
+
+    min_length : int
+
+    max_length : int
+
+    start_codons : collection of str
+        Start codons of upstream and downstream reading frames
+
+    min_translation_initiation_score : float
+        Lowest translation initiation score of their start codons
+
+    n_processes : int
+        Number of worker processes for generating reference sequences,
+        doesn't change what's cached
+
+    Returns
+    -------
+    CollapsedPeptides
+    """
+    path = reference_cache_path(
+        cache_dir,
+        genome,
+        upstream_reading_frames=upstream_reading_frames,
+        downstream_reading_frames=downstream_reading_frames,
+        skip_exons=skip_exons,
+        restrict_sources_to_gene_name=restrict_sources_to_gene_name,
+        min_length=min_length,
+        max_length=max_length,
+        start_codons=start_codons,
+        min_translation_initiation_score=min_translation_initiation_score)
+    if os.path.exists(path):
+        print("Loading cached reference peptides from %s" % path)
+        return CollapsedPeptides.load(path)
+    print("Building reference peptide cache %s" % path)
+    sequences = generate_protein_sequences(
+        genome=genome,
+        upstream_reading_frames=upstream_reading_frames,
+        downstream_reading_frames=downstream_reading_frames,
+        skip_exons=skip_exons,
+        restrict_sources_to_gene_name=restrict_sources_to_gene_name,
+        min_peptide_length=min_length,
+        max_peptide_length=max_length,
+        start_codons=start_codons,
+        min_translation_initiation_score=min_translation_initiation_score,
+        n_processes=n_processes)
+    reference_peptides = CollapsedPeptides.from_index(
+        PeptideSourceIndex.from_sequences(
+            sequences,
+            min_length=min_length,
+            max_length=max_length,
+            verbose=True))
+    del sequences
+    os.makedirs(cache_dir, exist_ok=True)
+    if not reference_peptides.save(path):
+        # e.g. another sample of a batch started at the same time
+        print("Loading reference peptides cached by another process")
+        return CollapsedPeptides.load(path)
+    return reference_peptides
+
+
+def write_hits_with_reference_peptides(
+        reference_peptides,
+        mutant_sequences,
+        f,
+        min_length=7,
+        max_length=20,
+        n_decoys_per_hit=1,
+        random_seed=0,
+        n_processes=1,
+        decoy_strategy="shuffle",
+        chunk_size=2 ** 16):
+    """
+    Collapse the peptides of mutant sequences, merge them into cached
+    reference peptides and write the hits followed by their decoys.
+
+    The merged peptides are written a chunk at a time and decoys are made
+    from their packed keys, so the memory used doesn't grow with the
+    number of memory-mapped reference peptides. The records are the same
+    as writing every merged peptide followed by
+    msmhc.decoys.generate_decoys of all of them.
+
+    Parameters
+    ----------
+    reference_peptides : CollapsedPeptides
+
+    mutant_sequences : list of MutantSequence
+
+    f : file or msmhc.output.RecordWriter
+
+    min_length : int
+
+    max_length : int
+
+    n_decoys_per_hit : int
+
+    random_seed : int
+
+    n_processes : int
+        Number of worker processes for scrambling decoys
+
+    decoy_strategy : str
+        One of msmhc.decoys.DECOY_STRATEGIES
+
+    chunk_size : int
+        Number of merged peptides to write at a time
+
+    Returns
+    -------
+    Number of hits and number of decoys written
+    """
+    mutant_peptides = CollapsedPeptides.from_index(
+        PeptideSourceIndex.from_sequences(
+            mutant_sequences,
+            min_length=min_length,
+            max_length=max_length))
+    name_group_counts = Counter()
+    n_hits = 0
+    for chunk in reference_peptides.iter_merged(mutant_peptides, chunk_size):
+        write_fasta_chunk(list(chunk.iter_sequences(name_group_counts)), f)
+        n_hits += len(chunk)
+
+    def make_hit_key_chunks():
+        # chunks of the same size as in generate_decoys, whatever chunk_size
+        # is, since each chunk of hits is scrambled with its own generator
+        return (
+            chunk.keys
+            for chunk in reference_peptides.iter_merged(mutant_peptides))
+
+    # every hit is either a reference or a mutant peptide
+    decoys = chain.from_iterable(iter_numbered_decoys(iter_decoy_keys(
+        make_hit_key_chunks,
+        [reference_peptides.keys, mutant_peptides.keys],
+        n_hits * n_decoys_per_hit,
+        random_seed=random_seed,
+        strategy=decoy_strategy,
+        n_processes=n_processes)))
+    n_decoys = write_fasta_records(decoys, f)
+    print("Wrote %d records (%d hits, %d decoys)" % (
+        n_hits + n_decoys,
+        n_hits,
+        n_decoys))
+    return n_hits, n_decoys
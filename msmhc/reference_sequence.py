@@ -25,11 +25,15 @@ class ReferenceSequence(Sequence):
         Sequence.__init__(
             self,
             name="ref-%s" % transcript.transcript_id,
-            amino_acids=transcript.protein_sequence,
-            attributes={
-                "source": "reference",
-                "transcript_id": transcript.transcript_id,
-                "transcript_name": transcript.transcript_name,
-                "gene_id": transcript.gene_id,
-                "gene_name": transcript.gene_name,
-            })
+            amino_acids=transcript.protein_sequence)
+
+    def base_attributes(self):
+        # built from the transcript rather than stored a second time
+        transcript = self.transcript
+        return {
+            "source": "reference",
+            "transcript_id": transcript.transcript_id,
+            "transcript_name": transcript.transcript_name,
+            "gene_id": transcript.gene_id,
+            "gene_name": transcript.gene_name,
+        }
@@ -16,21 +16,52 @@ from .common import convert_to_string
 class Sequence(object):
     """
     Base class used for reference and modified protein sequences
+
+    The length and mass attributes are computed from the amino acids when
+    they're needed instead of being stored, and the attributes dictionary
+    given to the constructor is kept as is (not copied), so that many
+    sequences can share it.
     """
     __slots__ = [
         "name",
         "amino_acids",
-        "attributes",
+        "_attributes",
     ]
 
-    def __init__(self, name, amino_acids, attributes={}):
+    def __init__(self, name, amino_acids, attributes=None):
+        if attributes is None:
+            attributes = {}
         self.name = name
         self.amino_acids = amino_acids
+        self._attributes = attributes
+
+    def base_attributes(self):
+        """
+        Dictionary of attributes other than length and mass. Subclasses
+        which keep their fields in slots build it from those instead.
+        """
+        return self._attributes
+
+    @property
+    def length(self):
+        return len(self.amino_acids)
+
+    @property
+    def mass(self):
+        return mass_of_peptide(self.amino_acids)
+
+    @property
+    def attributes(self):
+        """
+        New dictionary of all attributes, including length and mass.
+        """
+        return self._attributes_with_mass(self.mass)
 
-        attributes = attributes.copy()
-        attributes["length"] = len(amino_acids)
-        attributes["mass"] = mass_of_peptide(amino_acids)
-        self.attributes = attributes
+    def _attributes_with_mass(self, mass):
+        attributes = dict(self.base_attributes())
+        attributes["length"] = len(self.amino_acids)
+        attributes["mass"] = mass
+        return attributes
 
     def __str__(self):
         return "%s(name='%s', amino_acids='%s', attributes=%s)" % (
@@ -57,18 +88,57 @@ class Sequence(object):
     def __hash__(self):
         return hash(self.name)
 
-    def sorted_attribute_list(self):
+    def sorted_attribute_list(self, mass=None):
         """
         Returns list of attribute key/value pairs in alphabetical order
         of the keys.
+
+        Parameters
+        ----------
+        mass : float or None
+            Mass of this sequence if already known, e.g. from
+            msmhc.mass.masses_of_peptides
+        """
+        if mass is None:
+            mass = self.mass
+        return sorted(self._attributes_with_mass(mass).items(), key=lambda x: x[0])
+
+    def formatted_base_attributes(self, base_attributes=None):
         """
-        return sorted(self.attributes.items(), key=lambda x: x[0])
+        List of key/string value pairs of the base attributes, as they
+        appear in FASTA headers.
+        """
+        if base_attributes is None:
+            base_attributes = self.base_attributes()
+        return [
+            (k, convert_to_string(v))
+            for (k, v) in base_attributes.items()
+            if k not in ("length", "mass")
+        ]
+
+    def attribute_string(self, mass=None, formatted_base_attributes=None):
+        """
+        Parameters
+        ----------
+        mass : float or None
+            Mass of this sequence if already known
 
-    def attribute_string(self):
+        formatted_base_attributes : list or None
+            Result of formatted_base_attributes if already known, e.g.
+            shared by many sequences with the same attributes dictionary
+        """
+        if mass is None:
+            mass = self.mass
+        if formatted_base_attributes is None:
+            formatted_base_attributes = self.formatted_base_attributes()
+        pairs = formatted_base_attributes + [
+            ("length", convert_to_string(len(self.amino_acids))),
+            ("mass", convert_to_string(mass)),
+        ]
         return " ".join([
-            "%s=%s" % (k, convert_to_string(v))
+            "%s=%s" % (k, v)
             for (k, v)
-            in self.sorted_attribute_list()])
+            in sorted(pairs, key=lambda x: x[0])])
 
     def sequence_split_into_lines(self, maxwidth=80):
         lines = []
@@ -78,11 +148,13 @@ class Sequence(object):
                 lines.append(subseq)
         return lines
 
-    def fasta_string(self):
+    def fasta_string(self, mass=None, formatted_base_attributes=None):
         return ">%s %s\n%s\n" % (
             self.name,
-            self.attribute_string(),
+            self.attribute_string(
+                mass=mass,
+                formatted_base_attributes=formatted_base_attributes),
             "\n".join(self.sequence_split_into_lines()))
 
-    def write_to_fasta_file(self, file_handle):
-        file_handle.write(self.fasta_string())
\ No newline at end of file
+    def write_to_fasta_file(self, file_handle, mass=None):
+        file_handle.write(self.fasta_string(mass=mass))
\ No newline at end of file
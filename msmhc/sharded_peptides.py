@@ -0,0 +1,214 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Multi-process peptide extraction and collapse. K-mer space is split into
+contiguous ranges of residue prefixes, every worker scans all proteins but
+only keeps the k-mers of its own range, collapses them and writes a
+partial FASTA file (or peptide database). Since the ranges are contiguous
+in sorted order, concatenating the partial files in shard order gives the
+same records as a single process, once the numeric suffix of each name has
+been offset by the counts of the same name group in earlier shards.
+"""
+
+from collections import Counter
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from .external_kmers import iter_external_peptide_index
+from .output import RecordWriter, write_collapsed_hits
+from .packed_peptides import balanced_prefix_ranges
+from .peptide_database import PeptideDatabase, PeptideDatabaseWriter
+from .peptide_source_index import PeptideSourceIndex
+from .sequence import Sequence
+
+# sequences shared with forked workers, set only while a pool is running
+_shard_sequences = None
+
+
+def _write_shard(
+        shard_index,
+        prefix_range,
+        directory,
+        min_length,
+        max_length,
+        memory_budget,
+        write_fasta,
+        write_database):
+    sequences = _shard_sequences
+    if memory_budget is None:
+        blocks = [
+            PeptideSourceIndex.from_sequences(
+                sequences,
+                min_length=min_length,
+                max_length=max_length,
+                prefix_range=prefix_range)
+        ]
+    else:
+        blocks = iter_external_peptide_index(
+            sequences,
+            memory_budget=memory_budget,
+            min_length=min_length,
+            max_length=max_length,
+            temp_dir=directory,
+            prefix_range=prefix_range)
+    path = os.path.join(directory, "shard-%05d.fa" % shard_index)
+    database_path = os.path.join(directory, "shard-%05d.db" % shard_index)
+    key_path = os.path.join(directory, "shard-%05d.keys" % shard_index)
+    name_group_counts = Counter()
+    output = RecordWriter(
+        fasta_file=open(path, "w") if write_fasta else None,
+        database_writer=(
+            PeptideDatabaseWriter(database_path) if write_database else None))
+    with output, open(key_path, "wb") as key_file:
+        n_hits = write_collapsed_hits(
+            blocks,
+            output,
+            name_group_counts=name_group_counts,
+            key_file=key_file)
+    return path, database_path, key_path, name_group_counts, n_hits
+
+
+def _renumbered_name(name, name_offsets):
+    name_group, number = name.rsplit("-", 1)
+    return "%s-%d" % (name_group, int(number) + name_offsets.get(name_group, 0))
+
+
+def _copy_with_renumbered_names(source_path, file_handle, name_offsets):
+    """
+    Copy a FASTA file written by collapse, adding an offset to the numeric
+    suffix of every record name (e.g. ReferenceSequence-TP53-3).
+    """
+    with open(source_path) as f:
+        if not name_offsets:
+            shutil.copyfileobj(f, file_handle)
+            return
+        for line in f:
+            if line.startswith(">"):
+                name, rest = line[1:].split(" ", 1)
+                line = ">%s %s" % (_renumbered_name(name, name_offsets), rest)
+            file_handle.write(line)
+
+
+def _iter_renumbered_records(database_path, name_offsets):
+    """
+    Records of a shard's peptide database, with names renumbered as in
+    _copy_with_renumbered_names.
+    """
+    database = PeptideDatabase(database_path)
+    for i in range(len(database)):
+        yield Sequence(
+            name=_renumbered_name(database.name(i), name_offsets),
+            amino_acids=database.amino_acids(i),
+            attributes=database.attributes(i))
+
+
+def write_sharded_hits(
+        sequences,
+        file_handle,
+        n_processes,
+        min_length=7,
+        max_length=20,
+        memory_budget=None,
+        temp_dir=None,
+        key_file=None):
+    """
+    Extract, collapse and write the peptides of the given sequences using
+    several processes, producing the same FASTA records as collapsing
+    a single PeptideSourceIndex.
+
+    Parameters
+    ----------
+    sequences : list of Sequence
+
+    file_handle : file or msmhc.output.RecordWriter
+
+    n_processes : int
+
+    min_length : int
+
+    max_length : int
+
+    memory_budget : int or None
+        If given, the total memory budget split between the workers, each of
+        which then spills sorted k-mer runs to disk.
+
+    temp_dir : str or None
+        Parent directory for partial outputs and spilled runs
+
+    key_file : binary file or None
+        If given, the packed keys of the hits are appended to it, see
+        msmhc.output.write_collapsed_hits
+
+    Returns
+    -------
+    Number of hits written
+    """
+    global _shard_sequences
+    sequences = list(sequences)
+    prefix_ranges = balanced_prefix_ranges(
+        [s.amino_acids for s in sequences],
+        n_processes)
+    if memory_budget is not None:
+        memory_budget = memory_budget // n_processes
+    if isinstance(file_handle, RecordWriter):
+        fasta_file = file_handle.fasta_file
+        database_writer = file_handle.database_writer
+    else:
+        fasta_file = file_handle
+        database_writer = None
+    directory = tempfile.mkdtemp(prefix="msmhc-shards-", dir=temp_dir)
+    _shard_sequences = sequences
+    try:
+        # workers are forked so that they share the sequences with this
+        # process instead of receiving a pickled copy
+        context = multiprocessing.get_context("fork")
+        with context.Pool(n_processes) as pool:
+            results = pool.starmap(
+                _write_shard,
+                [
+                    (
+                        i,
+                        prefix_range,
+                        directory,
+                        min_length,
+                        max_length,
+                        memory_budget,
+                        fasta_file is not None,
+                        database_writer is not None,
+                    )
+                    for (i, prefix_range) in enumerate(prefix_ranges)
+                ])
+        n_hits = 0
+        name_offsets = Counter()
+        for (path, database_path, key_path, name_group_counts,
+                n_shard_hits) in results:
+            if fasta_file is not None:
+                _copy_with_renumbered_names(path, fasta_file, name_offsets)
+                os.remove(path)
+            if database_writer is not None:
+                database_writer.write(
+                    _iter_renumbered_records(database_path, name_offsets))
+                shutil.rmtree(database_path)
+            name_offsets.update(name_group_counts)
+            # shards are contiguous ranges of the sorted keys
+            if key_file is not None:
+                with open(key_path, "rb") as f:
+                    shutil.copyfileobj(f, key_file)
+            n_hits += n_shard_hits
+            os.remove(key_path)
+        return n_hits
+    finally:
+        _shard_sequences = None
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,80 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import sys
+
+from .main import generate_reference_sequences
+from .transcript_record import TranscriptRecord
+from .transcript_snapshot import write_transcript_snapshot
+
+from varcode.reference import genome_for_reference_name
+
+parser = argparse.ArgumentParser(
+    "msmhc-snapshot",
+    description=(
+        "Export the protein coding transcripts of a genome into a "
+        "memory-mappable snapshot which msmhc-generate can read with "
+        "--transcript-snapshot instead of querying pyensembl"))
+
+parser.add_argument(
+    "--genome",
+    default="grch37",
+    help="Reference genome name or Ensembl release")
+
+parser.add_argument(
+    "--output",
+    required=True,
+    help="Directory to create for the snapshot")
+
+parser.add_argument(
+    "--gene-name",
+    default=None,
+    help="Only export transcripts of genes with this name")
+
+parser.add_argument(
+    "--processes",
+    default=1,
+    type=int,
+    help="Number of worker processes for reading transcripts, split by contig")
+
+
+def iter_transcript_records(genome, restrict_sources_to_gene_name=None, n_processes=1):
+    """
+    TranscriptRecord of every transcript which msmhc.main makes a
+    ReferenceSequence from.
+    """
+    for sequence in generate_reference_sequences(
+            genome,
+            restrict_sources_to_gene_name=restrict_sources_to_gene_name,
+            n_processes=n_processes):
+        transcript = sequence.transcript
+        if isinstance(transcript, TranscriptRecord):
+            yield transcript
+        else:
+            yield TranscriptRecord.from_transcript(transcript)
+
+
+def run(args_list=None):
+    if args_list is None:
+        args_list = sys.argv[1:]
+    args = parser.parse_args(args_list)
+    genome = genome_for_reference_name(args.genome)
+    print("Using reference genome %s" % genome)
+    n_transcripts = write_transcript_snapshot(
+        iter_transcript_records(
+            genome,
+            restrict_sources_to_gene_name=args.gene_name,
+            n_processes=args.processes),
+        args.output,
+        genome=genome)
+    print("Wrote %d transcripts to %s" % (n_transcripts, args.output))
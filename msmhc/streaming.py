@@ -0,0 +1,281 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Streaming pipeline which generates, collapses and writes the peptides of
+one gene at a time, with decoys written right after the hits they were
+made from.
+
+Collapsing a gene on its own is only correct for peptides which no other
+gene contains, so the pipeline makes two passes over the source groups:
+
+1. The groups are generated once. The distinct k-mers of each gene are
+   packed and spilled to disk as sorted runs, and the gene's sources are
+   pickled to a spool file. Merging the runs finds the k-mers contained
+   in more than one gene. The sorted keys of all k-mers are kept on disk
+   so that decoys can be checked against every target.
+
+2. A second pass reads each gene's sources back from the spool, writes
+   the hits of its private peptides straight away and holds back its
+   shared peptides, which are collapsed together once every gene has
+   been seen.
+
+Neither pass keeps more than one gene's sources in memory, apart from the
+sources of shared peptides, so peak memory doesn't grow with the
+proteome. Time to the first record does: whether a peptide is private to
+its gene is only known once every gene has been seen, so nothing is
+written until the first pass is done.
+"""
+
+from collections import Counter
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from .decoys import generate_decoys_avoiding_keys
+from .external_kmers import iter_merged_kmer_runs, save_run
+from .output import write_fasta_chunk
+from .packed_peptides import (
+    extract_packed_kmers,
+    isin_keys,
+    merge_key_groups,
+    n_words_for_length,
+)
+from .peptide_source_index import PeptideSourceIndex
+from .peptides import iter_collapsed_peptide_sources
+
+
+def find_shared_kmers(
+        sequence_groups,
+        directory,
+        memory_budget,
+        min_length=7,
+        max_length=20):
+    """
+    Find the k-mers which occur in more than one group of sequences.
+
+    Parameters
+    ----------
+    sequence_groups : iterable of (group name, list of Sequence) pairs
+
+    directory : str
+        Where to spill sorted runs and write the keys of all k-mers
+
+    memory_budget : int
+        Approximate number of bytes of k-mer keys to buffer before spilling
+
+    min_length : int
+
+    max_length : int
+
+    Returns
+    -------
+    Sorted packed keys of the shared k-mers and a memory-mapped array of
+    the sorted packed keys of all k-mers.
+    """
+    n_words = n_words_for_length(max_length)
+    runs = []
+    buffered_keys = []
+    buffered_group_ids = []
+    n_buffered_bytes = 0
+    n_groups = 0
+
+    def spill():
+        keys, offsets, group_ids = merge_key_groups(
+            np.concatenate(buffered_keys),
+            np.ones(sum(len(k) for k in buffered_keys), dtype=np.int64),
+            np.concatenate(buffered_group_ids))
+        runs.append(save_run(directory, len(runs), keys, offsets, group_ids))
+        del buffered_keys[:]
+        del buffered_group_ids[:]
+
+    for group_id, (_, sequences) in enumerate(sequence_groups):
+        n_groups += 1
+        keys, _, _ = extract_packed_kmers(
+            [s.amino_acids for s in sequences],
+            min_length=min_length,
+            max_length=max_length)
+        if len(keys) == 0:
+            continue
+        buffered_keys.append(keys)
+        buffered_group_ids.append(np.full(len(keys), group_id, dtype=np.int64))
+        n_buffered_bytes += keys.nbytes
+        if n_buffered_bytes >= memory_budget:
+            spill()
+            n_buffered_bytes = 0
+    if buffered_keys:
+        spill()
+
+    all_keys_path = os.path.join(directory, "all-keys.bin")
+    shared_key_chunks = []
+    n_keys = 0
+    with open(all_keys_path, "wb") as f:
+        for block in iter_merged_kmer_runs(range(n_groups), runs):
+            shared_key_chunks.append(block.keys[block.source_counts() > 1])
+            f.write(block.keys.tobytes())
+            n_keys += len(block)
+    for paths in runs:
+        for path in paths:
+            os.remove(path)
+
+    if shared_key_chunks:
+        shared_keys = np.concatenate(shared_key_chunks)
+    else:
+        shared_keys = np.zeros((0, n_words), dtype=np.uint64)
+    if n_keys == 0:
+        all_keys = np.zeros((0, n_words), dtype=np.uint64)
+    else:
+        all_keys = np.memmap(
+            all_keys_path,
+            dtype=np.uint64,
+            mode="r",
+            shape=(n_keys, n_words))
+    print("Found %d k-mers, %d shared between groups of sequences" % (
+        n_keys,
+        len(shared_keys)))
+    return shared_keys, all_keys
+
+
+def _spool_sequence_groups(sequence_groups, path):
+    """
+    Pass sequence groups through, pickling each one to a file so that a
+    later pass can read them back instead of generating them again.
+    """
+    with open(path, "wb") as f:
+        for group in sequence_groups:
+            pickle.dump(group, f, protocol=pickle.HIGHEST_PROTOCOL)
+            yield group
+
+
+def _iter_spooled_sequence_groups(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _merge_indices(indices):
+    """
+    Combine indices over disjoint source tables into one index.
+    """
+    sources = []
+    key_chunks = []
+    count_chunks = []
+    source_id_chunks = []
+    for index in indices:
+        key_chunks.append(index.keys)
+        count_chunks.append(index.source_counts())
+        source_id_chunks.append(index.source_ids.astype(np.int64) + len(sources))
+        sources.extend(index.sources)
+    keys, offsets, source_ids = merge_key_groups(
+        np.concatenate(key_chunks),
+        np.concatenate(count_chunks),
+        np.concatenate(source_id_chunks))
+    return PeptideSourceIndex(sources, keys, offsets, source_ids)
+
+
+def write_streaming_hits_and_decoys(
+        sequence_groups,
+        file_handle,
+        min_length=7,
+        max_length=20,
+        n_decoys_per_hit=1,
+        random_seed=0,
+        memory_budget=2 ** 30,
+        temp_dir=None,
+        decoy_strategy="shuffle"):
+    """
+    Write the collapsed peptides of a stream of sequence groups, each
+    followed by its decoys, to a FASTA file.
+
+    Parameters
+    ----------
+    sequence_groups : iterable of (group name, list of Sequence) pairs
+        Such as msmhc.main.generate_protein_sequence_groups, only iterated
+        over once
+
+    file_handle : file or msmhc.output.RecordWriter
+
+    min_length : int
+
+    max_length : int
+
+    n_decoys_per_hit : int
+
+    random_seed : int
+
+    memory_budget : int
+        Approximate number of bytes of k-mer keys to buffer before spilling
+        a sorted run to disk
+
+    temp_dir : str or None
+        Parent directory for spilled runs and spooled sources
+
+    decoy_strategy : str
+        One of msmhc.decoys.DECOY_STRATEGIES
+
+    Returns
+    -------
+    Number of hits and number of decoys written
+    """
+    directory = tempfile.mkdtemp(prefix="msmhc-stream-", dir=temp_dir)
+    spool_path = os.path.join(directory, "sequence-groups.pickle")
+    try:
+        shared_keys, all_keys = find_shared_kmers(
+            _spool_sequence_groups(sequence_groups, spool_path),
+            directory,
+            memory_budget=memory_budget,
+            min_length=min_length,
+            max_length=max_length)
+        name_group_counts = Counter()
+        shared_indices = []
+        # numbers of hits, decoys and groups written so far
+        counts = [0, 0, 0]
+
+        def write(index):
+            hits = list(iter_collapsed_peptide_sources(index, name_group_counts))
+            # each group's decoys are seeded and numbered by its position
+            # in the stream, independently of the other groups' decoys
+            decoys = generate_decoys_avoiding_keys(
+                [hit.amino_acids for hit in hits],
+                all_keys,
+                n_decoys_per_peptide=n_decoys_per_hit,
+                random_seed=(random_seed, counts[2]),
+                first_decoy_number=counts[1] + 1,
+                strategy=decoy_strategy)
+            write_fasta_chunk(hits + list(decoys), file_handle)
+            counts[0] += len(hits)
+            counts[1] += len(decoys)
+            counts[2] += 1
+
+        for _, sequences in _iter_spooled_sequence_groups(spool_path):
+            index = PeptideSourceIndex.from_sequences(
+                sequences,
+                min_length=min_length,
+                max_length=max_length)
+            is_shared = isin_keys(shared_keys, index.keys)
+            write(index.subset(~is_shared))
+            if is_shared.any():
+                shared_indices.append(index.subset(is_shared))
+            del index
+        if shared_indices:
+            print("Collapsing %d peptides shared between groups" % len(shared_keys))
+            write(_merge_indices(shared_indices))
+        del all_keys
+        return counts[0], counts[1]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
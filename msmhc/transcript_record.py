@@ -0,0 +1,129 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+def transcript_exon_intervals(transcript):
+    """
+    Genomic (start, end) of each exon of a pyensembl Transcript or
+    TranscriptRecord in transcript order, None if it has no exons.
+    """
+    if isinstance(transcript, TranscriptRecord):
+        return transcript.exon_intervals
+    exons = getattr(transcript, "exons", None)
+    if exons is None:
+        return None
+    return tuple((int(exon.start), int(exon.end)) for exon in exons)
+
+
+def genomic_position(exon_intervals, strand, spliced_offset):
+    """
+    Genomic position of an offset into the spliced sequence of a
+    transcript, None if the offset is past its last exon.
+    """
+    for start, end in exon_intervals:
+        exon_length = end - start + 1
+        if spliced_offset < exon_length:
+            if strand == "-":
+                return end - spliced_offset
+            return start + spliced_offset
+        spliced_offset -= exon_length
+    return None
+
+
+class TranscriptRecord(object):
+    """
+    The fields of a pyensembl Transcript which msmhc uses, fetched once.
+    Stands in for the Transcript of a ReferenceSequence and in
+    alt_orf.generate_alt_reading_frames, and is cheap to send between
+    processes as a tuple.
+    """
+    __slots__ = [
+        "transcript_id",
+        "transcript_name",
+        "gene_id",
+        "gene_name",
+        "protein_sequence",
+        "sequence",
+        "start_codon_offset",
+        "coding_sequence_length",
+        "contig",
+        "strand",
+        "exon_intervals",
+    ]
+
+    def __init__(
+            self,
+            transcript_id,
+            transcript_name,
+            gene_id,
+            gene_name,
+            protein_sequence,
+            sequence,
+            start_codon_offset,
+            coding_sequence_length,
+            contig=None,
+            strand=None,
+            exon_intervals=None):
+        self.transcript_id = transcript_id
+        self.transcript_name = transcript_name
+        self.gene_id = gene_id
+        self.gene_name = gene_name
+        self.protein_sequence = protein_sequence
+        self.sequence = sequence
+        self.start_codon_offset = start_codon_offset
+        self.coding_sequence_length = coding_sequence_length
+        self.contig = contig
+        self.strand = strand
+        self.exon_intervals = exon_intervals
+
+    @classmethod
+    def from_transcript(cls, transcript):
+        """
+        Parameters
+        ----------
+        transcript : pyensembl.Transcript
+            Complete protein coding transcript
+        """
+        return cls(
+            transcript_id=transcript.transcript_id,
+            transcript_name=transcript.transcript_name,
+            gene_id=transcript.gene_id,
+            gene_name=transcript.gene_name,
+            protein_sequence=transcript.protein_sequence,
+            sequence=str(transcript.sequence),
+            start_codon_offset=min(transcript.start_codon_spliced_offsets),
+            coding_sequence_length=len(transcript.coding_sequence),
+            contig=transcript.contig,
+            strand=transcript.strand,
+            exon_intervals=transcript_exon_intervals(transcript))
+
+    def to_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, fields):
+        return cls(*fields)
+
+    @property
+    def start_codon_spliced_offsets(self):
+        start = self.start_codon_offset
+        return [start, start + 1, start + 2]
+
+    @property
+    def coding_sequence(self):
+        start = self.start_codon_offset
+        return self.sequence[start:start + self.coding_sequence_length]
+
+    def __repr__(self):
+        return "TranscriptRecord(transcript_id=%r, gene_name=%r)" % (
+            self.transcript_id,
+            self.gene_name)
@@ -0,0 +1,255 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Snapshot of the protein coding transcripts of a genome, a directory of
+flat arrays which can be memory-mapped instead of querying pyensembl:
+
+- sequences.bin and sequence_offsets.npy: cDNA of every transcript back
+  to back and where each one starts and ends
+- proteins.bin and protein_offsets.npy: the same for protein sequences
+- start_codon_offsets.npy, coding_sequence_lengths.npy: position and
+  length of the coding sequence within each cDNA
+- transcript_ids.npy, transcript_names.npy, gene_ids.npy, gene_names.npy,
+  contigs.npy, strands.npy: index of each transcript's names and location
+  in the string dictionary of strings.json
+- exon_offsets.npy, exon_starts.npy, exon_ends.npy: genomic intervals of
+  the exons of every transcript back to back, in transcript order
+- metadata.json: format version and the genome the snapshot came from
+
+Transcripts are stored in the order they were generated, so the
+transcripts of a gene are next to each other.
+"""
+
+from array import array
+from itertools import groupby
+import json
+import os
+
+import numpy as np
+
+from .transcript_record import TranscriptRecord
+
+SNAPSHOT_FORMAT_VERSION = 2
+
+_name_fields = [
+    "transcript_id",
+    "transcript_name",
+    "gene_id",
+    "gene_name",
+    "contig",
+    "strand",
+]
+
+_array_names = [
+    "sequence_offsets",
+    "protein_offsets",
+    "start_codon_offsets",
+    "coding_sequence_lengths",
+    "exon_offsets",
+    "exon_starts",
+    "exon_ends",
+] + [field + "s" for field in _name_fields]
+
+
+def _load_bytes(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def write_transcript_snapshot(records, path, genome=None):
+    """
+    Write transcript records to a new snapshot directory.
+
+    Parameters
+    ----------
+    records : iterable of TranscriptRecord
+
+    path : str
+
+    genome : pyensembl.Genome or None
+        Genome the records came from, its reference name and release are
+        kept so that a TranscriptSnapshot can stand in for it
+
+    Returns
+    -------
+    Number of transcripts written
+    """
+    os.makedirs(path)
+    sequence_lengths = array("q")
+    protein_lengths = array("q")
+    start_codon_offsets = array("q")
+    coding_sequence_lengths = array("q")
+    exon_counts = array("q")
+    exon_starts = array("q")
+    exon_ends = array("q")
+    strings = {}
+    name_ids = {field: array("i") for field in _name_fields}
+    with open(os.path.join(path, "sequences.bin"), "wb") as sequence_file, \
+            open(os.path.join(path, "proteins.bin"), "wb") as protein_file:
+        for record in records:
+            sequence = record.sequence.encode("ascii")
+            protein = record.protein_sequence.encode("ascii")
+            sequence_file.write(sequence)
+            protein_file.write(protein)
+            sequence_lengths.append(len(sequence))
+            protein_lengths.append(len(protein))
+            start_codon_offsets.append(record.start_codon_offset)
+            coding_sequence_lengths.append(record.coding_sequence_length)
+            exon_intervals = record.exon_intervals or ()
+            exon_counts.append(len(exon_intervals))
+            for exon_start, exon_end in exon_intervals:
+                exon_starts.append(exon_start)
+                exon_ends.append(exon_end)
+            for field in _name_fields:
+                name_ids[field].append(
+                    strings.setdefault(getattr(record, field), len(strings)))
+
+    def offsets_from_lengths(lengths):
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(lengths, dtype=np.int64), out=offsets[1:])
+        return offsets
+
+    arrays = {
+        "sequence_offsets": offsets_from_lengths(sequence_lengths),
+        "protein_offsets": offsets_from_lengths(protein_lengths),
+        "start_codon_offsets": np.frombuffer(start_codon_offsets, dtype=np.int64),
+        "coding_sequence_lengths": np.frombuffer(coding_sequence_lengths, dtype=np.int64),
+        "exon_offsets": offsets_from_lengths(exon_counts),
+        "exon_starts": np.frombuffer(exon_starts, dtype=np.int64),
+        "exon_ends": np.frombuffer(exon_ends, dtype=np.int64),
+    }
+    for field in _name_fields:
+        arrays[field + "s"] = np.frombuffer(name_ids[field], dtype=np.int32)
+    for array_name in _array_names:
+        np.save(os.path.join(path, array_name + ".npy"), arrays[array_name])
+    with open(os.path.join(path, "strings.json"), "w") as f:
+        json.dump(sorted(strings, key=strings.get), f)
+    metadata = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "n_transcripts": len(sequence_lengths),
+    }
+    if genome is not None:
+        species = getattr(genome, "species", None)
+        species = getattr(species, "latin_name", species)
+        release = getattr(genome, "release", None)
+        if release is None:
+            release = getattr(genome, "annotation_version", None)
+        metadata.update({
+            "reference_name": genome.reference_name,
+            "species": species,
+            "release": release,
+        })
+    with open(os.path.join(path, "metadata.json"), "w") as f:
+        json.dump(metadata, f)
+    return len(sequence_lengths)
+
+
+class TranscriptSnapshot(object):
+    """
+    Reader for a transcript snapshot written by write_transcript_snapshot.
+    Can be used in place of a pyensembl Genome as the source of reference
+    sequences in msmhc.main.
+    """
+    __slots__ = [
+        "path",
+        "sequences",
+        "proteins",
+        "strings",
+        "reference_name",
+        "species",
+        "release",
+    ] + _array_names
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        if metadata["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                "Transcript snapshot %s has format version %s, expected %d" % (
+                    path,
+                    metadata["format_version"],
+                    SNAPSHOT_FORMAT_VERSION))
+        self.reference_name = metadata.get("reference_name")
+        self.species = metadata.get("species")
+        self.release = metadata.get("release")
+        for array_name in _array_names:
+            setattr(
+                self,
+                array_name,
+                np.load(os.path.join(path, array_name + ".npy"), mmap_mode="r"))
+        self.sequences = _load_bytes(os.path.join(path, "sequences.bin"))
+        self.proteins = _load_bytes(os.path.join(path, "proteins.bin"))
+        with open(os.path.join(path, "strings.json")) as f:
+            self.strings = json.load(f)
+
+    def __len__(self):
+        return len(self.start_codon_offsets)
+
+    def __getitem__(self, i):
+        strings = self.strings
+        sequence_start, sequence_end = self.sequence_offsets[i:i + 2]
+        protein_start, protein_end = self.protein_offsets[i:i + 2]
+        exon_start, exon_end = self.exon_offsets[i:i + 2]
+        if exon_end > exon_start:
+            exon_intervals = tuple(zip(
+                self.exon_starts[exon_start:exon_end].tolist(),
+                self.exon_ends[exon_start:exon_end].tolist()))
+        else:
+            exon_intervals = None
+        return TranscriptRecord(
+            transcript_id=strings[self.transcript_ids[i]],
+            transcript_name=strings[self.transcript_names[i]],
+            gene_id=strings[self.gene_ids[i]],
+            gene_name=strings[self.gene_names[i]],
+            protein_sequence=self.proteins[protein_start:protein_end].tobytes().decode("ascii"),
+            sequence=self.sequences[sequence_start:sequence_end].tobytes().decode("ascii"),
+            start_codon_offset=int(self.start_codon_offsets[i]),
+            coding_sequence_length=int(self.coding_sequence_lengths[i]),
+            contig=strings[self.contigs[i]],
+            strand=strings[self.strands[i]],
+            exon_intervals=exon_intervals)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def transcript_records(self, gene_name=None):
+        """
+        All transcript records, or only those of genes with the given name.
+        """
+        if gene_name is None:
+            return list(self)
+        if gene_name not in self.strings:
+            return []
+        name_id = self.strings.index(gene_name)
+        return [self[i] for i in np.flatnonzero(self.gene_names == name_id)]
+
+    def transcript_records_by_gene(self, gene_name=None):
+        """
+        Pairs of gene ID and list of TranscriptRecord, one for each gene.
+        """
+        records = self.transcript_records(gene_name=gene_name)
+        for gene_id, gene_records in groupby(records, key=lambda r: r.gene_id):
+            yield gene_id, list(gene_records)
+
+    def __str__(self):
+        return "TranscriptSnapshot(path=%r, reference_name=%r, release=%r, n_transcripts=%d)" % (
+            self.path,
+            self.reference_name,
+            self.release,
+            len(self))
+
+    def __repr__(self):
+        return str(self)
@@ -70,7 +70,9 @@ if __name__ == '__main__':
         entry_points={
             'console_scripts': [
                 'msmhc-generate=msmhc.generate_cli:run',
-                'msmhc-fdr=msmhc.fdr_cli:run'
+                'msmhc-generate-batch=msmhc.batch_cli:run',
+                'msmhc-fdr=msmhc.fdr_cli:run',
+                'msmhc-snapshot=msmhc.snapshot_cli:run',
             ]
         }
     )
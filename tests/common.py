@@ -0,0 +1,101 @@
+"""
+Fixtures shared by several test modules.
+"""
+
+from random import Random
+
+from msmhc.sequence import Sequence
+
+
+class FakeExon(object):
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+class FakeTranscript(object):
+    def __init__(self, transcript_id, gene, sequence, start_codon_offset, exons):
+        self.transcript_id = transcript_id
+        self.transcript_name = transcript_id + "-name"
+        self.gene_id = gene.gene_id
+        self.gene_name = gene.gene_name
+        self.is_protein_coding = True
+        self.complete = True
+        self.sequence = sequence
+        self.start_codon_spliced_offsets = [
+            start_codon_offset, start_codon_offset + 1, start_codon_offset + 2]
+        self.coding_sequence = sequence[start_codon_offset:]
+        self.protein_sequence = "M" + sequence[start_codon_offset + 3:].replace("T", "")
+        self.contig = gene.contig
+        self.strand = "+"
+        self.exons = exons
+
+
+class FakeGene(object):
+    def __init__(self, gene_id, contig, rng):
+        self.gene_id = gene_id
+        self.gene_name = "name-" + gene_id
+        self.contig = contig
+        self.is_protein_coding = True
+        self.transcripts = []
+        # isoforms share their first exon and differ in the second
+        first_exon = "".join(rng.choice("ACGT") for _ in range(200))
+        for i in range(2):
+            sequence = first_exon + "".join(rng.choice("ACGT") for _ in range(100))
+            exons = [FakeExon(1000, 1199), FakeExon(2000 + 1000 * i, 2099 + 1000 * i)]
+            self.transcripts.append(
+                FakeTranscript("%s-T%d" % (gene_id, i), self, sequence, 50 + 3 * i, exons))
+
+
+class FakeGenome(object):
+    """
+    Stands in for a pyensembl Genome, defined at module level so that
+    worker processes can unpickle it.
+    """
+    reference_name = "FakeGenome"
+
+    def __init__(self, n_contigs=3, n_genes_per_contig=4):
+        rng = Random(0)
+        self.genes_by_contig = {
+            str(contig): [
+                FakeGene("G%d-%d" % (contig, i), str(contig), rng)
+                for i in range(n_genes_per_contig)
+            ]
+            for contig in range(n_contigs)
+        }
+
+    def contigs(self):
+        return sorted(self.genes_by_contig)
+
+    def genes(self, contig=None):
+        if contig is not None:
+            return self.genes_by_contig[contig]
+        return [g for c in self.contigs() for g in self.genes_by_contig[c]]
+
+
+class FakeProteinTranscript(object):
+    """
+    Transcript which only has the fields a ReferenceSequence is made from.
+    """
+    def __init__(self, transcript_id, gene_name, protein_sequence):
+        self.transcript_id = transcript_id
+        self.transcript_name = "%s-001" % gene_name
+        self.gene_id = "ENSG-%s" % gene_name
+        self.gene_name = gene_name
+        self.protein_sequence = protein_sequence
+
+
+def make_sequences():
+    """
+    Forty random sequences from three genes, with many shared peptides.
+    """
+    rng = Random(3)
+    sequences = []
+    for i in range(40):
+        amino_acids = "".join(
+            rng.choice("ACDEKLM") for _ in range(rng.randint(5, 80)))
+        sequences.append(Sequence(
+            name="seq-%d" % i,
+            amino_acids=amino_acids,
+            attributes={"gene_name": "gene%d" % (i % 3)}))
+    return sequences
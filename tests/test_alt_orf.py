@@ -0,0 +1,96 @@
+from random import Random
+
+from msmhc.alt_orf import (
+    DownstreamORF,
+    ThreeFrameTranslation,
+    UpstreamORF,
+    generate_alt_reading_frames,
+)
+from msmhc.genetic_code import translate_cdna
+from msmhc.reference_sequence import ReferenceSequence
+from nose.tools import eq_
+
+
+class FakeTranscript(object):
+    def __init__(self, sequence, start_codon_offset, coding_length):
+        self.transcript_id = "ENST1"
+        self.transcript_name = "A-001"
+        self.gene_id = "ENSG1"
+        self.gene_name = "A"
+        self.sequence = sequence
+        self.start_codon_spliced_offsets = [
+            start_codon_offset, start_codon_offset + 1, start_codon_offset + 2]
+        self.coding_sequence = sequence[start_codon_offset:start_codon_offset + coding_length]
+        self.protein_sequence = "M" * (coding_length // 3)
+
+
+def random_transcripts(n, seed=0):
+    rng = Random(seed)
+    transcripts = []
+    for _ in range(n):
+        length = rng.randint(50, 600)
+        # AT-rich so that there are plenty of start and stop codons
+        sequence = "".join(rng.choice("AATTGC") for _ in range(length))
+        start_codon_offset = rng.randint(0, length // 2)
+        coding_length = rng.randint(0, length - start_codon_offset)
+        transcripts.append(
+            FakeTranscript(sequence, start_codon_offset, coding_length))
+    return transcripts
+
+
+def test_three_frame_translation_matches_translate_cdna():
+    for transcript in random_transcripts(50):
+        cdna = transcript.sequence
+        translation = ThreeFrameTranslation(cdna)
+        for i in range(len(cdna) - 2):
+            if cdna[i:i + 3] == "ATG":
+                eq_(translation.translate_from(i),
+                    translate_cdna(cdna[i:], first_codon_is_start=True))
+
+
+def test_alt_reading_frames_are_suffix_translations():
+    n_orfs = 0
+    for transcript in random_transcripts(50, seed=1):
+        cdna = transcript.sequence
+        start_codon_offset = transcript.start_codon_spliced_offsets[0]
+        orfs = generate_alt_reading_frames(
+            ReferenceSequence(transcript),
+            min_peptide_length=3)
+        for orf in orfs:
+            i = start_codon_offset + int(orf.relative_start)
+            amino_acids, ends_with_stop_codon = translate_cdna(
+                cdna[i:], first_codon_is_start=True)
+            eq_(orf.amino_acids, amino_acids)
+            eq_(orf.ends_with_stop_codon, ends_with_stop_codon)
+            eq_(type(orf), UpstreamORF if i < start_codon_offset else DownstreamORF)
+            eq_(orf.sequence_before_start, cdna[max(0, i - 6):i])
+        n_orfs += len(orfs)
+    assert n_orfs > 0
+
+
+def test_near_cognate_start_codons():
+    transcript = FakeTranscript("ATGCTGAAACCCGGGTTTTAGCC" + "ATG" * 20, 23, 60)
+    orfs = generate_alt_reading_frames(
+        ReferenceSequence(transcript),
+        min_peptide_length=3,
+        search_end_offset=0,
+        start_codons=["CTG", "ATG"])
+    eq_([(orf.start_codon, orf.amino_acids, orf.relative_start) for orf in orfs],
+        [("CTG", "MKPGF", -20)])
+    eq_(generate_alt_reading_frames(
+        ReferenceSequence(transcript),
+        min_peptide_length=3,
+        search_end_offset=0), [])
+
+
+def test_min_translation_initiation_score():
+    for transcript in random_transcripts(20, seed=2):
+        orfs = generate_alt_reading_frames(
+            ReferenceSequence(transcript),
+            min_peptide_length=3)
+        strong_orfs = generate_alt_reading_frames(
+            ReferenceSequence(transcript),
+            min_peptide_length=3,
+            min_translation_initiation_score=0.9)
+        eq_([orf.fasta_string() for orf in strong_orfs],
+            [orf.fasta_string() for orf in orfs if orf.translation_initiation_score >= 0.9])
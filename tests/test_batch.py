@@ -0,0 +1,166 @@
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from msmhc.batch import generate_sample_databases
+from msmhc.collapsed_peptides import CollapsedPeptides
+from msmhc.main import generate_mutant_sequences
+from msmhc.reference_cache import (
+    load_or_build_reference_peptides,
+    reference_cache_path,
+    write_hits_with_reference_peptides,
+)
+from msmhc.transcript_record import TranscriptRecord
+from msmhc.transcript_snapshot import TranscriptSnapshot, write_transcript_snapshot
+from nose.tools import eq_
+
+from .common import FakeGenome
+
+
+class FakeGene(object):
+    def __init__(self, gene_id, gene_name):
+        self.gene_id = gene_id
+        self.gene_name = gene_name
+
+
+class FakeEffectTranscript(object):
+    def __init__(self, record):
+        self.transcript_id = record.transcript_id
+        self.transcript_name = record.transcript_name
+        self.gene = FakeGene(record.gene_id, record.gene_name)
+        self.protein_sequence = record.protein_sequence
+
+
+class FakeVariant(object):
+    def __init__(self, short_description):
+        self.short_description = short_description
+
+
+class FakeEffect(object):
+    """
+    Substitution of one residue, with the fields of a varcode effect which
+    msmhc.mutant_sequence uses.
+    """
+    modifies_protein_sequence = True
+
+    def __init__(self, record, position, residue):
+        self.transcript = FakeEffectTranscript(record)
+        self.aa_mutation_start_offset = position
+        self.short_description = "p.%s%d%s" % (
+            record.protein_sequence[position],
+            position + 1,
+            residue)
+        self.variant = FakeVariant("%s:%s" % (record.transcript_id, self.short_description))
+        self.mutant_protein_sequence = (
+            record.protein_sequence[:position] +
+            residue +
+            record.protein_sequence[position + 1:])
+
+
+class FakeEffects(object):
+    def __init__(self, effects):
+        self._effects = effects
+
+    def top_priority_effect_per_variant(self):
+        return {effect.variant: effect for effect in self._effects}
+
+
+class FakeVariants(object):
+    """
+    Stands in for a varcode.VariantCollection of substitutions.
+    """
+    def __init__(self, effects):
+        self._effects = effects
+
+    def __len__(self):
+        return len(self._effects)
+
+    def effects(self):
+        return FakeEffects(self._effects)
+
+
+def load_fake_variants(path, genome):
+    """
+    Substitutions in the transcripts of a TranscriptSnapshot, read from a
+    file with a transcript ID, residue position and new residue on each
+    line. Defined at module level so that worker processes can unpickle it.
+    """
+    records = {record.transcript_id: record for record in genome}
+    effects = []
+    with open(path) as f:
+        for line in f:
+            transcript_id, position, residue = line.split()
+            effects.append(FakeEffect(records[transcript_id], int(position), residue))
+    return FakeVariants(effects)
+
+
+def test_generate_sample_databases_from_transcript_snapshot():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = FakeGenome()
+        snapshot_path = os.path.join(directory, "snapshot")
+        write_transcript_snapshot(
+            [TranscriptRecord.from_transcript(t) for g in genome.genes() for t in g.transcripts],
+            snapshot_path,
+            genome=genome)
+        snapshot = TranscriptSnapshot(snapshot_path)
+        variants = {
+            "s1": "G0-0-T0\t3\tW\nG1-2-T1\t10\tW\n",
+            "s2": "G2-3-T0\t5\tC\n",
+            "s3": "",
+        }
+        samples = []
+        for sample in sorted(variants):
+            path = os.path.join(directory, "%s.txt" % sample)
+            with open(path, "w") as f:
+                f.write(variants[sample])
+            samples.append((sample, path))
+        options = dict(upstream_reading_frames=True, min_length=7, max_length=9)
+        cache_dir = os.path.join(directory, "cache")
+        load_or_build_reference_peptides(cache_dir, snapshot, **options)
+        reference_path = reference_cache_path(cache_dir, snapshot, **options)
+        output_dir = os.path.join(directory, "batch")
+        os.makedirs(output_dir)
+        results = generate_sample_databases(
+            samples,
+            reference_path,
+            output_dir,
+            snapshot,
+            load_fake_variants,
+            min_length=7,
+            max_length=9,
+            n_decoys_per_hit=2,
+            n_processes=2)
+        # every output was renamed into place
+        eq_(sorted(os.listdir(output_dir)), ["s1.fa", "s2.fa", "s3.fa"])
+
+        reference_peptides = CollapsedPeptides.load(reference_path)
+        n_hits_of_sample = {}
+        for sample, path in samples:
+            expected = StringIO()
+            n_hits, n_decoys = write_hits_with_reference_peptides(
+                reference_peptides,
+                generate_mutant_sequences(
+                    load_fake_variants(path, snapshot),
+                    max_peptide_length=9),
+                expected,
+                min_length=7,
+                max_length=9,
+                n_decoys_per_hit=2)
+            with open(os.path.join(output_dir, "%s.fa" % sample)) as f:
+                eq_(f.read(), expected.getvalue())
+            n_hits_of_sample[sample] = n_hits
+        eq_(sorted(results), [
+            (
+                sample,
+                len(load_fake_variants(path, snapshot)),
+                n_hits_of_sample[sample],
+                2 * n_hits_of_sample[sample],
+            )
+            for (sample, path) in samples
+        ])
+        # mutant peptides were merged into the reference peptides
+        assert n_hits_of_sample["s1"] > n_hits_of_sample["s2"] > n_hits_of_sample["s3"]
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import varcode  # noqa: F401
+except ImportError:
+    raise unittest.SkipTest("msmhc-generate-batch needs varcode")
+
+from msmhc import batch_cli, generate_cli
+from msmhc.transcript_record import TranscriptRecord
+from msmhc.transcript_snapshot import write_transcript_snapshot
+from nose.tools import eq_
+
+from .common import FakeGenome
+
+
+class FakeGRCh37(FakeGenome):
+    reference_name = "GRCh37"
+    release = 75
+    species = "homo_sapiens"
+
+
+VCF = """##fileformat=VCFv4.1
+##reference=GRCh37
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+"""
+
+MAF = "\t".join([
+    "Hugo_Symbol",
+    "NCBI_Build",
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Reference_Allele",
+    "Tumor_Seq_Allele1",
+    "Tumor_Seq_Allele2",
+    "Tumor_Sample_Barcode",
+]) + "\n"
+
+
+def test_batch_matches_generate_for_each_sample():
+    directory = tempfile.mkdtemp()
+    try:
+        genome = FakeGRCh37()
+        snapshot_path = os.path.join(directory, "snapshot")
+        write_transcript_snapshot(
+            [TranscriptRecord.from_transcript(t) for g in genome.genes() for t in g.transcripts],
+            snapshot_path,
+            genome=genome)
+        variant_files = {"s1": "s1.vcf", "s2": "variants/s2.maf"}
+        os.makedirs(os.path.join(directory, "variants"))
+        for filename, contents in [("s1.vcf", VCF), ("variants/s2.maf", MAF)]:
+            with open(os.path.join(directory, filename), "w") as f:
+                f.write(contents)
+        manifest_path = os.path.join(directory, "manifest.tsv")
+        with open(manifest_path, "w") as f:
+            f.write("# sample\tvariants\n")
+            for sample in sorted(variant_files):
+                # relative to the manifest's directory
+                f.write("%s\t%s\n" % (sample, variant_files[sample]))
+        options = [
+            "--transcript-snapshot", snapshot_path,
+            "--upstream-reading-frames",
+            "--min-peptide-length", "7",
+            "--max-peptide-length", "9",
+            "--num-decoys-per-hit", "2",
+        ]
+        output_dir = os.path.join(directory, "batch")
+        batch_cli.run(options + [
+            "--manifest", manifest_path,
+            "--output-dir", output_dir,
+            "--processes", "2",
+        ])
+        # every output was renamed into place
+        eq_(sorted(os.listdir(output_dir)), ["reference-cache", "s1.fa", "s2.fa"])
+
+        for sample, filename in sorted(variant_files.items()):
+            expected_path = os.path.join(directory, "%s-generate.fa" % sample)
+            variant_option = "--vcf" if filename.endswith(".vcf") else "--maf"
+            generate_cli.run(options + [
+                "--output", expected_path,
+                "--extract-peptides",
+                "--reference-cache-dir", os.path.join(directory, "generate-cache"),
+                "--genome", "GRCh37",
+                variant_option, os.path.join(directory, filename),
+            ])
+            with open(expected_path) as f:
+                expected = f.read()
+            with open(os.path.join(output_dir, "%s.fa" % sample)) as f:
+                eq_(f.read(), expected)
+    finally:
+        shutil.rmtree(directory)
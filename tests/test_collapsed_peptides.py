@@ -0,0 +1,125 @@
+from collections import Counter
+from io import StringIO
+import shutil
+import tempfile
+import os
+
+from msmhc.sequence import Sequence
+from msmhc.reference_sequence import ReferenceSequence
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.collapsed_peptides import CollapsedPeptides
+from msmhc.decoys import generate_decoys
+from msmhc.output import write_fasta_records
+from msmhc.reference_cache import write_hits_with_reference_peptides
+from nose.tools import eq_
+
+from .common import FakeProteinTranscript, make_sequences
+
+
+def make_reference_sequences():
+    return [
+        ReferenceSequence(FakeProteinTranscript("ENST1", "A", "SIINFEKLMMM")),
+        Sequence(name="other", amino_acids="MMSIINFEKLAA"),
+    ]
+
+
+def make_sample_sequences():
+    return [
+        Sequence(name="sample", amino_acids="SIINFEKLQQ", attributes={"gene_name": "A"}),
+        ReferenceSequence(FakeProteinTranscript("ENST2", "B", "QQSIINFEKL")),
+    ]
+
+
+def collapse(sequences):
+    return CollapsedPeptides.from_index(
+        PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=9))
+
+
+def fasta_strings(sequences):
+    return [s.fasta_string() for s in sequences]
+
+
+def test_merged_collapsed_peptides_match_collapse_of_all_sources():
+    reference = make_reference_sequences()
+    sample = make_sample_sequences()
+    merged = collapse(reference).merge(collapse(sample))
+    expected = collapse_peptide_sources(
+        PeptideSourceIndex.from_sequences(reference + sample, min_length=5, max_length=9))
+    eq_(fasta_strings(merged.iter_sequences()), fasta_strings(expected))
+
+
+def test_collapsed_peptides_save_and_load():
+    collapsed = collapse(make_reference_sequences())
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "reference")
+        collapsed.save(path)
+        eq_(sorted(f for f in os.listdir(path) if not f.endswith(".npy")),
+            ["attributes.json", "types.json"])
+        loaded = CollapsedPeptides.load(path)
+        eq_(fasta_strings(loaded.iter_sequences()), fasta_strings(collapsed.iter_sequences()))
+        sample = collapse(make_sample_sequences())
+        eq_(fasta_strings(loaded.merge(sample).iter_sequences()),
+            fasta_strings(collapsed.merge(sample).iter_sequences()))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_merged_chunks_match_merge():
+    sequences = make_sequences()
+    reference = collapse(sequences[:30] + make_reference_sequences())
+    sample = collapse(sequences[25:] + make_sample_sequences())
+    expected = fasta_strings(reference.merge(sample).iter_sequences())
+    for chunk_size in [1, 7, 100, 10 ** 6]:
+        chunks = list(reference.iter_merged(sample, chunk_size))
+        eq_(len(chunks[0]), min(chunk_size, len(expected)))
+        name_group_counts = Counter()
+        eq_(fasta_strings(
+                seq
+                for chunk in chunks
+                for seq in chunk.iter_sequences(name_group_counts)),
+            expected)
+
+
+def test_hits_with_reference_peptides_match_collapse_of_all_sources():
+    sequences = make_sequences()
+    reference = sequences[:30]
+    sample = sequences[25:]
+    hits = collapse_peptide_sources(
+        PeptideSourceIndex.from_sequences(reference + sample, min_length=5, max_length=9))
+    expected = StringIO()
+    write_fasta_records(hits, expected)
+    write_fasta_records(generate_decoys(hits, n_decoys=2 * len(hits)), expected)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "reference")
+        collapse(reference).save(path)
+        f = StringIO()
+        n_hits, n_decoys = write_hits_with_reference_peptides(
+            CollapsedPeptides.load(path),
+            sample,
+            f,
+            min_length=5,
+            max_length=9,
+            n_decoys_per_hit=2,
+            chunk_size=100)
+        eq_((n_hits, n_decoys), (len(hits), 2 * len(hits)))
+        eq_(f.getvalue(), expected.getvalue())
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_save_keeps_the_first_result_saved_to_a_path():
+    collapsed = collapse(make_reference_sequences())
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "reference")
+        eq_(collapsed.save(path), True)
+        # e.g. two processes which both built the same cache
+        eq_(collapse(make_sample_sequences()).save(path), False)
+        eq_(os.listdir(directory), ["reference"])
+        eq_(fasta_strings(CollapsedPeptides.load(path).iter_sequences()),
+            fasta_strings(collapsed.iter_sequences()))
+    finally:
+        shutil.rmtree(directory)
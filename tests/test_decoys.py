@@ -0,0 +1,90 @@
+from random import Random
+
+from msmhc.decoys import generate_decoys_avoiding_keys, generate_decoys_from_peptides
+from msmhc.packed_peptides import key_boundaries, lexsort_keys, pack_peptides
+from nose.tools import eq_
+
+
+def random_peptides(n, seed=0):
+    rng = Random(seed)
+    return [
+        "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(rng.randint(7, 15)))
+        for _ in range(n)
+    ]
+
+
+def test_decoys_are_deterministic_scrambles_of_hits():
+    peptides = random_peptides(500)
+    decoys = generate_decoys_from_peptides(peptides, n_decoys=1200, random_seed=3)
+    eq_(len(decoys), 1200)
+    decoy_peptides = [d.amino_acids for d in decoys]
+    eq_(len(set(decoy_peptides).intersection(peptides)), 0)
+    sorted_hits = {"".join(sorted(p)) for p in peptides}
+    for decoy in decoy_peptides:
+        assert "".join(sorted(decoy)) in sorted_hits
+    eq_(len(set(d.name for d in decoys)), 1200)
+    eq_([d.name for d in decoys], [d.name for d in decoys])
+    eq_(decoy_peptides,
+        [d.amino_acids for d in generate_decoys_from_peptides(
+            peptides, n_decoys=1200, random_seed=3)])
+    assert decoy_peptides != [
+        d.amino_acids for d in generate_decoys_from_peptides(
+            peptides, n_decoys=1200, random_seed=4)]
+
+
+def test_unscramblable_peptides():
+    # every shuffle of a repeated residue is the hit itself
+    eq_(len(generate_decoys_from_peptides(["AAAAAAA", "AAAAAAA"], n_decoys=4)), 0)
+    decoys = generate_decoys_from_peptides(["AAAAAAA", "SIINFEKL"], n_decoys=4)
+    eq_([sorted(d.amino_acids) for d in decoys], [sorted("SIINFEKL")] * 4)
+    eq_(len(generate_decoys_from_peptides([], n_decoys=4)), 0)
+
+
+def test_parallel_decoys_match_single_process():
+    peptides = random_peptides(300, seed=1)
+    serial = generate_decoys_from_peptides(
+        peptides, n_decoys=700, random_seed=5, chunk_size=64)
+    parallel = generate_decoys_from_peptides(
+        peptides, n_decoys=700, random_seed=5, chunk_size=64, n_processes=3)
+    eq_(len(serial), 700)
+    eq_([(d.name, d.amino_acids) for d in parallel],
+        [(d.name, d.amino_acids) for d in serial])
+    eq_(serial[0].name, "Decoy-1")
+    eq_(serial[-1].name, "Decoy-700")
+
+
+def test_reversed_decoys():
+    # the reversal of HGFEDCA is a hit, so it gets scrambled instead
+    peptides = ["SIINFEKL", "ACDEFGH", "HGFEDCA", "AAAAAAA"]
+    decoys = [d.amino_acids for d in generate_decoys_from_peptides(
+        peptides, strategy="reverse")]
+    # AAAAAAA can't be reversed or scrambled, so the last decoy is
+    # another scramble
+    eq_(len(decoys), 4)
+    assert "LKEFNIIS" in decoys[:3]
+    eq_(len(set(decoys).intersection(peptides)), 0)
+    eq_(sorted("".join(sorted(d)) for d in decoys[:3]),
+        sorted(["ACDEFGH", "ACDEFGH", "EFIIKLNS"]))
+    pseudo_decoys = [d.amino_acids for d in generate_decoys_from_peptides(
+        ["SIINFEKL", "AAAAAAA"], n_decoys=3, strategy="pseudo-reverse")]
+    eq_(pseudo_decoys[0], "KEFNIISL")
+    eq_(len(pseudo_decoys), 3)
+
+
+def test_reversed_decoys_avoiding_keys():
+    peptides = ["SIINFEKL", "ACDEFGH", "HGFEDCA"]
+    keys = pack_peptides(peptides)
+    keys = keys[lexsort_keys(keys)]
+    target_keys = keys[key_boundaries(keys)]
+    decoys = generate_decoys_avoiding_keys(
+        peptides,
+        target_keys,
+        n_decoys_per_peptide=2,
+        first_decoy_number=10,
+        strategy="pseudo-reverse")
+    decoy_peptides = [d.amino_acids for d in decoys]
+    # reversals first, then a second pass of scrambles
+    eq_(decoy_peptides[:3], ["KEFNIISL", "GFEDCAH", "CDEFGHA"])
+    eq_(len(decoy_peptides), 6)
+    eq_(len(set(decoy_peptides).intersection(peptides)), 0)
+    eq_([d.name for d in decoys], ["Decoy-%d" % i for i in range(10, 16)])
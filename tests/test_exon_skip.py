@@ -0,0 +1,110 @@
+from contextlib import redirect_stdout
+from io import StringIO
+from random import Random
+
+from msmhc.exon_skip import generate_exon_skip_sequences
+from msmhc.genetic_code import translate_cdna
+from msmhc.main import generate_protein_sequence_groups, generate_protein_sequences
+from msmhc.peptides import collapse_peptide_sources, extract_peptides
+from msmhc.reference_sequence import ReferenceSequence
+from msmhc.transcript_record import TranscriptRecord
+from nose.tools import eq_
+
+from .common import FakeGenome
+
+
+def random_transcript(rng, n_exons):
+    exon_lengths = [rng.randint(20, 80) for _ in range(n_exons)]
+    sequence = "".join(rng.choice("ACGT") for _ in range(sum(exon_lengths)))
+    start_codon_offset = rng.randint(0, exon_lengths[0] - 3)
+    sequence = sequence[:start_codon_offset] + "ATG" + sequence[start_codon_offset + 3:]
+    protein, ends_with_stop_codon = translate_cdna(
+        sequence[start_codon_offset:], first_codon_is_start=True)
+    coding_sequence_length = 3 * (len(protein) + ends_with_stop_codon)
+    exon_intervals = []
+    position = 1000
+    for exon_length in exon_lengths:
+        exon_intervals.append((position, position + exon_length - 1))
+        position += exon_length + 500
+    return TranscriptRecord(
+        transcript_id="T",
+        transcript_name="T-name",
+        gene_id="G",
+        gene_name="G-name",
+        protein_sequence=protein,
+        sequence=sequence,
+        start_codon_offset=start_codon_offset,
+        coding_sequence_length=coding_sequence_length,
+        contig="1",
+        strand="+",
+        exon_intervals=tuple(exon_intervals)), exon_lengths
+
+
+def kmers(protein, min_length, max_length):
+    return {
+        protein[i:i + k]
+        for k in range(min_length, max_length + 1)
+        for i in range(len(protein) - k + 1)
+    }
+
+
+def test_exon_skip_sequences_contain_all_new_peptides():
+    rng = Random(0)
+    n_sequences = 0
+    for _ in range(200):
+        transcript, exon_lengths = random_transcript(rng, rng.randint(3, 6))
+        reference_kmers = kmers(transcript.protein_sequence, 7, 12)
+        sequences = generate_exon_skip_sequences(
+            ReferenceSequence(transcript),
+            min_peptide_length=7,
+            max_peptide_length=12)
+        sequences_by_exon = {s.skipped_exon_number: s for s in sequences}
+        n_sequences += len(sequences)
+        exon_starts = [sum(exon_lengths[:i]) for i in range(len(exon_lengths))]
+        for exon_index in range(1, len(exon_lengths) - 1):
+            cdna = transcript.sequence
+            exon_start = exon_starts[exon_index]
+            skipped_cdna = cdna[:exon_start] + cdna[exon_start + exon_lengths[exon_index]:]
+            if exon_start < transcript.start_codon_offset + 3:
+                continue
+            protein, _ = translate_cdna(
+                skipped_cdna[transcript.start_codon_offset:], first_codon_is_start=True)
+            new_kmers = kmers(protein, 7, 12).difference(reference_kmers)
+            sequence = sequences_by_exon.get(exon_index + 1)
+            if sequence is None:
+                eq_(new_kmers, set())
+            else:
+                window_kmers = kmers(sequence.amino_acids, 7, 12)
+                eq_(new_kmers.difference(window_kmers), set())
+                eq_(window_kmers.difference(kmers(protein, 7, 12)), set())
+                eq_(sequence.amino_acids,
+                    protein[sequence.protein_start:sequence.protein_start + len(sequence.amino_acids)])
+    assert n_sequences > 0
+
+
+def test_skip_exons_option():
+    # transcripts of FakeGenome only have two exons, so there's no
+    # internal exon to skip
+    sequences = generate_protein_sequences(FakeGenome(), skip_exons=True)
+    eq_(len(sequences), 24)
+
+
+def test_skip_exons_one_gene_at_a_time():
+    output = StringIO()
+    with redirect_stdout(output):
+        groups = list(generate_protein_sequence_groups(FakeGenome(), skip_exons=True))
+    eq_(sum(len(sequences) for (_, sequences) in groups), 24)
+    # no progress is reported per gene
+    assert "skipped exon" not in output.getvalue()
+
+
+def test_exon_skip_peptides_shared_with_reference_are_collapsed():
+    transcript, _ = random_transcript(Random(1), 5)
+    reference = ReferenceSequence(transcript)
+    sequences = [reference] + generate_exon_skip_sequences(reference)
+    assert len(sequences) > 1
+    hits = collapse_peptide_sources(extract_peptides(sequences))
+    sources = {hit.amino_acids: hit.attributes["source"] for hit in hits}
+    for kmer in kmers(transcript.protein_sequence, 7, 20):
+        eq_(sources[kmer], {"reference"})
+    assert {"skipped-exon"} in sources.values()
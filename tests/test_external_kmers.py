@@ -0,0 +1,89 @@
+from io import StringIO
+import os
+from random import Random
+import shutil
+import tempfile
+
+from msmhc.sequence import Sequence
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.external_kmers import iter_external_peptide_index
+from msmhc.decoys import generate_decoys_from_peptides, iter_decoys_of_keys
+from msmhc.output import load_hit_keys, write_collapsed_hits, write_fasta_records
+from msmhc.packed_peptides import n_words_for_length
+from nose.tools import eq_
+
+
+def make_sequences():
+    rng = Random(2)
+    sequences = []
+    for i in range(40):
+        amino_acids = "".join(
+            rng.choice("ACDEK") for _ in range(rng.randint(5, 80)))
+        sequences.append(Sequence(name="seq-%d" % i, amino_acids=amino_acids))
+    return sequences
+
+
+def test_external_index_matches_in_memory_index():
+    sequences = make_sequences()
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=14)
+    # tiny budget so that there are many runs and many merged blocks
+    blocks = list(iter_external_peptide_index(
+        sequences,
+        memory_budget=20000,
+        min_length=5,
+        max_length=14))
+    assert len(blocks) > 1
+    eq_(
+        [(p, [s.name for s in sources]) for (p, sources) in index.items()],
+        [(p, [s.name for s in sources])
+         for block in blocks
+         for (p, sources) in block.items()])
+
+
+def test_external_fasta_matches_in_memory_fasta():
+    sequences = make_sequences()
+    in_memory = StringIO()
+    write_fasta_records(
+        collapse_peptide_sources(
+            PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=14)),
+        in_memory)
+    external = StringIO()
+    write_collapsed_hits(
+        iter_external_peptide_index(
+            sequences,
+            memory_budget=20000,
+            min_length=5,
+            max_length=14),
+        external)
+    eq_(external.getvalue(), in_memory.getvalue())
+
+
+def test_decoys_from_hit_key_file():
+    sequences = make_sequences()
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=14)
+    directory = tempfile.mkdtemp()
+    try:
+        key_path = os.path.join(directory, "hits.keys")
+        with open(key_path, "wb") as key_file:
+            n_hits = write_collapsed_hits(
+                iter_external_peptide_index(
+                    sequences,
+                    memory_budget=20000,
+                    min_length=5,
+                    max_length=14),
+                StringIO(),
+                key_file=key_file)
+        eq_(n_hits, len(index))
+        hit_keys = load_hit_keys(key_path, n_words_for_length(14))
+        decoys = [
+            (d.name, d.amino_acids)
+            for chunk in iter_decoys_of_keys(hit_keys, n_decoys=2 * n_hits, chunk_size=500)
+            for d in chunk
+        ]
+        expected = generate_decoys_from_peptides(
+            index.peptides(), n_decoys=2 * n_hits, chunk_size=500)
+        eq_(decoys, [(d.name, d.amino_acids) for d in expected])
+        del hit_keys
+    finally:
+        shutil.rmtree(directory)
@@ -9,4 +9,10 @@ def test_extract_peptides():
         "SIINFEKL",
         "SIINFEK",
         "IINFEKL"
-    })
\ No newline at end of file
+    })
+
+def test_sequences_without_attributes_dont_share_them():
+    a = Sequence(name="a", amino_acids="SIINFEKL")
+    b = Sequence(name="b", amino_acids="SIINFEKL")
+    a.base_attributes()["source"] = "reference"
+    eq_(b.base_attributes(), {})
@@ -0,0 +1,40 @@
+from random import Random
+
+from msmhc.genetic_code import (
+    codon_indices,
+    encode_cdna,
+    standard_genetic_code,
+    standard_genetic_code_with_extra_start_codons,
+    vertebrate_mitochondrial_genetic_code,
+)
+from nose.tools import eq_, assert_raises
+
+
+def random_cdna_sequences(n, seed=0):
+    rng = Random(seed)
+    return [
+        "".join(rng.choice("ACGT") for _ in range(rng.randint(0, 300)))
+        for _ in range(n)
+    ] + ["", "A", "AT", "ATG", "TAA", "ATGA"]
+
+
+def test_codon_indices():
+    eq_(codon_indices(encode_cdna("AAAACGTTTGNA")).tolist(), [0, 6, 63, 64])
+    eq_(codon_indices(encode_cdna("AAAACGTTTGNA"), frame=1).tolist(), [0, 27, 62])
+
+
+def test_translate_batch_matches_translate():
+    sequences = random_cdna_sequences(2000)
+    for genetic_code in [
+            standard_genetic_code_with_extra_start_codons,
+            vertebrate_mitochondrial_genetic_code]:
+        for first_codon_is_start in [False, True]:
+            eq_(genetic_code.translate_batch(sequences, first_codon_is_start),
+                [genetic_code.translate(s, first_codon_is_start) for s in sequences])
+
+
+def test_translate_batch_unknown_codon():
+    # codons after the stop codon aren't translated
+    eq_(standard_genetic_code.translate_batch(["ATGTAANNN"]), [("M", True)])
+    with assert_raises(KeyError):
+        standard_genetic_code.translate_batch(["ATGTAA", "ATGNAA"])
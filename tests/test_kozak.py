@@ -0,0 +1,24 @@
+from random import Random
+
+from msmhc.kozak import translation_initiation_score, translation_initiation_scores
+from nose.tools import eq_
+
+
+def test_scores_match_translation_initiation_score():
+    rng = Random(0)
+    for _ in range(200):
+        cdna = "".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 40)))
+        for length_before in [0, 3, 6]:
+            for length_after in [0, 3]:
+                scores = translation_initiation_scores(cdna, length_before, length_after)
+                eq_(len(scores), len(cdna))
+                for i in range(len(cdna) - 2):
+                    eq_(scores[i], translation_initiation_score(
+                        cdna[max(0, i - length_before):i],
+                        cdna[i:i + 3],
+                        cdna[i + 3:i + 3 + length_after]))
+
+
+def test_kozak_consensus_scores_highest():
+    scores = translation_initiation_scores("GCCACCATGGCG")
+    eq_(scores[6], 1.0)
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+
+from msmhc.main import generate_mutant_sequences
+from msmhc.mutant_sequence import MutantSequence
+from msmhc.protein_changes import changed_interval
+from nose.tools import eq_
+
+ORIGINAL_PROTEIN = "MSIINFEKLGGGGYYYYYYYYYYYAAAAAAAAAAAAAAAAAAAAAAAACCCCCCCCCDDDDDDDDDDE"
+
+
+class FakeVariant(object):
+    short_description = "chr1 g.1000A>T"
+
+
+class FakeGene(object):
+    gene_id = "ENSG1"
+    gene_name = "A"
+
+
+class FakeTranscript(object):
+    transcript_id = "ENST1"
+    transcript_name = "A-001"
+    gene = FakeGene()
+    protein_sequence = ORIGINAL_PROTEIN
+
+
+class FakeEffect(object):
+    transcript = FakeTranscript()
+    modifies_protein_sequence = True
+
+    def __init__(self, aa_mutation_start_offset, mutant_protein_sequence, variant=None):
+        self.variant = FakeVariant() if variant is None else variant
+        self.short_description = "p.X%dY" % aa_mutation_start_offset
+        self.aa_mutation_start_offset = aa_mutation_start_offset
+        self.mutant_protein_sequence = mutant_protein_sequence
+
+
+class FakeEffectCollection(object):
+    def __init__(self, effects):
+        self.effects = effects
+
+    def top_priority_effect(self):
+        return self.effects[0]
+
+    def top_priority_effect_per_variant(self):
+        return OrderedDict((e.variant, e) for e in self.effects)
+
+
+class FakeSubstitution(object):
+    """
+    Stands in for a varcode Variant whose top priority effect is a
+    substitution, defined at module level for worker processes.
+    """
+    def __init__(self, position):
+        self.position = position
+        self.short_description = "chr1 g.%dA>T" % (1000 + position)
+
+    def effects(self):
+        p = ORIGINAL_PROTEIN
+        residue = "W" if self.position % 2 else "R"
+        return FakeEffectCollection([
+            FakeEffect(self.position, p[:self.position] + residue + p[self.position + 1:], self)])
+
+
+class FakeVariantCollection(list):
+    def clone_with_new_elements(self, elements):
+        return FakeVariantCollection(elements)
+
+    def effects(self):
+        return FakeEffectCollection([
+            variant.effects().top_priority_effect() for variant in self])
+
+
+def kmers(protein, min_length, max_length):
+    return {
+        protein[i:i + k]
+        for k in range(min_length, max_length + 1)
+        for i in range(len(protein) - k + 1)
+    }
+
+
+def test_changed_interval():
+    eq_(changed_interval("MAXAA", "MAAAA"), (2, 3))
+    # insertion and deletion of a repeated residue
+    eq_(changed_interval("MAAAAA", "MAAAA"), (5, 6))
+    eq_(changed_interval("MAAA", "MAAAA"), (4, 4))
+    eq_(changed_interval("MAAAAKK", "MAAAA"), (5, 7))
+
+
+def test_mutant_sequence_keeps_peptides_overlapping_mutation():
+    p = ORIGINAL_PROTEIN
+    effects = [
+        # substitution, insertion, deletion, frameshift, stop loss, premature stop
+        FakeEffect(30, p[:30] + "W" + p[31:]),
+        FakeEffect(30, p[:30] + "WWW" + p[30:]),
+        FakeEffect(30, p[:30] + p[33:]),
+        FakeEffect(30, p[:30] + "RRRRRRRRRRRRRRRRRRRRRRRRRRRRRR"),
+        FakeEffect(len(p), p + "RRRR"),
+        FakeEffect(30, p[:30]),
+    ]
+    reference_kmers = kmers(p, 8, 11)
+    for effect in effects:
+        sequence = MutantSequence(effect, max_peptide_length=11)
+        full_sequence = MutantSequence(effect)
+        eq_(full_sequence.amino_acids, effect.mutant_protein_sequence)
+        eq_(sequence.name, full_sequence.name)
+        eq_(sequence.amino_acids,
+            effect.mutant_protein_sequence[
+                sequence.protein_start:sequence.protein_start + len(sequence.amino_acids)])
+        assert len(sequence.amino_acids) < len(full_sequence.amino_acids)
+        eq_(kmers(full_sequence.amino_acids, 8, 11).difference(reference_kmers),
+            kmers(sequence.amino_acids, 8, 11).difference(reference_kmers))
+
+
+def test_parallel_effect_prediction_matches_serial():
+    variants = FakeVariantCollection(FakeSubstitution(i) for i in range(1, 40))
+    serial = generate_mutant_sequences(variants, max_peptide_length=9)
+    parallel = generate_mutant_sequences(variants, max_peptide_length=9, n_processes=3)
+    eq_(len(serial), len(variants))
+    eq_([s.fasta_string() for s in parallel], [s.fasta_string() for s in serial])
@@ -1,8 +1,19 @@
+import numpy as np
+
 from msmhc.numerical_peptide_representation import (
+    LETTERS_PER_WORD,
+    amino_acids,
+    base,
     peptide_to_int,
     int_to_peptide,
+    peptide_length,
     drop_first_letter,
-    drop_last_letter
+    drop_last_letter,
+    peptides_to_ints,
+    ints_to_peptides,
+    peptide_lengths,
+    drop_first_letters,
+    drop_last_letters,
 )
 from nose.tools import eq_
 
@@ -26,3 +37,57 @@ def test_SIINFEKL_drop_multiple_letters():
 def test_RRR_round_trip():
     eq_(int_to_peptide(peptide_to_int("RRR")), "RRR")
 
+
+def test_single_letter_round_trip():
+    for aa in amino_acids:
+        eq_(int_to_peptide(peptide_to_int(aa)), aa)
+
+def test_peptide_length_is_exact():
+    for n in [1, 2, 13, 14, 15, 30]:
+        eq_(peptide_length(peptide_to_int("W" * n)), n)
+        eq_(peptide_length(peptide_to_int("R" * n)), n)
+
+
+def random_peptides(n, max_length=20, seed=0):
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, max_length + 1, size=n)
+    letters = np.frombuffer(amino_acids.encode("ascii"), dtype=np.uint8)
+    residues = letters[rng.randint(0, len(amino_acids), size=(n, max_length))]
+    text = residues.tobytes().decode("ascii")
+    return [
+        text[i * max_length:i * max_length + length]
+        for i, length in enumerate(lengths)
+    ]
+
+
+def test_batch_round_trip_million_peptides():
+    peptides = random_peptides(10 ** 6)
+    values = peptides_to_ints(peptides)
+    eq_(values.shape, (len(peptides), 2))
+    eq_(ints_to_peptides(values), peptides)
+    eq_(peptide_lengths(values).tolist(), [len(p) for p in peptides])
+
+
+def test_batch_single_word_round_trip():
+    peptides = random_peptides(10 ** 5, max_length=LETTERS_PER_WORD, seed=1)
+    values = peptides_to_ints(peptides)
+    eq_(values.shape, (len(peptides),))
+    eq_(ints_to_peptides(values), peptides)
+    eq_(values[:100].tolist(), [peptide_to_int(p) for p in peptides[:100]])
+
+
+def test_batch_matches_scalar_encoding():
+    peptides = random_peptides(1000, seed=2)
+    values = peptides_to_ints(peptides)
+    for (low, high), p in zip(values.tolist(), peptides):
+        eq_(low + high * base ** LETTERS_PER_WORD, peptide_to_int(p))
+
+
+def test_batch_drop_letters():
+    peptides = random_peptides(10 ** 5, seed=3)
+    values = peptides_to_ints(peptides)
+    for n in [1, 3, LETTERS_PER_WORD]:
+        eq_(ints_to_peptides(drop_first_letters(values, n)), [p[n:] for p in peptides])
+        eq_(
+            ints_to_peptides(drop_last_letters(values, n)),
+            [p[:max(len(p) - n, 0)] for p in peptides])
@@ -0,0 +1,75 @@
+from random import Random
+
+from msmhc.sequence import Sequence
+from msmhc.peptides import extract_peptides, extract_peptides_with_packed_encoding
+from msmhc.packed_peptides import (
+    _extract_packed_kmers_of_distinct_strings,
+    count_windows,
+    extract_packed_kmers,
+    lexsort_keys,
+    pack_peptides,
+    unpack_keys,
+)
+from nose.tools import eq_
+
+
+def random_protein(rng, length):
+    return "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(length))
+
+
+def test_pack_unpack_round_trip():
+    peptides = ["SIINFEKL", "A", "YYYYYYYYYYYYYYYYYYYY", "AXU*"]
+    eq_(unpack_keys(pack_peptides(peptides)), peptides)
+
+
+def test_packed_key_order_matches_string_order():
+    rng = Random(0)
+    peptides = [random_protein(rng, rng.randint(1, 20)) for _ in range(500)]
+    keys = pack_peptides(peptides)
+    sorted_peptides = [peptides[i] for i in lexsort_keys(keys)]
+    eq_(sorted_peptides, sorted(peptides))
+
+
+def test_packed_extraction_SIINFEKL():
+    seq = Sequence(name="test-seq", amino_acids="SIINFEKL")
+    peptide_dict = extract_peptides_with_packed_encoding(
+        [seq], min_length=7, max_length=8)
+    eq_(list(peptide_dict.keys()), ["IINFEKL", "SIINFEK", "SIINFEKL"])
+
+
+def test_packed_extraction_matches_python_extraction():
+    rng = Random(1)
+    # repeat some proteins so that peptides have multiple sources
+    proteins = [random_protein(rng, rng.randint(3, 60)) for _ in range(30)]
+    proteins += proteins[:5] + ["AAAAAAAAAAAA", "AAAAAAAAAAAA"]
+    sequences = [
+        Sequence(name="seq-%d" % i, amino_acids=aa)
+        for (i, aa) in enumerate(proteins)
+    ]
+    expected = extract_peptides(sequences, min_length=4, max_length=14)
+    result = extract_peptides_with_packed_encoding(
+        sequences, min_length=4, max_length=14)
+    eq_(set(result.keys()), set(expected.keys()))
+    for peptide, sources in expected.items():
+        eq_([s.name for s in result[peptide]], [s.name for s in sources])
+    eq_(list(result.keys()), sorted(result.keys()))
+
+
+def test_identical_sequences_are_scanned_once():
+    rng = Random(2)
+    proteins = [random_protein(rng, rng.randint(3, 40)) for _ in range(20)]
+    # duplicates interleaved with distinct proteins and sharing peptides
+    proteins = [rng.choice(proteins) for _ in range(60)] + [proteins[0][1:]]
+    keys, offsets, source_ids = extract_packed_kmers(
+        proteins, min_length=3, max_length=8)
+    expected_keys, expected_offsets, expected_source_ids = \
+        _extract_packed_kmers_of_distinct_strings(
+            proteins, min_length=3, max_length=8, prefix_range=None)
+    eq_(keys.tolist(), expected_keys.tolist())
+    eq_(offsets.tolist(), expected_offsets.tolist())
+    eq_(source_ids.tolist(), expected_source_ids.tolist())
+    eq_(source_ids.dtype, expected_source_ids.dtype)
+
+
+def test_count_windows():
+    eq_(count_windows([8, 2, 7], 7, 8), 2 + 0 + 1 + 1)
@@ -0,0 +1,80 @@
+from io import StringIO
+import os
+import shutil
+import tempfile
+
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.decoys import generate_decoys
+from msmhc.output import RecordWriter, write_fasta_records
+from msmhc.sequence import Sequence
+from msmhc.peptide_database import (
+    PeptideDatabase,
+    PeptideDatabaseWriter,
+    iter_fasta_records,
+    write_peptide_database,
+)
+from nose.tools import eq_
+
+from .common import make_sequences
+
+
+def make_records():
+    hits = collapse_peptide_sources(
+        PeptideSourceIndex.from_sequences(make_sequences(), min_length=5, max_length=9))
+    return hits + list(generate_decoys(hits, n_decoys=len(hits)))
+
+
+def fasta_string(sequences):
+    f = StringIO()
+    write_fasta_records(sequences, f)
+    return f.getvalue()
+
+
+def test_peptide_database_round_trip():
+    records = make_records()
+    expected_fasta = fasta_string(records)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "db")
+        eq_(write_peptide_database(records, path), len(records))
+        db = PeptideDatabase(path)
+        eq_(len(db), len(records))
+        exported = StringIO()
+        db.write_fasta(exported)
+        eq_(exported.getvalue(), expected_fasta)
+
+        hit = records[10]
+        eq_([seq.name for seq in db.lookup(hit.amino_acids)], [hit.name])
+        eq_({db.values[i] for i in db.source_ids(10, "gene_name")},
+            hit.base_attributes()["gene_name"])
+        eq_(len(db.source_ids(10, "no_such_field")), 0)
+        eq_(db.lookup("WWWWW"), [])
+
+        from_fasta_path = os.path.join(directory, "from-fasta")
+        write_peptide_database(
+            iter_fasta_records(StringIO(expected_fasta)),
+            from_fasta_path)
+        eq_(fasta_string(PeptideDatabase(from_fasta_path)), expected_fasta)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_record_writer_keeps_values_which_look_like_fields():
+    # e.g. a variant description containing " word=", which can't be told
+    # apart from the next field once it's been written to a FASTA header
+    record = Sequence(
+        name="Variant-1",
+        amino_acids="SIINFEKL",
+        attributes={"variant": {"chr1 g.100A>T note=x"}})
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "db")
+        fasta = StringIO()
+        with RecordWriter(fasta, PeptideDatabaseWriter(path)) as output:
+            write_fasta_records([record], output)
+            eq_(fasta.getvalue(), fasta_string([record]))
+        eq_(PeptideDatabase(path)[0].base_attributes(),
+            {"variant": {"chr1 g.100A>T note=x"}})
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,65 @@
+from msmhc.sequence import Sequence
+from msmhc.reference_sequence import ReferenceSequence
+from msmhc.peptides import (
+    collapse_peptide_sources,
+    extract_peptides,
+    keep_max_priority_sequences,
+)
+from msmhc.peptide_source_index import PeptideSourceIndex
+from nose.tools import eq_
+
+from .common import FakeProteinTranscript
+
+
+def make_sequences():
+    return [
+        ReferenceSequence(FakeProteinTranscript("ENST1", "A", "SIINFEKLMMM")),
+        Sequence(name="other", amino_acids="MMSIINFEKL"),
+        ReferenceSequence(FakeProteinTranscript("ENST2", "B", "QQSIINFEKLQ")),
+    ]
+
+
+def test_index_lookup():
+    sequences = make_sequences()
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=8, max_length=8)
+    eq_(index.sources_of("SIINFEKL"), sequences)
+    eq_(index.sources_of("MMSIINFE"), [sequences[1]])
+    eq_(index.sources_of("AAAAAAAA"), [])
+    eq_(list(index.find(["SIINFEKL", "SIINFEKLQ", "W"]) >= 0), [True, False, False])
+
+
+def test_index_keep_max_priority():
+    sequences = make_sequences()
+    index = keep_max_priority_sequences(
+        PeptideSourceIndex.from_sequences(sequences, min_length=8, max_length=8))
+    eq_(index.sources_of("SIINFEKL"), [sequences[0], sequences[2]])
+    eq_(index.sources_of("MMSIINFE"), [sequences[1]])
+
+
+def test_collapse_index_matches_collapse_dict():
+    sequences = make_sequences()
+    peptide_dict = extract_peptides(sequences, min_length=7, max_length=9)
+    sorted_dict = {k: peptide_dict[k] for k in sorted(peptide_dict)}
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=7, max_length=9)
+    eq_(
+        [s.fasta_string() for s in collapse_peptide_sources(index)],
+        [s.fasta_string() for s in collapse_peptide_sources(sorted_dict)])
+
+
+def test_full_sequence_index():
+    sequences = make_sequences() + [Sequence(name="copy", amino_acids="MMSIINFEKL")]
+    index = PeptideSourceIndex.from_full_sequences(sequences)
+    eq_(len(index), 3)
+    eq_(index.sources_of("MMSIINFEKL"), [sequences[1], sequences[3]])
+
+
+def test_collapse_shares_attributes_of_same_sources():
+    sequences = make_sequences()
+    hits = {
+        seq.amino_acids: seq
+        for seq in collapse_peptide_sources(
+            PeptideSourceIndex.from_sequences(sequences, min_length=8, max_length=9))
+    }
+    # both peptides come only from gene A's reference transcript
+    assert hits["INFEKLMM"].attributes["gene_name"] is hits["IINFEKLMM"].attributes["gene_name"]
+    eq_(hits["SIINFEKL"].attributes["gene_name"], {"A", "B"})
@@ -0,0 +1,58 @@
+from io import StringIO
+import shutil
+import tempfile
+
+from msmhc.alt_orf import START_CODONS
+from msmhc.decoys import generate_decoys
+from msmhc.main import generate_protein_sequences
+from msmhc.output import write_fasta_records
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.reference_cache import (
+    load_or_build_reference_peptides,
+    write_hits_with_reference_peptides,
+)
+from nose.tools import eq_
+
+from .common import FakeGenome, make_sequences
+
+
+def test_cached_reference_peptides_give_same_fasta():
+    genome = FakeGenome(n_contigs=3, n_genes_per_contig=6)
+    # every alternative start codon, so that some peptides come from
+    # reading frames whose different scores print the same
+    source_options = dict(
+        upstream_reading_frames=True,
+        downstream_reading_frames=True,
+        start_codons=START_CODONS)
+    mutant_sequences = make_sequences()
+    sequences = generate_protein_sequences(
+        genome,
+        min_peptide_length=7,
+        **source_options) + mutant_sequences
+    hits = collapse_peptide_sources(
+        PeptideSourceIndex.from_sequences(sequences, min_length=7, max_length=11))
+    expected = StringIO()
+    write_fasta_records(hits, expected)
+    write_fasta_records(generate_decoys(hits, n_decoys=len(hits)), expected)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # the first run builds the cache and the second loads it
+        for _ in range(2):
+            reference_peptides = load_or_build_reference_peptides(
+                cache_dir,
+                genome,
+                min_length=7,
+                max_length=11,
+                **source_options)
+            f = StringIO()
+            write_hits_with_reference_peptides(
+                reference_peptides,
+                mutant_sequences,
+                f,
+                min_length=7,
+                max_length=11)
+            eq_(f.getvalue(), expected.getvalue())
+    finally:
+        shutil.rmtree(cache_dir)
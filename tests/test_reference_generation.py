@@ -0,0 +1,60 @@
+
+from msmhc.alt_orf import START_CODONS, ReadingFrameMemo, generate_alt_reading_frames
+from msmhc.main import generate_protein_sequences, generate_reference_sequences
+from msmhc.transcript_record import TranscriptRecord, genomic_position
+from nose.tools import eq_
+
+from .common import FakeGenome
+
+
+def test_transcript_record_round_trip():
+    genome = FakeGenome(n_contigs=1, n_genes_per_contig=1)
+    transcript = genome.genes()[0].transcripts[1]
+    record = TranscriptRecord.from_tuple(
+        TranscriptRecord.from_transcript(transcript).to_tuple())
+    eq_(record.start_codon_spliced_offsets, transcript.start_codon_spliced_offsets)
+    eq_(record.coding_sequence, transcript.coding_sequence)
+    eq_(record.protein_sequence, transcript.protein_sequence)
+
+
+def test_parallel_generation_matches_serial():
+    genome = FakeGenome()
+    kwargs = dict(
+        upstream_reading_frames=True,
+        downstream_reading_frames=True,
+        min_peptide_length=3)
+    serial = generate_protein_sequences(genome, **kwargs)
+    parallel = generate_protein_sequences(genome, n_processes=2, **kwargs)
+    eq_(len(serial), len(parallel))
+    eq_([s.fasta_string() for s in serial], [s.fasta_string() for s in parallel])
+
+
+def test_isoforms_share_reading_frame_translations():
+    genome = FakeGenome()
+    sequences = generate_reference_sequences(genome)
+    memo = ReadingFrameMemo()
+    orfs = [
+        orf
+        for sequence in sequences
+        for orf in generate_alt_reading_frames(
+            sequence,
+            min_peptide_length=3,
+            start_codons=START_CODONS,
+            memo=memo)
+    ]
+    assert memo.n_reused > 0
+    eq_([orf.fasta_string() for orf in orfs],
+        [orf.fasta_string()
+         for sequence in sequences
+         for orf in generate_alt_reading_frames(
+             sequence,
+             min_peptide_length=3,
+             start_codons=START_CODONS)])
+
+
+def test_genomic_position():
+    exon_intervals = [(100, 109), (200, 204)]
+    eq_([genomic_position(exon_intervals, "+", i) for i in (0, 9, 10, 14, 15)],
+        [100, 109, 200, 204, None])
+    eq_([genomic_position(exon_intervals, "-", i) for i in (0, 9, 10, 14)],
+        [109, 100, 204, 200])
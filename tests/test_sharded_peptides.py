@@ -0,0 +1,67 @@
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from msmhc.sequence import Sequence
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.output import RecordWriter, write_fasta_records
+from msmhc.peptide_database import PeptideDatabase, PeptideDatabaseWriter
+from msmhc.sharded_peptides import write_sharded_hits
+from nose.tools import eq_
+
+from .common import make_sequences
+
+
+def check_sharded_fasta_matches_single_process(memory_budget):
+    sequences = make_sequences()
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=14)
+    expected = StringIO()
+    write_fasta_records(collapse_peptide_sources(index), expected)
+    sharded = StringIO()
+    key_file = BytesIO()
+    n_hits = write_sharded_hits(
+        sequences,
+        sharded,
+        n_processes=3,
+        min_length=5,
+        max_length=14,
+        memory_budget=memory_budget,
+        key_file=key_file)
+    eq_(sharded.getvalue(), expected.getvalue())
+    eq_(n_hits, len(index))
+    eq_(key_file.getvalue(), np.ascontiguousarray(index.keys).tobytes())
+
+
+def test_sharded_fasta_matches_single_process():
+    check_sharded_fasta_matches_single_process(memory_budget=None)
+
+
+def test_sharded_fasta_with_memory_budget_matches_single_process():
+    check_sharded_fasta_matches_single_process(memory_budget=60000)
+
+
+def test_sharded_database_matches_single_process():
+    sequences = make_sequences()
+    index = PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=14)
+    expected = StringIO()
+    write_fasta_records(collapse_peptide_sources(index), expected)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "db")
+        with RecordWriter(database_writer=PeptideDatabaseWriter(path)) as output:
+            n_hits = write_sharded_hits(
+                sequences,
+                output,
+                n_processes=3,
+                min_length=5,
+                max_length=14)
+        eq_(n_hits, len(index))
+        exported = StringIO()
+        PeptideDatabase(path).write_fasta(exported)
+        eq_(exported.getvalue(), expected.getvalue())
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,104 @@
+from io import StringIO
+from random import Random
+
+from msmhc.sequence import Sequence
+from msmhc.peptides import collapse_peptide_sources
+from msmhc.peptide_source_index import PeptideSourceIndex
+from msmhc.streaming import write_streaming_hits_and_decoys
+from nose.tools import eq_
+
+
+def make_sequence_groups():
+    rng = Random(5)
+    groups = []
+    for i in range(6):
+        sequences = []
+        for j in range(4):
+            amino_acids = "".join(
+                rng.choice("ACDEK") for _ in range(rng.randint(5, 40)))
+            sequences.append(Sequence(
+                name="seq-%d-%d" % (i, j),
+                amino_acids=amino_acids,
+                attributes={"gene_name": "gene%d" % i}))
+        groups.append(("gene%d" % i, sequences))
+    return groups
+
+
+def test_streaming_hits_match_collapse_of_all_sources():
+    groups = make_sequence_groups()
+    sequences = [s for _, group in groups for s in group]
+    expected = {
+        seq.amino_acids: seq
+        for seq in collapse_peptide_sources(
+            PeptideSourceIndex.from_sequences(sequences, min_length=5, max_length=9))
+    }
+    generated = []
+
+    def generate_groups():
+        for group in groups:
+            generated.append(group[0])
+            yield group
+
+    f = StringIO()
+    n_hits, n_decoys = write_streaming_hits_and_decoys(
+        generate_groups(),
+        f,
+        min_length=5,
+        max_length=9,
+        memory_budget=2000)
+    records = f.getvalue().split(">")[1:]
+    hit_records = [r for r in records if not r.startswith("Decoy")]
+    decoy_records = [r for r in records if r.startswith("Decoy")]
+    # sources are generated once and read back for the second pass
+    eq_(generated, [name for (name, _) in groups])
+    eq_(n_hits, len(expected))
+    eq_(len(hit_records), n_hits)
+    eq_(len(decoy_records), n_decoys)
+    for record in hit_records:
+        header, amino_acids = record.strip().split("\n")
+        eq_(header.split(" ", 1)[1], expected[amino_acids].attribute_string())
+    for record in decoy_records:
+        amino_acids = record.strip().split("\n")[1]
+        assert amino_acids not in expected
+
+
+def test_streaming_decoys():
+    groups = make_sequence_groups()
+
+    def write(**kwargs):
+        f = StringIO()
+        counts = write_streaming_hits_and_decoys(
+            iter(groups),
+            f,
+            min_length=5,
+            max_length=9,
+            memory_budget=2000,
+            n_decoys_per_hit=2,
+            **kwargs)
+        return counts, f.getvalue()
+
+    (n_hits, n_decoys), fasta = write(random_seed=1)
+    # decoy names don't depend on earlier calls either
+    eq_(write(random_seed=1), ((n_hits, n_decoys), fasta))
+    assert write(random_seed=2)[1] != fasta
+    records = [r.strip().split("\n") for r in fasta.split(">")[1:]]
+    hits = {amino_acids for (header, amino_acids) in records if not header.startswith("Decoy")}
+    decoys = [(header.split(" ")[0], amino_acids)
+              for (header, amino_acids) in records if header.startswith("Decoy")]
+    eq_(len(hits), n_hits)
+    eq_(len(decoys), n_decoys)
+    eq_(n_decoys, 2 * n_hits)
+    eq_([name for (name, _) in decoys], ["Decoy-%d" % i for i in range(1, n_decoys + 1)])
+    sorted_hits = {"".join(sorted(p)) for p in hits}
+    for _, amino_acids in decoys:
+        assert amino_acids not in hits
+        assert "".join(sorted(amino_acids)) in sorted_hits
+
+    (_, n_reversed), reversed_fasta = write(decoy_strategy="reverse")
+    eq_(n_reversed, n_decoys)
+    reversed_decoys = {
+        amino_acids for (header, amino_acids) in
+        (r.strip().split("\n") for r in reversed_fasta.split(">")[1:])
+        if header.startswith("Decoy")
+    }
+    assert len({p[::-1] for p in hits if p[::-1] not in hits} - reversed_decoys) == 0
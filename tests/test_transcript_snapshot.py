@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+
+from msmhc.main import generate_protein_sequences, generate_reference_sequences
+from msmhc.transcript_record import TranscriptRecord
+from msmhc.transcript_snapshot import TranscriptSnapshot, write_transcript_snapshot
+from nose.tools import eq_
+
+from .common import FakeGenome
+
+
+def test_snapshot_round_trip():
+    genome = FakeGenome()
+    records = [TranscriptRecord.from_transcript(t) for g in genome.genes() for t in g.transcripts]
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "snapshot")
+        eq_(write_transcript_snapshot(records, path), len(records))
+        snapshot = TranscriptSnapshot(path)
+        eq_(len(snapshot), len(records))
+        eq_([r.to_tuple() for r in snapshot], [r.to_tuple() for r in records])
+        eq_([r.transcript_id for r in snapshot.transcript_records(gene_name="name-G1-2")],
+            ["G1-2-T0", "G1-2-T1"])
+        eq_(len(list(snapshot.transcript_records_by_gene())), len(genome.genes()))
+
+        # reference sequences and reading frames are the same as from the genome
+        kwargs = dict(
+            upstream_reading_frames=True,
+            downstream_reading_frames=True,
+            min_peptide_length=3)
+        eq_([s.fasta_string() for s in generate_protein_sequences(snapshot, **kwargs)],
+            [s.fasta_string() for s in generate_protein_sequences(genome, **kwargs)])
+        eq_(len(generate_reference_sequences(snapshot, "name-G0-0")), 2)
+    finally:
+        shutil.rmtree(directory)